@@ -15,7 +15,7 @@ with open(path.join(this_directory, "README.md"), encoding="utf-8") as f:
 setup(
       name = "superviolin",
       py_modules = ["plot_cli", "plot"],      
-      version = "1.0.6",
+      version = "1.1.0",
       url = "",
       description = "Python CLI to make Violin SuperPlots",
       long_description = long_description,
@@ -28,26 +28,26 @@ setup(
       entry_points = {
                       "console_scripts": ["superviolin=superviolin.plot_cli:cli"]
                       },
-      python_requires = ">=3.6.2",
+      python_requires = ">=3.8",
       install_requires = [
           "appdirs",
           "click",
           "matplotlib",
           "numpy",
-          "pandas",
+          "pandas>=1.5",
           "scipy",
           "xlrd",
-          "openpyxl",
-          "scikit-posthocs"
+          "openpyxl"
           ],
+      extras_require = {
+          "columnar": ["pyarrow"]
+          },
       package_data = {"" : ["demo_data.csv",
                             "args.txt",
                             "demo_args.txt",
                             "test.pkl"]
                       },
       classifiers = [
-          "Programming Language :: Python :: 3.6",
-          "Programming Language :: Python :: 3.7",
           "Programming Language :: Python :: 3.8",
           "Programming Language :: Python :: 3.9",
           "License :: OSI Approved :: MIT License",
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Headless rendering of many Violin SuperPlots, optionally spread over a
+process pool, with a report of the time taken and errors of each plot
+
+@author: Martin Kenny
+"""
+
+import io
+import os
+import json
+import time
+import contextlib
+
+from superviolin.parallel import map_jobs
+from superviolin.readers import EXTENSIONS
+
+# file extensions picked up when rendering every dataset in a directory
+DATA_EXTENSIONS = tuple(EXTENSIONS) + (".xlsx", ".xls")
+
+def find_datasets(data_dir):
+    """
+    List the data files in a directory that can be used to generate
+    Violin SuperPlots
+
+    Parameters
+    ----------
+    data_dir : string
+        Directory containing CSV, Excel, Parquet, Feather or Arrow files
+
+    Returns
+    -------
+    list of strings
+        Sorted paths of the data files
+
+    """
+    files = []
+    for name in sorted(os.listdir(data_dir)):
+        path = os.path.join(data_dir, name)
+        if os.path.isfile(path) and name.lower().endswith(DATA_EXTENSIONS):
+            files.append(path)
+    return files
+
+def job_names(filenames):
+    """
+    Name each job after its data file, adding a number to repeated names so
+    outputs of different jobs never overwrite each other
+
+    Parameters
+    ----------
+    filenames : list of strings
+        Data file of each job
+
+    Returns
+    -------
+    names : list of strings
+        Unique name of each job
+
+    """
+    names = []
+    seen = {}
+    for filename in filenames:
+        name = os.path.splitext(os.path.basename(filename))[0] or "superviolin"
+        seen[name] = seen.get(name, 0) + 1
+        if seen[name] > 1:
+            name = f"{name}_{seen[name]}"
+        names.append(name)
+    return names
+
+def render_job(name, args, out_dir, formats):
+    """
+    Generate a Violin SuperPlot on a standalone Agg figure and save it in
+    each format. Statistics are returned rather than written to the current
+    directory, and posthoc tables are saved next to the figures.
+
+    Parameters
+    ----------
+    name : string
+        Name of the job, used for the output filenames
+    args : dictionary
+        Arguments for instantiating a Superviolin object
+    out_dir : string
+        Directory to save the outputs in
+    formats : list of strings
+        File extensions to save the figure as, e.g. ["png", "svg"]
+
+    Returns
+    -------
+    dictionary
+        Name, status, time taken in seconds, output paths, statistics,
+        errors and printed output of the job
+
+    """
+    # imported here so listing datasets does not load matplotlib
+    from superviolin.plot import Superviolin
+    from superviolin.stats import json_number
+    
+    start = time.perf_counter()
+    result = {"name" : name, "filename" : args.get("filename", ""),
+              "status" : "ok", "outputs" : [], "errors" : []}
+    log = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(log):
+            violin = Superviolin(**dict(args, return_stats=True))
+            if violin.errors:
+                result["status"] = "failed"
+                result["errors"] = list(violin.errors)
+            else:
+                fig, ax = violin.make_figure()
+                p, info = violin.generate_plot(ax=ax)
+                for fmt in formats:
+                    path = os.path.join(out_dir, f"{name}.{fmt}")
+                    violin.savefig(path, format=fmt)
+                    result["outputs"].append(path)
+                if hasattr(info, "to_csv"):
+                    path = os.path.join(out_dir, f"{name}_posthoc.txt")
+                    info.to_csv(path, sep="\t")
+                    result["outputs"].append(path)
+                result["p_value"] = (p if isinstance(p, str)
+                                     else json_number(p))
+    except Exception as e:
+        result["status"] = "failed"
+        result["errors"].append(f"{type(e).__name__}: {e}")
+    result["seconds"] = time.perf_counter() - start
+    result["log"] = log.getvalue()
+    return result
+
+def run_batch(jobs, out_dir, formats=("png",), n_jobs=1, report=None):
+    """
+    Render every job and write a JSON report of the results
+
+    Parameters
+    ----------
+    jobs : list of tuples
+        Name and Superviolin arguments of each job
+    out_dir : string
+        Directory to save the outputs in. Created if it does not exist
+    formats : list of strings, optional
+        File extensions to save each figure as. The default is ("png",).
+    n_jobs : integer, optional
+        Number of worker processes. Values below 1 use every CPU core.
+        The default is 1.
+    report : string, optional
+        Path of the JSON report. The default None saves batch_report.json
+        in out_dir.
+
+    Returns
+    -------
+    dictionary
+        Summary of the batch and the result of each job
+
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    formats = list(formats)
+
+    # the jobs already fill the pool, so each plot fits its kdes serially
+    if n_jobs != 1:
+        jobs = [(name, dict(args, n_jobs=1)) for name, args in jobs]
+    start = time.perf_counter()
+    results = map_jobs(render_job,
+                       [(name, args, out_dir, formats) for name, args in jobs],
+                       n_jobs)
+    summary = {
+        "out_dir" : os.path.abspath(out_dir),
+        "formats" : formats,
+        "succeeded" : sum(r["status"] == "ok" for r in results),
+        "failed" : sum(r["status"] != "ok" for r in results),
+        "seconds" : time.perf_counter() - start,
+        "jobs" : results,
+        }
+    if report is None:
+        report = os.path.join(out_dir, "batch_report.json")
+    with open(report, "w") as f:
+        json.dump(summary, f, indent=2)
+    summary["report"] = report
+    return summary
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of each stage of generating a Violin SuperPlot on seeded
+synthetic datasets, with a saved baseline to catch slowdowns
+
+@author: Martin Kenny
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import tempfile
+import contextlib
+import subprocess
+import itertools
+
+# numpy, pandas and the Superviolin class are imported by the functions
+# which use them, so the CLI can read SUITES without loading them
+
+SHAPES = ("normal", "skewed", "bimodal")
+
+STAGES = ("load", "kde", "render", "stats", "savefig")
+
+# cases of each suite as rows per replicate, conditions, replicates and shape
+SUITES = {
+    "quick" : [(rows, 2, 3, "normal") for rows in (100, 1000, 10000)]
+              + [(1000, 6, 3, "normal"), (1000, 2, 8, "normal"),
+                 (1000, 2, 3, "skewed"), (1000, 2, 3, "bimodal")],
+    "full" : list(itertools.product((100, 1000, 10000, 100000, 1000000,
+                                     10000000), (2,), (3,), ("normal",)))
+             + list(itertools.product((10000,), (2, 3, 10, 30), (3, 10),
+                                      SHAPES)),
+    }
+
+# slowdown relative to the baseline above which a stage is a regression
+TOLERANCE = 0.25
+
+# differences below this many seconds are treated as timing noise
+MIN_SECONDS = 0.01
+
+# seconds within which the command line must start, e.g. for --help or init
+STARTUP_LIMIT = 0.2
+
+def make_tidy_data(rows, conditions=2, replicates=3, shape="normal", seed=0):
+    """
+    Generate a tidy dataset with a known structure for benchmarking
+
+    Parameters
+    ----------
+    rows : integer
+        Number of values in each replicate of each condition
+    conditions : integer, optional
+        Number of conditions. The default is 2.
+    replicates : integer, optional
+        Number of replicates. The default is 3.
+    shape : string, optional
+        "normal", "skewed" (lognormal) or "bimodal" (a mixture of two
+        normal distributions). The default is "normal".
+    seed : integer, optional
+        Seed of the random number generator. The default is 0.
+
+    Returns
+    -------
+    Pandas DataFrame
+        condition, replicate and value columns
+
+    """
+    import numpy as np
+    import pandas as pd
+    
+    if shape not in SHAPES:
+        raise ValueError(f"Unsupported shape: {shape}")
+    rng = np.random.default_rng(seed)
+    rows = int(rows)
+    size = rows * conditions * replicates
+
+    # each condition and replicate has its own offset so the
+    # stripes and the statistics have something to find
+    shift = (np.repeat(np.arange(conditions), rows * replicates) * 0.5
+             + np.tile(np.repeat(rng.normal(0, 0.2, replicates), rows),
+                       conditions))
+    if shape == "normal":
+        values = rng.normal(10, 1, size)
+    elif shape == "skewed":
+        values = 8 + rng.lognormal(0, 0.75, size)
+    else:
+        mode = rng.random(size) < 0.4
+        values = np.where(mode, rng.normal(8, 0.6, size),
+                          rng.normal(12, 1, size))
+    return pd.DataFrame({
+        "condition" : np.repeat([f"C{i}" for i in range(conditions)],
+                                rows * replicates),
+        "replicate" : np.tile(np.repeat([f"R{i}" for i in range(replicates)],
+                                        rows), conditions),
+        "value" : values + shift,
+        })
+
+def case_name(rows, conditions, replicates, shape):
+    return f"{shape}-rows{int(rows)}-cond{conditions}-rep{replicates}"
+
+def time_stages(filename, kde_engine="exact", **kwargs):
+    """
+    Time each stage of generating and saving a Violin SuperPlot from a
+    CSV file
+
+    Parameters
+    ----------
+    filename : string
+        CSV file with condition, replicate and value columns
+    kde_engine : string, optional
+        Engine used to fit the kernel density estimators.
+        The default is "exact".
+    **kwargs
+        Further arguments for Superviolin
+
+    Returns
+    -------
+    dictionary
+        Seconds taken by each stage in STAGES
+
+    """
+    # imported here so the command line can list the suites without
+    # loading matplotlib
+    from superviolin.plot import Superviolin
+    
+    times = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        violin = Superviolin(filename=filename, kde_engine=kde_engine,
+                             **kwargs)
+        times["load"] = time.perf_counter() - start
+        if violin.errors:
+            raise ValueError("; ".join(violin.errors))
+
+        start = time.perf_counter()
+        violin.get_kde_data(violin.bw, violin.kde_engine, violin.grid_mode,
+                            violin.n_jobs, violin.kde_cache,
+                            violin.grid_points)
+        times["kde"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        fig, ax = violin.make_figure()
+        violin.plot_subgroups(violin.centre_val, violin.middle_vals,
+                              violin.error_bars, violin.ylimits,
+                              violin.total_width, violin.linewidth,
+                              violin.stats_on_plot, violin.show_legend, ax)
+        times["render"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        violin.get_statistics(violin.centre_val, violin.paired,
+                              violin.stats_on_plot, violin.ylimits,
+                              return_=True)
+        times["stats"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        violin.savefig(io.BytesIO(), format="png")
+        times["savefig"] = time.perf_counter() - start
+    return times
+
+def time_startup(args=("--help",), repeats=5, cwd=None, env=None):
+    """
+    Time the command line from starting a fresh interpreter until it exits,
+    keeping the fastest run
+
+    Parameters
+    ----------
+    args : sequence of strings, optional
+        Arguments of the command line. The default is ("--help",).
+    repeats : integer, optional
+        Number of runs. The default is 5.
+    cwd : string, optional
+        Folder to run the command in. The default None is the current folder
+    env : dictionary, optional
+        Environment variables of the command. The default None uses those of
+        this process
+
+    Returns
+    -------
+    float
+        Seconds taken by the fastest run
+
+    """
+    code = "import sys; from superviolin.plot_cli import cli; cli(sys.argv[1:])"
+    runs = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code, *args], cwd=cwd, env=env,
+                       capture_output=True, check=True)
+        runs.append(time.perf_counter() - start)
+    return min(runs)
+
+def run_suite(suite="quick", repeats=3, kde_engine="exact", seed=0,
+              echo=print):
+    """
+    Benchmark every case of a suite, keeping the fastest time of each stage
+    over the repeats
+
+    Parameters
+    ----------
+    suite : string, optional
+        Name of a suite in SUITES. The default is "quick".
+    repeats : integer, optional
+        Number of times each case is run. The default is 3.
+    kde_engine : string, optional
+        Engine used to fit the kernel density estimators.
+        The default is "exact".
+    seed : integer, optional
+        Seed of the synthetic data. The default is 0.
+    echo : function, optional
+        Called with a line of text after each case, or None for no output.
+        The default is print.
+
+    Returns
+    -------
+    dictionary
+        Settings of the run and the seconds of each stage of each case
+
+    """
+    import numpy as np
+    import pandas as pd
+    
+    if suite not in SUITES:
+        raise ValueError(f"Unsupported benchmark suite: {suite}")
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows, conditions, replicates, shape in SUITES[suite]:
+            name = case_name(rows, conditions, replicates, shape)
+            filename = os.path.join(tmp, f"{name}.csv")
+            make_tidy_data(rows, conditions, replicates, shape,
+                           seed).to_csv(filename, index=False)
+            runs = [time_stages(filename, kde_engine) for _ in range(repeats)]
+            os.remove(filename)
+            results[name] = {s : min(r[s] for r in runs) for s in STAGES}
+            if echo is not None:
+                stages = "  ".join(f"{s} {results[name][s]:.3f}"
+                                   for s in STAGES)
+                echo(f"{name:<38}{stages}")
+    return {
+        "suite" : suite,
+        "repeats" : repeats,
+        "kde_engine" : kde_engine,
+        "seed" : seed,
+        "python" : sys.version.split()[0],
+        "numpy" : np.__version__,
+        "pandas" : pd.__version__,
+        "cases" : results,
+        }
+
+def save_results(results, fname):
+    with open(fname, "w") as f:
+        json.dump(results, f, indent=2)
+
+def load_results(fname):
+    with open(fname, "r") as f:
+        return json.load(f)
+
+def startup_regressions(results, limit=STARTUP_LIMIT):
+    """
+    Check the startup of the command line against a fixed limit, which
+    applies with or without a baseline
+
+    Parameters
+    ----------
+    results : dictionary
+        Results returned by run_suite with the seconds of time_startup
+        under "startup"
+    limit : float, optional
+        Slowest allowed startup in seconds. The default is STARTUP_LIMIT.
+
+    Returns
+    -------
+    list of dictionaries
+        The startup regression in the same form as find_regressions, or an
+        empty list
+
+    """
+    startup = results.get("startup")
+    if startup is None or startup <= limit:
+        return []
+    return [{"case" : "cli", "stage" : "startup", "baseline" : limit,
+             "seconds" : startup}]
+
+def find_regressions(results, baseline, tolerance=TOLERANCE,
+                     min_seconds=MIN_SECONDS):
+    """
+    Compare benchmark results with a baseline
+
+    Parameters
+    ----------
+    results : dictionary
+        Results returned by run_suite
+    baseline : dictionary
+        Earlier results of the same suite
+    tolerance : float, optional
+        Fraction by which a stage may be slower than the baseline.
+        The default is TOLERANCE.
+    min_seconds : float, optional
+        Smallest slowdown in seconds that counts as a regression.
+        The default is MIN_SECONDS.
+
+    Returns
+    -------
+    list of dictionaries
+        Case, stage, baseline and new seconds of each regression
+
+    """
+    regressions = []
+    for name, stages in results["cases"].items():
+        for stage, seconds in stages.items():
+            before = baseline["cases"].get(name, {}).get(stage)
+            if before is None:
+                continue
+            if (seconds > before * (1 + tolerance)
+                    and seconds - before > min_seconds):
+                regressions.append({"case" : name, "stage" : stage,
+                                    "baseline" : before, "seconds" : seconds})
+    return regressions
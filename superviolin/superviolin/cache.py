@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Content-addressed cache of the kernel density estimates used to draw
+Violin SuperPlots, so repeated plots of the same data skip the KDE fits
+
+@author: Martin Kenny
+"""
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from appdirs import AppDirs
+
+# number of conditions kept in the in-memory tier
+MEMORY_ITEMS = 256
+
+# maximum size of the on-disk tier in bytes
+DISK_BYTES = 256 * 1024 ** 2
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def default_cache_dir():
+    """
+    Get the user cache directory of the package
+
+    Returns
+    -------
+    string
+        Path of the directory used for the on-disk cache tier
+
+    """
+    dirs = AppDirs("superviolin", "Martin Kenny")
+    return os.path.join(dirs.user_cache_dir, "kde")
+
+def get_cache(cache_dir=None):
+    """
+    Get the cache shared by every Superviolin instance in this process that
+    uses the same on-disk directory
+
+    Parameters
+    ----------
+    cache_dir : string, optional
+        Directory for the on-disk tier. The default None keeps results in
+        memory only.
+
+    Returns
+    -------
+    KDECache
+        The shared cache
+
+    """
+    with _caches_lock:
+        if cache_dir not in _caches:
+            _caches[cache_dir] = KDECache(cache_dir=cache_dir)
+        return _caches[cache_dir]
+
+def kde_key(arrays, **settings):
+    """
+    Hash the values of the replicates of a condition together with the
+    settings used to fit and stack their kernel density estimators
+
+    Parameters
+    ----------
+    arrays : list of numpy arrays
+        Values of each replicate, in the order they are stacked
+    **settings
+        Bandwidth, grid and engine settings that change the result
+
+    Returns
+    -------
+    string
+        Hexadecimal digest identifying the result
+
+    """
+    digest = hashlib.sha256()
+    for arr in arrays:
+        arr = np.ascontiguousarray(arr, dtype=np.float64)
+        digest.update(str(arr.size).encode())
+        digest.update(arr.tobytes())
+    digest.update(repr(sorted(settings.items())).encode())
+    return digest.hexdigest()
+
+class KDECache:
+    def __init__(self, max_items=MEMORY_ITEMS, cache_dir=None,
+                 max_bytes=DISK_BYTES):
+        """
+        Two-tier cache of the norm_wy and px arrays of each condition,
+        with a least recently used in-memory tier and an optional on-disk
+        tier which is capped in size
+
+        Parameters
+        ----------
+        max_items : integer, optional
+            Number of conditions kept in memory. The default is MEMORY_ITEMS.
+        cache_dir : string, optional
+            Directory for the on-disk tier. The default None keeps results
+            in memory only.
+        max_bytes : integer, optional
+            Maximum size of the on-disk tier. The least recently used files
+            are removed when it grows beyond this. The default is DISK_BYTES.
+
+        """
+        self.max_items = max_items
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".npz")
+
+    def get(self, key):
+        """
+        Look up a cached result
+
+        Parameters
+        ----------
+        key : string
+            Digest returned by kde_key
+
+        Returns
+        -------
+        tuple or None
+            norm_wy, px and the bandwidth factor of the last fitted
+            replicate, or None if the key is not cached
+
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+        if self.cache_dir is None:
+            return None
+
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                factor = float(data["factor"])
+                entry = (data["norm_wy"], data["px"],
+                         None if np.isnan(factor) else factor)
+            os.utime(path)
+        except (OSError, KeyError, ValueError):
+            return None
+        self._remember(key, entry)
+        return entry
+
+    def put(self, key, norm_wy, px, factor=None):
+        """
+        Add a result to the cache
+
+        Parameters
+        ----------
+        key : string
+            Digest returned by kde_key
+        norm_wy : numpy array
+            Stacked densities of the replicates of a condition
+        px : numpy array
+            Points of each replicate
+        factor : float, optional
+            Bandwidth factor of the last fitted replicate
+
+        Returns
+        -------
+        None.
+
+        """
+        entry = (np.asarray(norm_wy), np.asarray(px), factor)
+        self._remember(key, entry)
+        if self.cache_dir is None:
+            return
+
+        # write to a temporary file first so other processes
+        # never read a partially written result
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, norm_wy=entry[0], px=entry[1],
+                     factor=np.nan if factor is None else factor)
+        os.replace(tmp, path)
+        self._evict_disk()
+
+    def clear(self):
+        """
+        Remove every result from both tiers
+
+        Returns
+        -------
+        None.
+
+        """
+        with self._lock:
+            self._memory.clear()
+        if self.cache_dir is not None:
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".npz"):
+                    os.remove(os.path.join(self.cache_dir, name))
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_items:
+                self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        """
+        Remove the least recently used files until the on-disk tier is
+        within its size cap
+
+        Returns
+        -------
+        None.
+
+        """
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".npz"):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(f[1] for f in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of parsed data files, so plotting the same file again loads
+its condition, replicate and value columns as memory-mapped arrays instead
+of parsing the file
+
+@author: Martin Kenny
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+
+import numpy as np
+
+from superviolin.cache import default_cache_dir
+
+# maximum size of the cache in bytes
+FILE_CACHE_BYTES = 2 * 1024 ** 3
+
+# changes whenever the layout of the cached files changes
+FILE_CACHE_VERSION = 1
+
+_META = "meta.json"
+
+def default_file_cache_dir(cache_dir=None):
+    """
+    Get the directory used to cache parsed data files
+
+    Parameters
+    ----------
+    cache_dir : string, optional
+        Directory of the on-disk KDE cache. The default None uses the user
+        cache directory of the package.
+
+    Returns
+    -------
+    string
+        Path of the parsed file cache, next to the KDE cache
+
+    """
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+    return os.path.join(cache_dir, "files")
+
+def file_key(filename, **settings):
+    """
+    Identify a parsed data file by its path, size and modification time
+    together with the settings used to parse it
+
+    Parameters
+    ----------
+    filename : string
+        Path of the data file
+    **settings
+        Format, column names and filters that change the parsed result
+
+    Returns
+    -------
+    string or None
+        Hexadecimal digest identifying the result, or None if the file
+        cannot be found
+
+    """
+    try:
+        stat = os.stat(filename)
+    except (OSError, TypeError):
+        return None
+    digest = hashlib.sha256()
+    digest.update(os.path.abspath(filename).encode())
+    digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+    digest.update(repr(sorted(settings.items())).encode())
+    digest.update(str(FILE_CACHE_VERSION).encode())
+    return digest.hexdigest()
+
+class ParsedFileCache:
+    def __init__(self, cache_dir, max_bytes=FILE_CACHE_BYTES):
+        """
+        Directory of parsed data files. Each entry is a folder of .npy
+        arrays, which are memory-mapped when loaded, and a JSON file of
+        labels. The least recently used entries are removed once the
+        directory grows beyond max_bytes
+
+        Parameters
+        ----------
+        cache_dir : string
+            Directory of the cache. Created if it does not exist
+        max_bytes : integer, optional
+            Maximum size of the cache. The default is FILE_CACHE_BYTES.
+
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, key):
+        """
+        Look up a parsed file
+
+        Parameters
+        ----------
+        key : string
+            Digest returned by file_key
+
+        Returns
+        -------
+        arrays : dictionary or None
+            Read-only memory-mapped arrays, or None if the key is not cached
+        meta : dictionary or None
+            Labels and other values saved with the arrays
+
+        """
+        if key is None:
+            return None, None
+        path = os.path.join(self.cache_dir, key)
+        try:
+            with open(os.path.join(path, _META), "r") as f:
+                meta = json.load(f)
+            arrays = {name : np.load(os.path.join(path, f"{name}.npy"),
+                                     mmap_mode="r")
+                      for name in meta.pop("arrays")}
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            return None, None
+        return arrays, meta
+
+    def put(self, key, arrays, meta):
+        """
+        Add a parsed file to the cache. Failures to write are ignored, as
+        the cache only saves time
+
+        Parameters
+        ----------
+        key : string
+            Digest returned by file_key
+        arrays : dictionary
+            Numpy arrays to save
+        meta : dictionary
+            JSON serializable labels and other values to save
+
+        Returns
+        -------
+        None.
+
+        """
+        if key is None:
+            return
+        path = os.path.join(self.cache_dir, key)
+
+        # write to a temporary folder first so other processes
+        # never read a partially written entry
+        tmp = None
+        try:
+            tmp = tempfile.mkdtemp(dir=self.cache_dir,
+                                   prefix=f".{os.getpid()}.{threading.get_ident()}.")
+            for name, arr in arrays.items():
+                np.save(os.path.join(tmp, f"{name}.npy"), np.asarray(arr))
+            with open(os.path.join(tmp, _META), "w") as f:
+                json.dump(dict(meta, arrays=list(arrays)), f)
+            if os.path.exists(path):
+                shutil.rmtree(path, ignore_errors=True)
+            os.replace(tmp, path)
+        except OSError:
+            if tmp is not None:
+                shutil.rmtree(tmp, ignore_errors=True)
+            return
+        self._evict()
+
+    def clear(self):
+        """
+        Remove every parsed file from the cache
+
+        Returns
+        -------
+        None.
+
+        """
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_dir():
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    def _evict(self):
+        """
+        Remove the least recently used entries until the cache is within
+        its size cap
+
+        Returns
+        -------
+        None.
+
+        """
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_dir() or entry.name.startswith("."):
+                continue
+            try:
+                size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                entries.append((entry.stat().st_mtime, size, entry.path))
+            except OSError:
+                continue
+        total = sum(e[1] for e in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
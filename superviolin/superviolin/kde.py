@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+"""
+Kernel density estimation engines used to draw the stripes of
+Violin SuperPlots
+
+@author: Martin Kenny
+"""
+
+import numpy as np
+
+KDE_ENGINES = ("exact", "fft", "truncated")
+
+# number of bins per kernel bandwidth used by the fft engine. Linear binning
+# at this resolution keeps the fft engine within FFT_TOLERANCE of the
+# exact engine
+FFT_BINS_PER_BW = 32
+FFT_MAX_BINS = 2 ** 20
+
+# maximum absolute difference between the fft and exact engines,
+# relative to the peak of the exact density
+FFT_TOLERANCE = 1e-3
+
+# number of bandwidths either side of each point summed by the truncated
+# engine. Kernel values beyond this are below exp(-18) of the kernel peak
+TRUNCATE_BW = 6
+
+# maximum number of kernel values held in memory at once when the exact
+# engine evaluates all replicates of a condition together
+BATCH_CHUNK = 2 ** 22
+
+def kde_factor(n, bw=None):
+    """
+    Get the bandwidth factor used to scale the standard deviation of the
+    data, following the same rules as scipy.stats.gaussian_kde
+
+    Parameters
+    ----------
+    n : integer
+        Number of data points in the replicate
+    bw : float or string, optional
+        Bandwidth factor, or "scott" or "silverman" to calculate it from n.
+        The default None uses Scott's Rule.
+
+    Returns
+    -------
+    float
+        The bandwidth factor
+
+    """
+    if bw is None or bw == "scott":
+        return n ** (-1 / 5)
+    elif bw == "silverman":
+        return (n * 3 / 4) ** (-1 / 5)
+    return float(bw)
+
+def adaptive_grid_points(span, bandwidth, pixels, points_per_bw=4,
+                         minimum=16):
+    """
+    Choose the number of points used to evaluate the kernel density
+    estimators of a condition so that no more points are computed than can
+    be resolved by the kernel or drawn on the figure
+
+    Parameters
+    ----------
+    span : float
+        Range of the data of the condition
+    bandwidth : float
+        Smallest kernel bandwidth among the replicates of the condition
+    pixels : float
+        Number of pixels covered by the span on the rendered figure
+    points_per_bw : integer, optional
+        Number of points per bandwidth, beyond which the density has no
+        further detail. The default is 4.
+    minimum : integer, optional
+        Smallest number of points to use. The default is 16.
+
+    Returns
+    -------
+    integer
+        Number of points
+
+    """
+    num = np.ceil(pixels)
+    if bandwidth > 0:
+        num = min(num, np.ceil(span / bandwidth * points_per_bw) + 1)
+    return int(max(num, minimum))
+
+def _check_data(arr):
+    """
+    Raise the same errors as scipy.stats.gaussian_kde for data that cannot
+    be used to fit a kernel density estimator
+
+    Parameters
+    ----------
+    arr : numpy array
+        Values of a single replicate without NaN values
+
+    Returns
+    -------
+    float
+        Standard deviation of the data
+
+    """
+    if arr.size < 2:
+        raise ValueError("`dataset` input should have multiple elements.")
+    std = np.std(arr, ddof=1)
+    if not std > 0:
+        raise np.linalg.LinAlgError("The data has a singular covariance and "
+                                    "cannot be used to fit a KDE")
+    return std
+
+def fft_kde(arr, points, bw=None):
+    """
+    Evaluate a Gaussian kernel density estimator by linearly binning the
+    data onto a fine grid, convolving the bin counts with the kernel using
+    FFT, and interpolating the result onto the requested points.
+    The cost is O(n + g log g) for n data points and g bins rather than
+    O(n * m) for m points. If more than FFT_MAX_BINS bins are needed to
+    stay within FFT_TOLERANCE, the exact density is returned instead.
+
+    Parameters
+    ----------
+    arr : numpy array
+        Values of a single replicate without NaN values
+    points : numpy array
+        Points at which to evaluate the density
+    bw : float, optional
+        Bandwidth factor as used by scipy.stats.gaussian_kde.
+        The default None uses Scott's Rule.
+
+    Returns
+    -------
+    numpy array
+        Density at each point
+
+    """
+    arr = np.asarray(arr, dtype=float)
+    points = np.asarray(points, dtype=float)
+    h = _check_data(arr) * kde_factor(arr.size, bw)
+
+    # the grid must cover the data and every evaluation point
+    finite = points[np.isfinite(points)]
+    lo = min(arr.min(), finite.min()) if finite.size else arr.min()
+    hi = max(arr.max(), finite.max()) if finite.size else arr.max()
+    span = hi - lo
+    num_bins = int(max(np.ceil(span / h * FFT_BINS_PER_BW) + 1, 64))
+    if num_bins > FFT_MAX_BINS:
+        # too few bins per bandwidth would exceed FFT_TOLERANCE,
+        # e.g. for a wide span against a small bandwidth
+        from scipy.stats import gaussian_kde
+        return gaussian_kde(arr, bw_method=bw).evaluate(points)
+    delta = span / (num_bins - 1)
+
+    # linear binning shares each point between its two neighbouring bins
+    pos = (arr - lo) / delta
+    left = np.clip(np.floor(pos).astype(int), 0, num_bins - 2)
+    frac = pos - left
+    counts = np.bincount(left, weights=1 - frac, minlength=num_bins)
+    counts += np.bincount(left + 1, weights=frac, minlength=num_bins)
+
+    # kernel covering every offset on the grid so the
+    # zero-padded convolution below is not truncated
+    offsets = np.arange(-(num_bins - 1), num_bins) * delta
+    kernel = np.exp(-0.5 * (offsets / h) ** 2) / (h * np.sqrt(2 * np.pi))
+    size = 1 << int(np.ceil(np.log2(counts.size + kernel.size - 1)))
+    conv = np.fft.irfft(np.fft.rfft(counts, size) * np.fft.rfft(kernel, size),
+                        size)
+    density = conv[num_bins - 1:2 * num_bins - 1] / arr.size
+    density = np.clip(density, 0, None)
+
+    grid = lo + np.arange(num_bins) * delta
+    return np.interp(points, grid, density)
+
+def truncated_kde(arr, points, bw=None, truncate=TRUNCATE_BW):
+    """
+    Evaluate a Gaussian kernel density estimator by summing only the data
+    points within a number of bandwidths of each point. The data is sorted
+    once and each window is found with np.searchsorted, so the cost is
+    O(n log n + m * window) and the full n * m kernel matrix is never built.
+
+    Parameters
+    ----------
+    arr : numpy array
+        Values of a single replicate without NaN values
+    points : numpy array
+        Points at which to evaluate the density
+    bw : float, optional
+        Bandwidth factor as used by scipy.stats.gaussian_kde.
+        The default None uses Scott's Rule.
+    truncate : float, optional
+        Number of bandwidths either side of each point to include in the sum.
+        The default is TRUNCATE_BW.
+
+    Returns
+    -------
+    numpy array
+        Density at each point
+
+    """
+    arr = np.sort(np.asarray(arr, dtype=float))
+    points = np.asarray(points, dtype=float)
+    h = _check_data(arr) * kde_factor(arr.size, bw)
+    
+    starts = np.searchsorted(arr, points - truncate * h, side="left")
+    stops = np.searchsorted(arr, points + truncate * h, side="right")
+    density = np.full(points.shape, np.nan)
+    norm_const = arr.size * h * np.sqrt(2 * np.pi)
+    for i, (start, stop) in enumerate(zip(starts, stops)):
+        if np.isfinite(points[i]):
+            z = (arr[start:stop] - points[i]) / h
+            density[i] = np.exp(-0.5 * z * z).sum() / norm_const
+    return density
+
+def evaluate_kde(arr, points, bw=None, engine="exact"):
+    """
+    Fit a Gaussian kernel density estimator to a replicate and evaluate it
+    at the given points
+
+    Parameters
+    ----------
+    arr : numpy array
+        Values of a single replicate without NaN values
+    points : list or numpy array
+        Points at which to evaluate the density
+    bw : float, optional
+        Bandwidth factor as used by scipy.stats.gaussian_kde.
+        The default None uses Scott's Rule.
+    engine : string, optional
+        "exact" to use scipy.stats.gaussian_kde, "fft" to use the binned
+        FFT approximation, which stays within FFT_TOLERANCE of the peak
+        density of the exact engine, or "truncated" to sum only the data
+        within TRUNCATE_BW bandwidths of each point. The default is "exact".
+
+    Returns
+    -------
+    kde_points : numpy array
+        Density at each point
+    factor : float
+        Bandwidth factor used to fit the kernel density estimator
+
+    """
+    if engine == "fft":
+        kde_points = fft_kde(arr, points, bw)
+        factor = kde_factor(len(arr), bw)
+    elif engine == "truncated":
+        kde_points = truncated_kde(arr, points, bw)
+        factor = kde_factor(len(arr), bw)
+    elif engine == "exact":
+        # scipy.stats is slow to import, so it is only loaded when needed
+        from scipy.stats import gaussian_kde
+        kde = gaussian_kde(arr, bw_method=bw)
+        kde_points = kde.evaluate(points)
+        factor = kde.factor
+    else:
+        raise ValueError(f"Unsupported KDE engine: {engine}")
+    return kde_points, factor
+
+def _batch_exact_kde(arrays, points, bw=None):
+    """
+    Evaluate Gaussian kernel density estimators for several replicates in
+    one vectorized pass over their concatenated data, processed in chunks
+    to bound memory use
+
+    Parameters
+    ----------
+    arrays : list of numpy arrays
+        Values of each replicate without NaN values
+    points : numpy array
+        Points at which to evaluate the densities
+    bw : float, optional
+        Bandwidth factor as used by scipy.stats.gaussian_kde.
+        The default None uses Scott's Rule.
+
+    Returns
+    -------
+    densities : numpy array
+        Density of each replicate (rows) at each point (columns). Rows of
+        replicates that cannot be fitted are zero
+    factors : list
+        Bandwidth factor of each replicate, or None if it could not be fitted
+
+    """
+    densities = np.zeros((len(arrays), len(points)))
+    factors = [None] * len(arrays)
+    data, inv_h, weights, rows = [], [], [], []
+    for i, arr in enumerate(arrays):
+        try:
+            std = _check_data(arr)
+            factor = kde_factor(arr.size, bw)
+            h = factor * std
+        except ValueError:
+            continue
+        factors[i] = factor
+        data.append(arr)
+        inv_h.append(np.full(arr.size, 1 / h))
+        weights.append(np.full(arr.size, 1 / (arr.size * h * np.sqrt(2 * np.pi))))
+        rows.append(np.full(arr.size, i))
+    if not data:
+        return densities, factors
+    
+    data = np.concatenate(data)
+    inv_h = np.concatenate(inv_h)
+    weights = np.concatenate(weights)
+    rows = np.concatenate(rows)
+    chunk = max(1, BATCH_CHUNK // max(1, len(points)))
+    for start in range(0, data.size, chunk):
+        stop = start + chunk
+        z = (points[None, :] - data[start:stop, None]) * inv_h[start:stop, None]
+        kernel = np.exp(-0.5 * z * z) * weights[start:stop, None]
+        
+        # sum the kernel rows belonging to each replicate
+        onehot = rows[start:stop] == np.arange(len(arrays))[:, None]
+        densities += onehot @ kernel
+    return densities, factors
+
+def batch_kde(arrays, points, bw=None, engine="exact"):
+    """
+    Evaluate kernel density estimators for all replicates of a condition
+    on a shared grid and return them as one (replicates x points) array
+
+    Parameters
+    ----------
+    arrays : list of numpy arrays
+        Values of each replicate without NaN values
+    points : numpy array
+        Points at which to evaluate the densities
+    bw : float, optional
+        Bandwidth factor as used by scipy.stats.gaussian_kde.
+        The default None uses Scott's Rule.
+    engine : string, optional
+        Engine used to fit each replicate as described in evaluate_kde.
+        The exact engine evaluates all replicates in a single vectorized
+        call. The default is "exact".
+
+    Returns
+    -------
+    densities : numpy array
+        Density of each replicate (rows) at each point (columns). Rows of
+        replicates that cannot be fitted are zero
+    factors : list
+        Bandwidth factor of each replicate, or None if it could not be fitted
+
+    """
+    points = np.asarray(points, dtype=float)
+    if engine == "exact":
+        return _batch_exact_kde(arrays, points, bw)
+    densities = np.zeros((len(arrays), len(points)))
+    factors = [None] * len(arrays)
+    for i, arr in enumerate(arrays):
+        try:
+            densities[i], factors[i] = evaluate_kde(arr, points, bw, engine)
+        except ValueError:
+            continue
+    return densities, factors
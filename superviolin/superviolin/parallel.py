@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers for spreading independent fits over a process pool
+
+@author: Martin Kenny
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+def resolve_n_jobs(n_jobs=1):
+    """
+    Get the number of worker processes to use
+
+    Parameters
+    ----------
+    n_jobs : integer or float, optional
+        Number of worker processes. Values below 1 use every CPU core.
+        The default is 1.
+
+    Returns
+    -------
+    integer
+        Number of worker processes
+
+    """
+    n_jobs = int(n_jobs)
+    if n_jobs < 1:
+        n_jobs = os.cpu_count() or 1
+    return n_jobs
+
+def map_jobs(func, jobs, n_jobs=1):
+    """
+    Call func with each tuple of arguments in jobs, in a process pool if
+    n_jobs is greater than 1. Results are returned in the order of jobs, so
+    the output does not depend on the number of workers. A ValueError
+    raised by a job is returned in place of its result.
+
+    Parameters
+    ----------
+    func : function
+        Module-level function so it can be sent to worker processes
+    jobs : list of tuples
+        Arguments for each call of func
+    n_jobs : integer, optional
+        Number of worker processes. Values below 1 use every CPU core.
+        The default is 1.
+
+    Returns
+    -------
+    results : list
+        Result or ValueError of each job
+
+    """
+    n_jobs = min(resolve_n_jobs(n_jobs), len(jobs))
+    results = []
+    if n_jobs <= 1:
+        for args in jobs:
+            try:
+                results.append(func(*args))
+            except ValueError as e:
+                results.append(e)
+        return results
+    
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        futures = [pool.submit(func, *args) for args in jobs]
+        for future in futures:
+            error = future.exception()
+            if isinstance(error, ValueError):
+                results.append(error)
+            elif error is not None:
+                raise error
+            else:
+                results.append(future.result())
+    return results
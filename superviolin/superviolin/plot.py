@@ -5,20 +5,69 @@ Created on Thu Dec 17 14:51:42 2020
 @author: Martin Kenny
 """
 
+from contextlib import nullcontext
+
 import numpy as np
 import pandas as pd
-import scikit_posthocs as sp
-import matplotlib.pyplot as plt
-from matplotlib import rcParams as params
-from scipy.stats import gaussian_kde, norm, f_oneway
-from scipy.stats import ttest_ind, ttest_rel
-params["xtick.labelsize"] = 8
-params["ytick.labelsize"] = 8
-params["axes.labelsize"] = 9
-params["axes.spines.right"] = False
-params["axes.spines.top"] = False
-params["figure.dpi"] = 300
-params['legend.fontsize'] = 5
+from superviolin.kde import (KDE_ENGINES, adaptive_grid_points, batch_kde,
+                             evaluate_kde, kde_factor)
+from superviolin.parallel import map_jobs
+from superviolin.cache import KDECache, default_cache_dir, get_cache, kde_key
+from superviolin.profiling import MemoryProfiler
+from superviolin.readers import detect_format, read_tidy, read_untidy_excel
+from superviolin.filecache import ParsedFileCache, default_file_cache_dir, file_key
+from superviolin.summary import (BOOTSTRAP_SAMPLES, SUMMARIES,
+                                 bootstrap_intervals, compact_values,
+                                 encode_labels, group_offsets,
+                                 replicate_centres, skeleton_stats)
+
+# matplotlib, scipy.stats and the statistics module are slow to import, so
+# they are only imported by the methods which use them. numpy and pandas
+# are needed as soon as a Superviolin loads its data, so they are not
+
+# default style of Violin SuperPlots. It is applied to the axes of each plot
+# rather than to the global rcParams so that plots can be drawn concurrently
+STYLE = {
+    "xtick.labelsize" : 8,
+    "ytick.labelsize" : 8,
+    "axes.labelsize" : 9,
+    "axes.spines.right" : False,
+    "axes.spines.top" : False,
+    "figure.dpi" : 300,
+    "legend.fontsize" : 5,
+    }
+
+# height of each Violin SuperPlot in inches
+FIG_HEIGHT = 5 / 2.54
+
+# stages of generate_plot in the order they run. Each stage depends on the
+# results of the stages before it which invalidate it below
+STAGES = ("load", "kde", "statistics", "render", "redraw")
+STAGE_DEPENDENTS = {
+    "load" : ("kde", "statistics", "render", "redraw"),
+    "kde" : ("render", "redraw"),
+    "statistics" : ("render", "redraw"),
+    "render" : ("redraw",),
+    "redraw" : (),
+    }
+
+# earliest stage invalidated by a change of each argument. Arguments which
+# are not listed change how stages run but not their results
+PARAM_STAGES = {
+    "condition" : "load", "value" : "load", "replicate" : "load",
+    "filename" : "load", "data_format" : "load", "file_format" : "load",
+    "dataframe" : "load", "filter_order" : "load", "file_cache" : "load",
+    "bw" : "kde", "kde_engine" : "kde", "grid_mode" : "kde",
+    "grid_points" : "kde",
+    "centre_val" : "statistics", "paired_data" : "statistics",
+    "control" : "statistics",
+    "order" : "render", "cmap" : "render", "middle_vals" : "render",
+    "error_bars" : "render", "bootstrap_samples" : "render",
+    "bootstrap_seed" : "render", "show_legend" : "render",
+    "stats_on_plot" : "render", "ylimits" : "render",
+    "xlabel" : "redraw", "ylabel" : "redraw", "total_width" : "redraw",
+    "linewidth" : "redraw", "sep_linewidth" : "redraw", "style" : "redraw",
+    }
 
 class Superviolin:
     def __init__(self, condition="condition", value="value", replicate="replicate",
@@ -27,9 +76,49 @@ class Superviolin:
                  paired_data="no", stats_on_plot="no", ylimits="None",
                  total_width=0.8, linewidth=1, dataframe=False, dpi=300,
                  sep_linewidth=0.5, xlabel="", ylabel="", cmap="Set2",
-                 bw="None", show_legend="no", return_stats=False):
+                 bw="None", show_legend="no", return_stats=False,
+                 kde_engine="exact", grid_mode="union", n_jobs=1,
+                 kde_cache="no", cache_dir="None", grid_points=128,
+                 style=None, memprofile="no", file_format="auto",
+                 filter_order="no", file_cache="no", control="None",
+                 bootstrap_samples=BOOTSTRAP_SAMPLES, bootstrap_seed=0):
+        # arguments are kept so set_params can change some of them and
+        # rerun only the stages which depend on them
+        self._params = {k : v for k, v in locals().items() if k != "self"}
         self.errors = []
-        self.df = dataframe
+        
+        # measure the memory used by each stage from here on, if requested
+        self.profiler = MemoryProfiler() if memprofile == "yes" else None
+        self.fig = None
+        self.ax = None
+        self.subgroup_dict = {}
+        self._stale = set(STAGES)
+        self._statistics = None
+        self._set_options(**self._params)
+        self._load(**self._params)
+        self.check_errors()
+    
+    def _set_options(self, condition="condition", value="value",
+                     replicate="replicate", centre_val="mean",
+                     middle_vals="mean", error_bars="SEM", paired_data="no",
+                     stats_on_plot="no", ylimits="None", total_width=0.8,
+                     linewidth=1, dpi=300, sep_linewidth=0.5, xlabel="",
+                     ylabel="", bw="None", show_legend="no",
+                     return_stats=False, kde_engine="exact",
+                     grid_mode="union", n_jobs=1, kde_cache="no",
+                     cache_dir="None", grid_points=128, style=None,
+                     file_cache="no", control="None",
+                     bootstrap_samples=BOOTSTRAP_SAMPLES, bootstrap_seed=0,
+                     **kwargs):
+        """
+        Set the attributes of the arguments which do not need the data,
+        adding unsupported options to the errors list attribute
+
+        Returns
+        -------
+        None.
+
+        """
         self.x = condition if condition != "REPLACE_ME" else "condition"
         self.y = value if value != "REPLACE_ME" else "value"
         self.rep = replicate if replicate != "REPLACE_ME" else "replicate"
@@ -40,69 +129,182 @@ class Superviolin:
         self.middle_vals = middle_vals
         self.centre_val = centre_val
         self.paired = paired_data
+        self.control = control
         self.stats_on_plot = stats_on_plot
         self.return_stats = return_stats
         self.ylimits = ylimits
         self.total_width = total_width
         self.error_bars = error_bars
+        self.bootstrap_samples = int(bootstrap_samples)
+        self.bootstrap_seed = int(bootstrap_seed)
         self.show_legend = show_legend
-        self._on_legend = []
+        self.style = dict(STYLE)
+        if style is not None:
+            self.style.update(style)
+        self.kde_engine = kde_engine
+        self.grid_mode = grid_mode
+        self.n_jobs = n_jobs
+        self.dpi = dpi
+        if grid_points == "adaptive":
+            self.grid_points = grid_points
+        else:
+            try:
+                self.grid_points = int(grid_points)
+            except ValueError:
+                self.grid_points = 0
+            if self.grid_points < 2:
+                self.errors.append("grid_points must be adaptive or a number above 1")
+        
+        # keep parsed data files next to the kde cache so the same file
+        # loads as memory-mapped arrays the next time it is plotted
+        if file_cache == "yes":
+            self.file_cache = ParsedFileCache(default_file_cache_dir(
+                None if cache_dir == "None" else cache_dir))
+        else:
+            self.file_cache = None
+        
+        # reuse kde results of identical data between plots, keeping them
+        # in memory and, if requested, in a size-capped directory on disk
+        if isinstance(kde_cache, KDECache):
+            self.kde_cache = kde_cache
+        elif kde_cache == "memory":
+            self.kde_cache = get_cache()
+        elif kde_cache == "yes":
+            if cache_dir == "None":
+                cache_dir = default_cache_dir()
+            self.kde_cache = get_cache(cache_dir)
+        else:
+            self.kde_cache = None
+        if kde_engine not in KDE_ENGINES:
+            self.errors.append(f"Unsupported KDE engine: {kde_engine}")
+        if grid_mode not in ("union", "fixed"):
+            self.errors.append(f"Unsupported grid mode: {grid_mode}")
         if bw != "None":
             self.bw = bw
         else:
             self.bw = None
-        params["savefig.dpi"] = dpi
         if self.xlabel == "REPLACE_ME":
             self.xlabel = ""
         if self.ylabel == "REPLACE_ME":
             self.ylabel = ""
-            
-        qualitative = ["Pastel1", "Pastel2", "Paired", "Accent", "Dark2",
-                       "Set1", "Set2", "Set3", "tab10", "tab20", "tab20b",
-                       "tab20c"]
+    
+    def _load(self, order="None", filename="", data_format="tidy",
+              dataframe=False, cmap="Set2", control="None",
+              file_format="auto", filter_order="no", **kwargs):
+        """
+        Load the data and index the rows of each (condition, replicate)
+        pair, then organize the subgroups. The load stage stays stale if
+        the data could not be loaded
+
+        Returns
+        -------
+        None.
+
+        """
+        self.df = dataframe
+        self.subgroup_dict = {}
         
-        # ensure dataframe is loaded
-        if self._check_df(filename, data_format):
+        # ensure dataframe is loaded, only reading the conditions in order
+        # from the file if requested
+        conditions = None
+        if filter_order == "yes" and order != "None":
+            conditions = order.split(", ")
+        key = None
+        if self.file_cache is not None and "bool" in str(type(self.df)):
+            key = file_key(filename, data_format=data_format,
+                           file_format=file_format, conditions=conditions,
+                           columns=(self.x, self.y, self.rep))
+        with self._stage("load"):
+            cached = self._load_cached_file(key)
+            loaded = cached or self._check_df(filename, data_format,
+                                              file_format, conditions)
+        if loaded:
             
             # ensure columns are all present in the dataframe
             if self._cols_in_df():
                 
-                # force Condition and Replicate to string types
-                self.df[self.x] = self.df[self.x].astype(str)
-                self.df[self.rep] = self.df[self.rep].astype(str)
-                
-                # organize subgroups
-                self.subgroups = tuple(sorted(self.df[self.x].unique().tolist()))
-                if order != "None":
-                    self.subgroups = order.split(", ")
+                # hold Condition and Replicate as categoricals of their
+                # string labels without modifying the caller's DataFrame
+                if not cached:
+                    with self._stage("coercion"):
+                        self._encode_columns()
                 
-                # dictionary of arrays for subgroup data
-                # loop through the keys and add an empty list
-                # when the replicate numbers don"t match
-                self.subgroup_dict = dict(
-                    zip(self.subgroups,
-                        [{"norm_wy" : [], "px" : []} for i in self.subgroups])
-                    )
-    
-                self.unique_reps = tuple(self.df[self.rep].unique())
-                
-                # make sure there"s enough colours for 
-                # each subgroup when instantiating
-                if ", " in cmap:
-                    self.colours = tuple(cmap.split(", "))
-                else:
-                    self.cm = plt.get_cmap(cmap)
-                    if cmap in qualitative:
-                        # self.colours = [self.cm(i / len(self.unique_reps)) for i in range(len(self.unique_reps))]
-                        self.colours = [self.cm(i / self.cm.N) for i in range(len(self.unique_reps))]
-                    else:
-                        divisor = len(self.unique_reps)+2
-                        self.colours = [self.cm((i+2) / divisor) for i in range(len(self.unique_reps))]
-                        # shuffle colours
-                        np.random.shuffle(self.colours)
-                if len(self.colours) < len(self.unique_reps):
-                    self.errors.append("Not enough colours for each replicate")
-        self.check_errors()
+                # index the rows of each (condition, replicate) pair once
+                # so later stages can slice them without rescanning self.df
+                with self._stage("group_index"):
+                    self._build_group_index(cached)
+                if key is not None and not cached:
+                    self._save_cached_file(key)
+                self._set_groups(order, cmap, control)
+                self._stale.discard("load")
+    
+    def _set_groups(self, order="None", cmap="Set2", control="None",
+                    colours=True):
+        """
+        Organize the subgroups of the loaded data and the colours of each
+        replicate
+
+        Parameters
+        ----------
+        order : string, optional
+            Conditions to plot, separated by ", ". The default "None" plots
+            every condition in sorted order.
+        cmap : string, optional
+            Colour map or colours separated by ", ". The default is "Set2".
+        control : string, optional
+            Condition compared with every other condition.
+            The default is "None".
+        colours : bool, optional
+            False to keep the current colours, as colour maps which are not
+            qualitative are shuffled. The default is True.
+
+        Returns
+        -------
+        None.
+
+        """
+        qualitative = ["Pastel1", "Pastel2", "Paired", "Accent", "Dark2",
+                       "Set1", "Set2", "Set3", "tab10", "tab20", "tab20b",
+                       "tab20c"]
+        
+        # organize subgroups
+        self.subgroups = tuple(sorted(self.df[self.x].cat.categories))
+        if order != "None":
+            self.subgroups = order.split(", ")
+        
+        # dictionary of arrays for subgroup data
+        # loop through the keys and add an empty list
+        # when the replicate numbers don"t match,
+        # keeping the data of subgroups which were already fitted
+        self.subgroup_dict = dict(
+            zip(self.subgroups,
+                [self.subgroup_dict.get(i, {"norm_wy" : [], "px" : []})
+                 for i in self.subgroups])
+            )
+
+        self.unique_reps = tuple(self.df[self.rep].cat.categories)
+        
+        # make sure there"s enough colours for 
+        # each subgroup when instantiating
+        if not colours:
+            pass
+        elif ", " in cmap:
+            self.colours = tuple(cmap.split(", "))
+        else:
+            from matplotlib import colormaps
+            self.cm = colormaps[cmap]
+            if cmap in qualitative:
+                # self.colours = [self.cm(i / len(self.unique_reps)) for i in range(len(self.unique_reps))]
+                self.colours = [self.cm(i / self.cm.N) for i in range(len(self.unique_reps))]
+            else:
+                divisor = len(self.unique_reps)+2
+                self.colours = [self.cm((i+2) / divisor) for i in range(len(self.unique_reps))]
+                # shuffle colours
+                np.random.shuffle(self.colours)
+        if len(self.colours) < len(self.unique_reps):
+            self.errors.append("Not enough colours for each replicate")
+        if control != "None" and control not in self._x_lookup:
+            self.errors.append(f"Control {control} not found in data")
     
     def check_errors(self):
         num_errors = len(self.errors)
@@ -118,34 +320,265 @@ class Superviolin:
             return False
         
                     
-    def generate_plot(self):
+    @staticmethod
+    def _changed(old, new):
+        """
+        Check whether a new argument value differs from the old one,
+        treating values which cannot be compared, like DataFrames, as
+        changed unless they are the same object
+        """
+        if old is new:
+            return False
+        try:
+            return bool(old != new)
+        except (TypeError, ValueError):
+            return True
+    
+    def _param_stages(self, name):
+        """
+        Get the earliest stages invalidated by a change of an argument,
+        given the current values of the other arguments
+
+        Parameters
+        ----------
+        name : string
+            Name of the changed argument
+
+        Returns
+        -------
+        set
+            Stages invalidated by the change, without their dependents
+
+        """
+        params = self._params
+        if name == "dpi" and params["grid_points"] == "adaptive":
+            # the number of grid points follows the dpi
+            return {"kde"}
+        if name != "order" or "load" in self._stale:
+            return {PARAM_STAGES[name]} if name in PARAM_STAGES else set()
+        if params["filter_order"] == "yes":
+            # only the conditions in order were read from the file
+            return {"load"}
+        order = params["order"]
+        if order == "None":
+            subgroups = tuple(sorted(self.df[self.x].cat.categories))
+        else:
+            subgroups = order.split(", ")
+        stages = {"render"}
+        if any(len(self.subgroup_dict.get(g, {}).get("px", [])) == 0
+               for g in subgroups):
+            stages.add("kde")
+        if tuple(subgroups) != tuple(self.subgroups):
+            # the plotted conditions and their order are compared
+            stages.add("statistics")
+        return stages
+    
+    @property
+    def stale_stages(self):
+        """
+        Stages which have to run before the plot is up to date, in the
+        order they run
+        """
+        return tuple(s for s in STAGES if s in self._stale)
+    
+    def set_params(self, **params):
+        """
+        Change arguments of the Violin SuperPlot and invalidate the stages
+        which depend on them. The stages run again on the next call of
+        update or generate_plot
+
+        Parameters
+        ----------
+        **params
+            New values of any arguments of the class
+
+        Raises
+        ------
+        TypeError
+            If an argument is not an argument of the class
+
+        Returns
+        -------
+        tuple of strings
+            Stages invalidated by the changed arguments, in the order they
+            run. Empty if no argument changed
+
+        """
+        unknown = [k for k in params if k not in self._params]
+        if unknown:
+            raise TypeError(f"Unknown arguments: {', '.join(unknown)}")
+        changed = [k for k, v in params.items()
+                   if self._changed(self._params[k], v)]
+        self._params.update(params)
+        invalidated = set()
+        for name in changed:
+            for stage in self._param_stages(name):
+                invalidated.add(stage)
+                invalidated.update(STAGE_DEPENDENTS[stage])
+        self._stale.update(invalidated)
+        
+        # options are cheap to set again, while the subgroups and colours
+        # are only organized again once the data is loaded
+        self.errors = []
+        self._set_options(**self._params)
+        if "load" not in self._stale:
+            self._set_groups(self._params["order"], self._params["cmap"],
+                             self._params["control"],
+                             colours="cmap" in changed)
+        return tuple(s for s in STAGES if s in invalidated)
+    
+    def update(self, ax=None):
+        """
+        Run the stages of the Violin SuperPlot which are stale after
+        set_params, reusing the results of the others
+
+        Parameters
+        ----------
+        ax : matplotlib Axes, optional
+            Axes to draw the Violin SuperPlot on if it is rendered again.
+            The default None redraws on the axes drawn on before, if any,
+            or creates a new pyplot figure.
+
+        Returns
+        -------
+        tuple of strings or None
+            Stages which were run, in order, or None if there are errors
+
+        """
+        stale = self.stale_stages
+        if "load" in self._stale:
+            self._load(**self._params)
+        
+        # if no errors exist, update the superplot. Otherwise, report errors
+        if self.check_errors():
+            self._stop_profiler()
+            return None
+        if "kde" in stale:
+            with self._stage("get_kde_data"):
+                self.get_kde_data(self.bw, self.kde_engine, self.grid_mode,
+                                  self.n_jobs, self.kde_cache,
+                                  self.grid_points)
+        if "render" in stale:
+            if ax is None and self.ax is not None:
+                ax = self.ax
+                ax.cla()
+            with self._stage("plot_subgroups"):
+                self.plot_subgroups(self.centre_val, self.middle_vals,
+                                    self.error_bars, self.ylimits,
+                                    self.total_width, self.linewidth,
+                                    self.stats_on_plot, self.show_legend, ax)
+        elif "redraw" in stale:
+            self._redraw()
+        if "statistics" in stale or "render" in stale:
+            with self._stage("get_statistics"):
+                if "statistics" in stale:
+                    self._statistics = self._compute_statistics(
+                        self.centre_val, self.paired, self.return_stats,
+                        self.control)
+                if "render" in stale:
+                    p, posthoc = self._statistics
+                    self.overlay_statistics(p, posthoc, self.stats_on_plot,
+                                            self.ylimits,
+                                            control=self.control)
+        self._stale.clear()
+        self._stop_profiler()
+        return stale
+                    
+    def generate_plot(self, ax=None):
         """
         Generate Violin SuperPlot by calling get_kde_data, plot_subgroups,
         and get_statistics if the errors list attribute is empty.
 
+        Parameters
+        ----------
+        ax : matplotlib Axes, optional
+            Axes to draw the Violin SuperPlot on. The default None creates a
+            new pyplot figure. Pass the axes of a figure from make_figure to
+            draw without pyplot, e.g. from several threads at once.
+
         Returns
         -------
         None.
 
         """
-        # if no errors exist, create the superplot. Otherwise, report errors
-        errors = self.check_errors()
-        if not errors:
-            self.get_kde_data(self.bw)
-            self.plot_subgroups(self.centre_val, self.middle_vals,
-                                self.error_bars, self.ylimits,
-                                self.total_width, self.linewidth,
-                                self.stats_on_plot, self.show_legend)
-            if self.return_stats:
-                p, info = self.get_statistics(self.centre_val, self.paired,
-                                    self.stats_on_plot, self.ylimits,
-                                    self.return_stats)
-                return p, info
-            else:
-                self.get_statistics(self.centre_val, self.paired,
-                                    self.stats_on_plot, self.ylimits,
-                                    self.return_stats)
-        
+        # every stage after loading the data runs again on a new figure
+        self._stale.update(STAGE_DEPENDENTS["load"])
+        if ax is None:
+            self.fig, self.ax = None, None
+        if self.update(ax) is None:
+            return
+        if self.return_stats:
+            p, posthoc = self._statistics
+            if len(self.subgroups) == 2:
+                return p, self.paired
+            return p, posthoc
+    
+    def _stage(self, name):
+        """
+        Get a context manager which measures the memory used by a stage if
+        the memprofile argument was "yes"
+
+        Parameters
+        ----------
+        name : string
+            Name of the stage in the memory report
+
+        Returns
+        -------
+        context manager
+            Profiler stage, or a context manager that does nothing
+
+        """
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.stage(name)
+    
+    def _stop_profiler(self):
+        """
+        Stop tracing allocations once the last stage has been measured
+
+        Returns
+        -------
+        None.
+
+        """
+        if self.profiler is not None:
+            self.profiler.stop()
+    
+    def memory_report(self):
+        """
+        Get the peak and retained memory of each stage measured when the
+        memprofile argument is "yes"
+
+        Returns
+        -------
+        dictionary or None
+            Measurements of each stage as described in
+            MemoryProfiler.report, or None if memory was not profiled
+
+        """
+        if self.profiler is None:
+            return None
+        return self.profiler.report()
+    
+    def save_memory_report(self, fname):
+        """
+        Save the memory report as JSON
+
+        Parameters
+        ----------
+        fname : string
+            Path of the JSON file
+
+        Returns
+        -------
+        None.
+
+        """
+        if self.profiler is None:
+            print("Memory was not profiled. Use memprofile=\"yes\"")
+        else:
+            self.profiler.save(fname)
                             
     def _make_tidy(self, xl_file):
         """
@@ -154,7 +587,7 @@ class Superviolin:
 
         Parameters
         ----------
-        xl_file : string
+        xl_file : string or file-like object
             name of the excel file being examined
 
         Returns
@@ -162,29 +595,27 @@ class Superviolin:
         None.
 
         """
-        xl = pd.ExcelFile(xl_file)
-        sheets = xl.sheet_names # replicates
-        dfs = []
-        for s in sheets:
-            df = xl.parse(s)
-            if not df.empty:
-                df = df.melt(value_vars=df.columns.tolist(), var_name=self.x,
-                             value_name=self.y)
-                df[self.rep] = s
-                dfs.append(df)
-        self.df = pd.concat(dfs)
+        self.df = read_untidy_excel(xl_file, self.x, self.y, self.rep)
     
-    def _check_df(self, filename, data_format):
+    def _check_df(self, filename, data_format, file_format="auto",
+                  conditions=None):
         """
-        Read dataframe if file extension is valid. 
+        Read dataframe if file extension is valid. Only the condition, value
+        and replicate columns are read from tidy data files.
 
         Parameters
         ----------
         filename : string
             name of the file containing the data for the Violin SuperPlot.
-            Must be CSV or an Excel workbook
+            Must be CSV, an Excel workbook, Parquet, Feather or Arrow IPC
         data_format : string
             either "tidy" or "untidy" based on format of the data
+        file_format : string, optional
+            Format of the file, or "auto" to use the file extension.
+            The default is "auto".
+        conditions : list of strings, optional
+            Only read rows of these conditions. The default None reads
+            every row.
 
         Returns
         -------
@@ -194,21 +625,211 @@ class Superviolin:
 
         """
         if "bool" in str(type(self.df)):
-            if filename.endswith("csv"):
-                self.df = pd.read_csv(filename)
-                return True
-            elif ".xl" in filename:
-                if data_format == "tidy":
-                    self.df = pd.read_excel(filename)
-                else:
+            try:
+                file_format = detect_format(filename, file_format)
+            except ValueError as e:
+                self.errors.append(str(e))
+                return False
+            try:
+                if file_format == "excel" and data_format != "tidy":
                     self._make_tidy(filename)
-                return True
-            else:
-                self.errors.append("Incorrect filename or unsupported filetype")
+                    return True
+                self.df = read_tidy(filename, [self.x, self.y, self.rep],
+                                    file_format, self.x, conditions)
+            except (ImportError, ValueError) as e:
+                self.errors.append(str(e))
                 return False
+            return True
         else:
             return True
     
+    def _encode_columns(self):
+        """
+        Replace the df attribute with a compact copy of the condition,
+        replicate and value columns, with the conditions and replicates as
+        categoricals of their string labels
+
+        Returns
+        -------
+        None.
+
+        """
+        self.df = pd.DataFrame({
+            self.x : encode_labels(self.df[self.x]),
+            self.rep : encode_labels(self.df[self.rep]),
+            self.y : compact_values(self.df[self.y]),
+            })
+    
+    def _build_group_index(self, cached=False):
+        """
+        Sort the rows of the df attribute by their (condition, replicate)
+        codes once, so the values of each pair are a contiguous slice found
+        from an offsets table
+
+        Parameters
+        ----------
+        cached : bool, optional
+            True if the df attribute and offsets table were loaded from the
+            parsed file cache, which holds them already sorted.
+            The default is False.
+
+        Returns
+        -------
+        None.
+
+        """
+        if not cached:
+            order, self._offsets = group_offsets(
+                self.df[self.x].cat.codes.to_numpy(),
+                self.df[self.rep].cat.codes.to_numpy(),
+                len(self.df[self.x].cat.categories),
+                len(self.df[self.rep].cat.categories))
+            if order is not None:
+                self.df = self.df.take(order).reset_index(drop=True)
+        
+        self._values = self.df[self.y].to_numpy()
+        self._summaries = {}
+        self._x_lookup = {label : code for code, label
+                          in enumerate(self.df[self.x].cat.categories)}
+        self._rep_lookup = {label : code for code, label
+                            in enumerate(self.df[self.rep].cat.categories)}
+    
+    def _load_cached_file(self, key):
+        """
+        Load the df attribute and offsets table of a data file from the
+        parsed file cache. The arrays are memory-mapped, so they are only
+        read from disk as they are used
+
+        Parameters
+        ----------
+        key : string or None
+            Digest returned by file_key, or None if the cache is not used
+
+        Returns
+        -------
+        bool
+            True if the file was found in the cache
+
+        """
+        if key is None:
+            return False
+        arrays, meta = self.file_cache.get(key)
+        if arrays is None:
+            return False
+        self.df = pd.DataFrame({
+            self.x : pd.Categorical.from_codes(arrays["x_codes"],
+                                               meta["x_labels"]),
+            self.rep : pd.Categorical.from_codes(arrays["rep_codes"],
+                                                 meta["rep_labels"]),
+            self.y : arrays["values"],
+            }, copy=False)
+        self._offsets = arrays["offsets"]
+        return True
+    
+    def _save_cached_file(self, key):
+        """
+        Save the sorted df attribute and offsets table of a data file to the
+        parsed file cache
+
+        Parameters
+        ----------
+        key : string
+            Digest returned by file_key
+
+        Returns
+        -------
+        None.
+
+        """
+        arrays = {"x_codes" : self.df[self.x].cat.codes.to_numpy(),
+                  "rep_codes" : self.df[self.rep].cat.codes.to_numpy(),
+                  "values" : self.df[self.y].to_numpy(),
+                  "offsets" : self._offsets}
+        meta = {"x_labels" : self.df[self.x].cat.categories.tolist(),
+                "rep_labels" : self.df[self.rep].cat.categories.tolist()}
+        self.file_cache.put(key, arrays, meta)
+    
+    def _replicate_values(self, group, rep):
+        """
+        Get the values of a single replicate of a condition from the
+        grouped index
+
+        Parameters
+        ----------
+        group : string
+            Categorical condition on the x axis
+        rep : string
+            Name of the experimental replicate
+
+        Returns
+        -------
+        numpy array
+            Values of the replicate, which is empty if the condition
+            has no data for that replicate
+
+        """
+        if group not in self._x_lookup or rep not in self._rep_lookup:
+            return np.empty(0)
+        pair = self._x_lookup[group] * len(self._rep_lookup) + self._rep_lookup[rep]
+        start, stop = self._offsets[pair], self._offsets[pair + 1]
+        return self._values[start:stop].astype(float)
+    
+    def _replicate_summary(self, middle_vals="mean"):
+        """
+        Calculate the middle value of every replicate of every condition in
+        one pass over the grouped index. Results are kept for each
+        middle_vals so plot_subgroups and get_statistics share them
+
+        Parameters
+        ----------
+        middle_vals : string
+            Central measure of each replicate. Either mean, median, or robust
+            mean, which uses data between the 2.5 and 97.5 percentiles
+
+        Returns
+        -------
+        centres : numpy array
+            Middle value of each replicate (columns) of each condition (rows)
+            in the order of the grouped index
+        sizes : numpy array
+            Number of rows of each replicate of each condition
+
+        """
+        how = middle_vals if middle_vals in SUMMARIES else "mean"
+        if how not in self._summaries:
+            centres, sizes = replicate_centres(self._values, self._offsets, how)
+            shape = (len(self._x_lookup), len(self._rep_lookup))
+            self._summaries[how] = (centres.reshape(shape), sizes.reshape(shape))
+        return self._summaries[how]
+    
+    def _replicate_middles(self, group, middle_vals="mean"):
+        """
+        Get the middle value of each replicate of a condition
+
+        Parameters
+        ----------
+        group : string
+            Categorical condition on the x axis
+        middle_vals : string
+            Central measure of each replicate. Either mean, median, or robust
+            mean, which uses data between the 2.5 and 97.5 percentiles
+
+        Returns
+        -------
+        Pandas DataFrame
+            Replicate names and their middle values
+
+        """
+        if group not in self._x_lookup:
+            return pd.DataFrame({self.rep : [], self.y : []})
+        centres, sizes = self._replicate_summary(middle_vals)
+        row = self._x_lookup[group]
+        has_rows = sizes[row] > 0
+        return pd.DataFrame({
+            self.rep : np.array(self.unique_reps, dtype=object)[has_rows],
+            self.y : centres[row][has_rows],
+            })
+    
     def _cols_in_df(self):
         """
         Check if all column names specified by the user are present in the 
@@ -232,7 +853,8 @@ class Superviolin:
         else:
             return True
 
-    def get_kde_data(self, bw=None):
+    def get_kde_data(self, bw=None, kde_engine="exact", grid_mode="union",
+                     n_jobs=1, cache=None, grid_points=128):
         """
         Fit kernel density estimators to the replicate of each condition,
         generate list of x and y co-ordinates of the histogram,
@@ -245,101 +867,317 @@ class Superviolin:
             Values should be between 0 and 1. The default value will result
             in an "optimal" value being used to smoothen the stripes. This
             value is calculated using Scott's Rule
+        kde_engine : string
+            Method used to fit the kernel density estimators. "exact" uses
+            scipy.stats.gaussian_kde and "fft" bins each replicate onto a
+            fine grid and convolves it with the kernel using FFT, which is
+            much faster for large replicates and stays within 0.1% of the
+            peak density of the exact engine. "truncated" sorts each
+            replicate and sums only the data within a few bandwidths of each
+            point, which is faster for mid-sized replicates and uses less
+            memory than the exact engine. The default is "exact".
+        grid_mode : string
+            "union" evaluates each replicate on grid_points points spanning
+            the condition plus the minimum and maximum of every replicate, so
+            the number of points varies between conditions. "fixed" evaluates
+            all replicates of a condition together on exactly grid_points
+            points and masks the points outside each replicate's range.
+            The default is "union".
+        n_jobs : integer
+            Number of worker processes used to fit the kernel density
+            estimators. Each worker only receives the values of the replicate
+            it fits, and the results are identical to fitting them in this
+            process. Values below 1 use every CPU core. The default is 1.
+        cache : KDECache
+            Cache of previously fitted conditions, keyed by a hash of the
+            replicate values and the settings above. Conditions found in the
+            cache are not refitted. The default None fits every condition.
+        grid_points : integer or string
+            Number of points spanning each condition at which the kernel
+            density estimators are evaluated, or "adaptive" to choose it for
+            each condition from the bandwidth and the pixel height of the
+            figure at the dpi attribute. The default is 128.
 
         Returns
         -------
         None.
 
         """
+        # gather the data and grid of each condition first, then fit every
+        # kde in one pass so the fits can be spread over a process pool
+        grids = []
+        jobs = []
+        keys = {}
+        cached = {}
+        
+        # range of the y axis, which the adaptive grid
+        # compares with the pixel height of the figure
+        finite = self._values[np.isfinite(self._values)]
+        y_span = finite.max() - finite.min() if finite.size > 0 else 0
         for group in self.subgroups:
-            px = []
-            norm_wy = []
-            min_cuts = []
-            max_cuts = []
+            grid = self._kde_grid(group, grid_mode, grid_points, bw, y_span)
+            arrays, points = grid[0], grid[3]
             
-            # get limits for fitting the kde 
-            for rep in self.unique_reps:
-                sub = self.df[(self.df[self.rep] == rep) &
-                              (self.df[self.x] == group)][self.y]
-                min_cuts.append(sub.min())
-                max_cuts.append(sub.max())
-            min_cuts = sorted(min_cuts)
-            max_cuts = sorted(max_cuts)
+            # skip conditions whose stripes were already fitted
+            # with the same data and settings
+            if cache is not None:
+                keys[group] = kde_key(arrays, bw=bw, kde_engine=kde_engine,
+                                      grid_mode=grid_mode, num=len(points))
+                cached[group] = cache.get(keys[group])
+                if cached[group] is not None:
+                    continue
+            grids.append(grid)
+            if grid_mode == "fixed":
+                jobs.append((arrays, points, bw, kde_engine))
+            else:
+                jobs.extend((arr, points, bw, kde_engine) for arr in arrays)
+        fit = batch_kde if grid_mode == "fixed" else evaluate_kde
+        results = iter(map_jobs(fit, jobs, n_jobs))
+        
+        factor = None
+        grids = iter(grids)
+        for group in self.subgroups:
+            if cached.get(group) is not None:
+                norm_wy, px, factor = cached[group]
+                if bw == None and factor is not None:
+                    print(f"Fitting KDE with Scott's Factor: {factor:.3f}")
+                self.subgroup_dict[group]["norm_wy"] = norm_wy
+                self.subgroup_dict[group]["px"] = px
+                continue
             
-            # make linespace of points from highest_min_cut to lowest_max_cut
-            points1 = list(np.linspace(np.nanmin(min_cuts),
-                                       np.nanmax(max_cuts),
-                                       num = 128))
-            points = sorted(list(set(min_cuts + points1 + max_cuts)))
+            grid = next(grids)
+            if grid_mode == "fixed":
+                norm_wy, px, factors = self._fixed_grid_kde(*grid, next(results))
+                factors = [f for f in factors if f is not None]
+            else:
+                fits = [next(results) for i in grid[0]]
+                norm_wy, px, factors = self._union_grid_kde(*grid, fits)
+            if len(factors) > 0:
+                factor = factors[-1]
+            self._store_kde_data(group, norm_wy, px, bw, factor)
+            if cache is not None:
+                cache.put(keys[group], self.subgroup_dict[group]["norm_wy"],
+                          self.subgroup_dict[group]["px"], factor)
+    
+    def _kde_grid(self, group, grid_mode="union", grid_points=128, bw=None,
+                  y_span=0):
+        """
+        Get the values of each replicate of a condition and the points
+        at which their kernel density estimators will be evaluated
+
+        Parameters
+        ----------
+        group : string
+            Categorical condition on the x axis
+        grid_mode : string
+            Either "union" or "fixed" as described in get_kde_data
+        grid_points : integer or string
+            Number of points or "adaptive" as described in get_kde_data
+        bw : float
+            Bandwidth factor of the kernel density estimators
+        y_span : float
+            Range of the y axis, used by the adaptive grid
+
+        Returns
+        -------
+        arrays : list of numpy arrays
+            Values of each replicate without NaN values
+        min_cuts : numpy array
+            Minimum of each replicate, NaN for empty replicates
+        max_cuts : numpy array
+            Maximum of each replicate, NaN for empty replicates
+        points : numpy array
+            Points at which to evaluate the kernel density estimators
+
+        """
+        arrays = []
+        for rep in self.unique_reps:
+            arr = self._replicate_values(group, rep)
             
-            for rep in self.unique_reps:
-                
-                # first point to catch an empty list
-                # caused by uneven rep numbers
-                try:
-                    sub = self.df[(self.df[self.rep] == rep) &
-                                  (self.df[self.x] == group)][self.y]
-                    arr = np.array(sub)
-                    
-                    # remove nan or inf values which 
-                    # could cause a kde ValueError
-                    arr = arr[~(np.isnan(arr))]
-                    kde = gaussian_kde(arr, bw_method=bw)
-                    kde_points = kde.evaluate(points)
-                    # kde_points = kde_points - np.nanmin(kde_points) #why?
-                    
-                    # use min and max to make the kde_points
-                    # outside that dataset = 0
-                    idx_min = min_cuts.index(arr.min())
-                    idx_max = max_cuts.index(arr.max())
-                    if idx_min > 0:
-                        for p in range(idx_min):
-                            kde_points[p] = 0
-                    for idx in range(idx_max - len(max_cuts), 0):
-                        if idx_max - len(max_cuts) != -1:
-                            kde_points[idx+1] = 0
-                    
-                    # remove nan prior to combining arrays into dictionary
-                    kde_wo_nan = self._interpolate_nan(kde_points)
-                    points_wo_nan = self._interpolate_nan(points)
-                    
-                    # normalize each stripe's area to a constant
-                    # so that they all have the same area when plotted
-                    area = 30
-                    kde_wo_nan = (area / sum(kde_wo_nan)) * kde_wo_nan
-                    
-                    norm_wy.append(kde_wo_nan)
-                    px.append(points_wo_nan)
-                except ValueError:
-                    norm_wy.append([])
-                    px.append(self._interpolate_nan(points))
-            px = np.array(px)
+            # remove nan or inf values which 
+            # could cause a kde ValueError
+            arrays.append(arr[~np.isnan(arr)])
+        
+        # get limits for fitting the kde
+        min_cuts = np.array([a.min() if a.size > 0 else np.nan for a in arrays])
+        max_cuts = np.array([a.max() if a.size > 0 else np.nan for a in arrays])
+        low, high = np.nanmin(min_cuts), np.nanmax(max_cuts)
+        if grid_points == "adaptive":
             
-            # print Scott's factor to the console to help users
-            # choose alternative values for bw
-            try:
-                if bw == None:
-                    scott = kde.scotts_factor()
-                    print(f"Fitting KDE with Scott's Factor: {scott:.3f}")
-            except UnboundLocalError:
-                pass
+            # the narrowest kernel sets the finest detail worth computing
+            # and the figure sets the finest detail that can be drawn
+            bandwidths = [np.std(a, ddof=1) * kde_factor(a.size, bw)
+                          for a in arrays if a.size > 1]
+            bandwidths = [h for h in bandwidths if h > 0]
+            pixels = FIG_HEIGHT * self.dpi
+            if y_span > 0:
+                pixels *= (high - low) / y_span
+            grid_points = adaptive_grid_points(high - low,
+                                               min(bandwidths, default=0),
+                                               pixels)
+        points = np.linspace(low, high, num=grid_points)
+        if grid_mode != "fixed":
             
-            # catch the error when there is an empty list added to the dictionary
-            length = max([len(e) for e in norm_wy])
+            # add the limits of each replicate so every stripe
+            # starts and ends on a point
+            limits = np.append(min_cuts, max_cuts)
+            limits = limits[~np.isnan(limits)]
+            points = np.array(sorted(set(limits.tolist() + points.tolist())))
+        return arrays, min_cuts, max_cuts, points
+    
+    def _union_grid_kde(self, arrays, min_cuts, max_cuts, points, fits):
+        """
+        Set the density of each replicate of a condition to zero outside its
+        range and normalize the area of each stripe
+
+        Parameters
+        ----------
+        arrays : list of numpy arrays
+            Values of each replicate without NaN values
+        min_cuts : numpy array
+            Minimum of each replicate
+        max_cuts : numpy array
+            Maximum of each replicate
+        points : numpy array
+            Points at which the kernel density estimators were evaluated
+        fits : list
+            Density and bandwidth factor of each replicate, or the ValueError
+            raised when fitting it
+
+        Returns
+        -------
+        norm_wy : numpy array
+            Area-normalized density of each replicate (rows) at each point
+        px : numpy array
+            The points repeated for each replicate
+        factors : list
+            Bandwidth factor of each fitted replicate
+
+        """
+        px = []
+        norm_wy = []
+        factors = []
+        min_cuts = sorted(min_cuts.tolist())
+        max_cuts = sorted(max_cuts.tolist())
+        for arr, fit in zip(arrays, fits):
             
-            # rescale norm_wy for display purposes
-            norm_wy = [a if len(a) > 0 else np.zeros(length) for a in norm_wy]
-            norm_wy = np.array(norm_wy)
-            norm_wy = np.cumsum(norm_wy, axis = 0)
+            # first point to catch an empty list
+            # caused by uneven rep numbers
             try:
-                norm_wy = norm_wy / np.nanmax(norm_wy) # [0,1]
+                if isinstance(fit, ValueError):
+                    raise fit
+                kde_points, factor = fit
+                factors.append(factor)
+                
+                # use min and max to make the kde_points
+                # outside that dataset = 0
+                idx_min = min_cuts.index(arr.min())
+                idx_max = max_cuts.index(arr.max())
+                if idx_min > 0:
+                    for p in range(idx_min):
+                        kde_points[p] = 0
+                for idx in range(idx_max - len(max_cuts), 0):
+                    if idx_max - len(max_cuts) != -1:
+                        kde_points[idx+1] = 0
+                
+                # remove nan prior to combining arrays into dictionary
+                kde_wo_nan = self._interpolate_nan(kde_points)
+                
+                # normalize each stripe's area to a constant
+                # so that they all have the same area when plotted
+                area = 30
+                kde_wo_nan = (area / sum(kde_wo_nan)) * kde_wo_nan
+                
+                norm_wy.append(kde_wo_nan)
             except ValueError:
-                print("Failed to normalize y values")
-            
-            # update the dictionary with the normalized data
-            # and corresponding x points
-            self.subgroup_dict[group]["norm_wy"] = norm_wy
-            self.subgroup_dict[group]["px"] = px
+                norm_wy.append(np.zeros(len(points)))
+            px.append(points)
+        return np.array(norm_wy), np.array(px), factors
+    
+    def _fixed_grid_kde(self, arrays, min_cuts, max_cuts, points, fit):
+        """
+        Set the density of each replicate of a condition to zero outside its
+        range and normalize the area of each stripe
+
+        Parameters
+        ----------
+        arrays : list of numpy arrays
+            Values of each replicate without NaN values
+        min_cuts : numpy array
+            Minimum of each replicate
+        max_cuts : numpy array
+            Maximum of each replicate
+        points : numpy array
+            Points at which the kernel density estimators were evaluated
+        fit : tuple
+            Density of each replicate (rows) at each point and the bandwidth
+            factor of each replicate, as returned by batch_kde
+
+        Returns
+        -------
+        norm_wy : numpy array
+            Area-normalized density of each replicate (rows) at each point
+        px : numpy array
+            The grid points repeated for each replicate
+        factors : list
+            Bandwidth factor of each replicate, or None if it was not fitted
+
+        """
+        norm_wy, factors = fit
+        
+        # use min and max of each replicate to mask the
+        # density outside that dataset
+        outside = ((points[None, :] < min_cuts[:, None]) |
+                   (points[None, :] > max_cuts[:, None]))
+        norm_wy[outside] = 0
+        
+        # normalize each stripe's area to a constant
+        # so that they all have the same area when plotted
+        area = 30
+        totals = norm_wy.sum(axis=1, keepdims=True)
+        np.divide(area * norm_wy, totals, out=norm_wy, where=totals > 0)
+        px = np.tile(points, (len(arrays), 1))
+        return norm_wy, px, factors
+    
+    def _store_kde_data(self, group, norm_wy, px, bw=None, factor=None):
+        """
+        Stack the area-normalized densities of the replicates of a condition,
+        rescale them for display and add them to the subgroup_dict attribute
+
+        Parameters
+        ----------
+        group : string
+            Categorical condition on the x axis
+        norm_wy : numpy array
+            Area-normalized density of each replicate (rows) at each point
+        px : numpy array
+            Points at which the densities were evaluated for each replicate
+        bw : float
+            Bandwidth factor of the kernel density estimators
+        factor : float
+            Bandwidth factor used for the last fitted replicate
+
+        Returns
+        -------
+        None.
+
+        """
+        # print Scott's factor to the console to help users
+        # choose alternative values for bw
+        if bw == None and factor is not None:
+            print(f"Fitting KDE with Scott's Factor: {factor:.3f}")
+        
+        # rescale norm_wy for display purposes
+        norm_wy = np.cumsum(norm_wy, axis = 0)
+        try:
+            norm_wy = norm_wy / np.nanmax(norm_wy) # [0,1]
+        except ValueError:
+            print("Failed to normalize y values")
+        
+        # update the dictionary with the normalized data
+        # and corresponding x points
+        self.subgroup_dict[group]["norm_wy"] = norm_wy
+        self.subgroup_dict[group]["px"] = px
     
     @staticmethod
     def _interpolate_nan(arr):
@@ -367,10 +1205,92 @@ class Superviolin:
             arr[nan_idx[0][0]] = arr[nan_idx[0][0] + 1] - median_val
         return arr
     
+    def make_figure(self, pyplot=False):
+        """
+        Create a figure sized for the conditions of this Violin SuperPlot
+
+        Parameters
+        ----------
+        pyplot : bool, optional
+            True to create the figure with pyplot so it can be shown with
+            plt.show. The default False creates a standalone figure which
+            does not touch the pyplot global state.
+
+        Returns
+        -------
+        fig : matplotlib Figure
+            The new figure
+        ax : matplotlib Axes
+            Axes of the new figure with the style attribute applied
+
+        """
+        figsize = (1 + len(self.subgroups) / 2, FIG_HEIGHT)
+        dpi = self.style.get("figure.dpi")
+        if pyplot:
+            import matplotlib.pyplot as plt
+            fig = plt.figure(figsize=figsize, dpi=dpi)
+        else:
+            from matplotlib.figure import Figure
+            fig = Figure(figsize=figsize, dpi=dpi)
+        ax = fig.add_subplot()
+        self._apply_style(ax)
+        return fig, ax
+    
+    def _apply_style(self, ax):
+        """
+        Apply the style attribute to the axes of a Violin SuperPlot
+
+        Parameters
+        ----------
+        ax : matplotlib Axes
+            Axes of the Violin SuperPlot
+
+        Returns
+        -------
+        None.
+
+        """
+        style = self.style
+        for axis in ("x", "y"):
+            if f"{axis}tick.labelsize" in style:
+                ax.tick_params(axis=axis, labelsize=style[f"{axis}tick.labelsize"])
+            for which in ("major", "minor"):
+                key = f"{axis}tick.{which}.width"
+                if key in style:
+                    ax.tick_params(axis=axis, which=which, width=style[key])
+        for side, spine in ax.spines.items():
+            if f"axes.spines.{side}" in style:
+                spine.set_visible(style[f"axes.spines.{side}"])
+            if "axes.linewidth" in style:
+                spine.set_linewidth(style["axes.linewidth"])
+    
+    def savefig(self, fname, **kwargs):
+        """
+        Save the Violin SuperPlot at the dpi attribute
+
+        Parameters
+        ----------
+        fname : string or file-like object
+            Where to save the figure
+        **kwargs
+            Further arguments for matplotlib's Figure.savefig
+
+        Returns
+        -------
+        None.
+
+        """
+        kwargs.setdefault("dpi", self.dpi)
+        self.fig.savefig(fname, **kwargs)
+    
     def _single_subgroup_plot(self, group, axis_point, mid_df,
-                              total_width, linewidth):
+                              total_width, linewidth, artists):
         """
-        Plot a Violin SuperPlot for the given condition
+        Add the stripes, separating lines, outline and replicate markers of
+        the Violin SuperPlot for the given condition to the artists that
+        plot_subgroups draws as collections. Their x values are kept for a
+        width of 1 with the axis point of each, so the plot can be redrawn
+        at another width
 
         Parameters
         ----------
@@ -386,23 +1306,16 @@ class Superviolin:
         linewidth : float
             Width value for the outlines of each Violin SuperPlot and the 
             summary statistics skeleton plot
+        artists : dictionary
+            Lists of stripe polygons and colours, line segments, whether
+            each line is an outline, and marker positions and colours for
+            the whole plot, with the axis point of each
 
         Returns
         -------
         None.
 
         """
-        
-        # select scatter size based on number of replicates
-        scatter_sizes = [10, 8, 6, 4]
-        if len(self.unique_reps) < 3:
-            num = 0 
-        elif len(self.unique_reps) > len(scatter_sizes):
-            num = -1
-        else:
-            num = len(self.unique_reps) - 3
-        scatter_size = scatter_sizes[num]
-        
         norm_wy = self.subgroup_dict[group]["norm_wy"]
         px = self.subgroup_dict[group]["px"]
         right_sides = np.array([norm_wy[-1]*-1 + i*2 for i in norm_wy])
@@ -422,56 +1335,84 @@ class Superviolin:
         # use last array to plot the outline
         outline_y = np.append(px[-1], np.flipud(px[-1]))
         append_param = np.flipud(norm_wy[-1]) * -1
-        outline_x = np.append(norm_wy[-1],
-                              append_param)*total_width + axis_point
-        
-        # Temporary fix; find original source of the
-        # bug and correct when time allows
-        if outline_x[0] != outline_x[-1]:
-            xval = round(outline_x[0], 4)
-            yval = outline_y[0]
-            outline_x = np.insert(outline_x, 0, xval)
-            outline_x = np.insert(outline_x, outline_x.size, xval)
-            outline_y = np.insert(outline_y, 0, yval)
-            outline_y = np.insert(outline_y, outline_y.size, yval)
-        
-        for i,a in enumerate(self.unique_reps):
+        outline_x = np.append(norm_wy[-1], append_param)
+        
+        for i in range(len(self.unique_reps)):
             reshaped_x = np.append(px[i-1], np.flipud(px[i-1]))
-            mid_val = mid_df[mid_df[self.rep] == a][self.y].values
-            reshaped_y = new_wy[i] * total_width  + axis_point
             
-            # check if _on_legend contains the rep
-            if a in self._on_legend:
-                lbl = ""
-            else:
-                lbl = a
-                self._on_legend.append(a)
-            
-            # plot separating lines and stripes
-            plt.plot(reshaped_y, reshaped_x, c="k",
-                     linewidth=self.sep_linewidth)
-            plt.fill(reshaped_y, reshaped_x, color=self.colours[i],
-                     label=lbl, linewidth=self.sep_linewidth,)
+            # separating lines and stripes
+            stripe = np.column_stack([new_wy[i], reshaped_x])
+            artists["lines"].append(stripe)
+            artists["line_points"].append(axis_point)
+            artists["outlines"].append(False)
+            artists["stripes"].append(stripe)
+            artists["stripe_points"].append(axis_point)
+            artists["stripe_colours"].append(self.colours[i])
+        
+        # place the middle value of each replicate halfway between the
+        # edges of its stripe; replicates without a middle value are NaN
+        mid_vals = mid_df.groupby(self.rep, sort=False)[self.y].first()
+        mid_vals = mid_vals.reindex(self.unique_reps).to_numpy(float)
+        edges = np.vstack([norm_wy[-1]*-1, right_sides])
+        centres = (edges[:-1] + edges[1:]) / 2
+        x_vals = self._interpolate_rows(centres, px[0], mid_vals)
+        for i in np.flatnonzero(~np.isnan(mid_vals)):
+            artists["markers"].append((x_vals[i], mid_vals[i]))
+            artists["marker_points"].append(axis_point)
+            artists["marker_colours"].append(self.colours[i])
+        artists["lines"].append(np.column_stack([outline_x, outline_y]))
+        artists["line_points"].append(axis_point)
+        artists["outlines"].append(True)
+    
+    def _scale_artists(self, total_width):
+        """
+        Place the stripes, lines and replicate markers gathered by
+        _single_subgroup_plot for the given width of each violin
+
+        Parameters
+        ----------
+        total_width : float
+            Half the width of each Violin SuperPlot
+
+        Returns
+        -------
+        stripes : list of numpy arrays
+            Polygon of each stripe
+        lines : list of numpy arrays
+            Points of each separating line and outline
+        markers : numpy array
+            Position of each replicate marker
+
+        """
+        artists = self._artists
+        stripes = [np.column_stack([s[:, 0] * total_width + point, s[:, 1]])
+                   for s, point in zip(artists["stripes"],
+                                       artists["stripe_points"])]
+        lines = []
+        for line, point, outline in zip(artists["lines"],
+                                        artists["line_points"],
+                                        artists["outlines"]):
+            line_x = line[:, 0] * total_width + point
+            line_y = line[:, 1]
             
-            # get the mid_val each replicate and find it in reshaped_x
-            # then get corresponding point in reshaped_x to plot the points
-            if mid_val.size > 0: # account for empty mid_val
-                arr = reshaped_x[np.logical_not(np.isnan(reshaped_x))]
-                nearest = self._find_nearest(arr, mid_val[0])
-                
-                # find the indices of nearest in new_wy
-                # there will be two because new_wy is a loop
-                idx = np.where(reshaped_x == nearest)
-                x_vals = reshaped_y[idx]
-                x_val = x_vals[0] + ((x_vals[1] - x_vals[0]) / 2)
-                plt.scatter(x_val, mid_val[0], facecolors=self.colours[i],
-                            edgecolors="Black", linewidth=self.sep_linewidth,
-                            zorder=10, marker="o", s=scatter_size)
-        plt.plot(outline_x, outline_y, color="Black", linewidth=linewidth)
+            # Temporary fix; find original source of the
+            # bug and correct when time allows
+            if outline and line_x[0] != line_x[-1]:
+                xval = round(line_x[0], 4)
+                yval = line_y[0]
+                line_x = np.insert(line_x, 0, xval)
+                line_x = np.insert(line_x, line_x.size, xval)
+                line_y = np.insert(line_y, 0, yval)
+                line_y = np.insert(line_y, line_y.size, yval)
+            lines.append(np.column_stack([line_x, line_y]))
+        markers = np.array(artists["markers"]).reshape(-1, 2)
+        markers[:, 0] = (markers[:, 0] * total_width
+                         + np.array(artists["marker_points"]))
+        return stripes, lines, markers
         
     def plot_subgroups(self, centre_val="mean", middle_vals="mean", error_bars="SEM",
                        ylimits="None", total_width=0.8, linewidth=1,
-                       show_stats="no", show_legend="no"):
+                       show_stats="no", show_legend="no", ax=None):
         """
         Plot all subgroups of the df attribute
 
@@ -485,7 +1426,8 @@ class Superviolin:
         error_bars : string
             Method for displaying error bars in the skeleton plot. Either SEM
             for standard error of the mean, SD for standard deviation,
-            or CI for 95% confidence intervals
+            bootstrap for 95% percentile bootstrap confidence intervals of
+            the centre value, or CI for normal 95% confidence intervals
         ylimits : string
             User-specified ylimits in the form (lower, upper) where lower and 
             upper are float values
@@ -498,121 +1440,256 @@ class Superviolin:
             Either "yes" or "no" to overlay the statistics on the plot
         show_legend : bool
             True to show a legend on the generated plot
+        ax : matplotlib Axes, optional
+            Axes to draw on. The default None creates a new pyplot figure.
 
         Returns
         -------
         None.
 
         """
-        width = 1 + len(self.subgroups) / 2
-        height = 5 / 2.54
-        plt.figure(figsize=(width, height))
+        if ax is None:
+            self.fig, self.ax = self.make_figure(pyplot=True)
+        else:
+            self.fig, self.ax = ax.figure, ax
+            self._apply_style(ax)
+        ax = self.ax
         ticks = []
         lbls = []
         
+        # stripes, lines and markers of every condition are gathered
+        # here and drawn as one collection of each kind
+        artists = {"stripes" : [], "stripe_points" : [],
+                   "stripe_colours" : [], "lines" : [], "line_points" : [],
+                   "outlines" : [], "markers" : [], "marker_points" : [],
+                   "marker_colours" : []}
+        self._artists = artists
+        skeleton = []
+        
         # width of the bars
         median_width = 0.4
+        
+        # summarize the replicate middle values of all conditions at once
+        centres, _ = self._replicate_summary(middle_vals)
+        rows = [self._x_lookup.get(a) for a in self.subgroups]
+        group_centres = np.array([centres[r] if r is not None
+                                  else np.full(len(self.unique_reps), np.nan)
+                                  for r in rows]).reshape(len(rows), -1)
+        stats = skeleton_stats(group_centres)
+        if error_bars == "bootstrap":
+            boot_lower, boot_upper = bootstrap_intervals(
+                group_centres, "median" if centre_val == "median" else "mean",
+                self.bootstrap_samples, seed=self.bootstrap_seed,
+                n_jobs=self.n_jobs)
         for i,a in enumerate(self.subgroups):
             ticks.append(i*2)
             lbls.append(a)            
             
-            # calculate the mean/median value for
-            # all replicates of the variable
-            sub = self.df[self.df[self.x] == a]
-            
-            # robust mean calculates mean using data
-            # between the 2.5 and 97.5 percentiles
-            if middle_vals == "robust":
-                
-                # loop through replicates in sub
-                subs = []
-                for rep in sub[self.rep].unique():
-                    
-                    # drop rows containing NaN values as
-                    # they mess up the subsetting
-                    s = sub[sub[self.rep] == rep].dropna()
-                    lower = np.percentile(s[self.y], 2.5)
-                    upper = np.percentile(s[self.y], 97.5)
-                    s = s.query(f"{lower} <= {self.y} <= {upper}")
-                    subs.append(s)
-                sub = pd.concat(subs)
-                middle_vals = "mean"
-            
-            # calculate mean from remaining data
-            means = sub.groupby(self.rep,
-                                as_index=False).agg({self.y : middle_vals})
+            # the mean/median value for all replicates of the variable
+            means = self._replicate_middles(a, middle_vals)
             self._single_subgroup_plot(a, i*2, mid_df=means,
                                        total_width=total_width,
-                                       linewidth=linewidth)
+                                       linewidth=linewidth, artists=artists)
             
             # get mean or median line of the skeleton plot
             if centre_val == "mean":
-                mid_val = means[self.y].mean()
+                mid_val = stats["mean"][i]
             else:
-                mid_val = means[self.y].median()
+                mid_val = stats["median"][i]
             
             # get error bars for the skeleton plot
             if error_bars == "SEM":
-                sem = means[self.y].sem()
-                upper = mid_val + sem
-                lower = mid_val - sem
+                upper = mid_val + stats["sem"][i]
+                lower = mid_val - stats["sem"][i]
             elif error_bars == "SD":
-                upper = mid_val + means[self.y].std()
-                lower = mid_val - means[self.y].std()
+                upper = mid_val + stats["std"][i]
+                lower = mid_val - stats["std"][i]
+            elif error_bars == "bootstrap":
+                lower, upper = boot_lower[i], boot_upper[i]
             else:
-                lower, upper = norm.interval(0.95, loc=means[self.y].mean(),
-                                      scale=means[self.y].std())
+                from scipy.stats import norm
+                lower, upper = norm.interval(0.95, loc=stats["mean"][i],
+                                             scale=stats["std"][i])
             
-            # plot horizontal lines across the column, centered on the tick
-            plt.plot([i*2 - median_width / 1.5, i*2 + median_width / 1.5],
-                         [mid_val, mid_val], lw=linewidth, color="k",
-                         zorder=20)
+            # horizontal lines across the column, centered on the tick
+            skeleton.append([(i*2 - median_width / 1.5, mid_val),
+                             (i*2 + median_width / 1.5, mid_val)])
             for b in [upper, lower]:
-                plt.plot([i*2 - median_width / 4.5, i*2 + median_width / 4.5],
-                         [b, b], lw=linewidth, color="k", zorder=20)
+                skeleton.append([(i*2 - median_width / 4.5, b),
+                                 (i*2 + median_width / 4.5, b)])
             
-            # plot vertical lines connecting the limits
-            plt.plot([i*2, i*2], [lower, upper], lw=linewidth, color="k",
-                     zorder=20)
+            # vertical lines connecting the limits
+            skeleton.append([(i*2, lower), (i*2, upper)])
+        
+        # draw stripes below the separating lines and outlines,
+        # with the replicate markers and the skeleton plot on top
+        from matplotlib.collections import LineCollection, PolyCollection
+        stripe_verts, line_verts, markers = self._scale_artists(total_width)
+        stripes = PolyCollection(stripe_verts,
+                                 facecolors=artists["stripe_colours"],
+                                 edgecolors=artists["stripe_colours"],
+                                 linewidths=self.sep_linewidth, zorder=1,
+                                 gid="stripes")
+        # lines keep the projecting caps and round joins of
+        # the separate lines they were once drawn as
+        lines = LineCollection(line_verts, colors="k",
+                               linewidths=self._line_widths(linewidth),
+                               capstyle="projecting", joinstyle="round",
+                               zorder=2, gid="outlines")
+        skeleton = LineCollection(skeleton, colors="k", linewidths=linewidth,
+                                  capstyle="projecting", joinstyle="round",
+                                  zorder=20, gid="skeleton")
+        for collection in (stripes, lines, skeleton):
+            ax.add_collection(collection)
+        self._collections = {"stripes" : stripes, "outlines" : lines,
+                             "skeleton" : skeleton}
+        if len(markers) > 0:
+            self._collections["markers"] = ax.scatter(
+                markers[:, 0], markers[:, 1],
+                facecolors=artists["marker_colours"], edgecolors="Black",
+                linewidth=self.sep_linewidth, zorder=10, marker="o",
+                s=self._scatter_size(), gid="markers")
+        ax.autoscale_view()
         
         # add legend
+        self._show_legend = show_legend
         if show_legend != "no":
-            plt.legend(loc=1, bbox_to_anchor=(1.1,1.1))
+            self._add_legend(ax)
         
-        plt.xticks(ticks, lbls)
-        plt.xlabel(self.xlabel)
-        plt.ylabel(self.ylabel)
-        plt.tight_layout()
+        ax.set_xticks(ticks)
+        ax.set_xticklabels(lbls)
+        ax.set_xlabel(self.xlabel, fontsize=self.style.get("axes.labelsize"))
+        ax.set_ylabel(self.ylabel, fontsize=self.style.get("axes.labelsize"))
+        self.fig.tight_layout()
         if ylimits != "None":
-            lims = (float(i) for i in ylimits.split(", "))
-            plt.ylim(lims)
+            lims = [float(i) for i in ylimits.split(", ")]
+            ax.set_ylim(lims)
+        
+    def _line_widths(self, linewidth):
+        """
+        Width of each line drawn by plot_subgroups, where outlines use
+        linewidth and separating lines use the sep_linewidth attribute
+        """
+        return [linewidth if outline else self.sep_linewidth
+                for outline in self._artists["outlines"]]
+    
+    def _add_legend(self, ax):
+        """
+        Add a legend listing the colour of each replicate to the axes
+
+        Parameters
+        ----------
+        ax : matplotlib Axes
+            Axes of the Violin SuperPlot
+
+        Returns
+        -------
+        None.
+
+        """
+        from matplotlib.patches import Patch
+        handles = [Patch(facecolor=c, edgecolor=c, label=rep,
+                         linewidth=self.sep_linewidth)
+                   for rep, c in zip(self.unique_reps, self.colours)]
+        ax.legend(handles=handles, loc=1, bbox_to_anchor=(1.1,1.1),
+                  fontsize=self.style.get("legend.fontsize"))
+    
+    def _redraw(self):
+        """
+        Update the widths, line widths, labels and style of the drawn
+        Violin SuperPlot in place, without fitting or plotting it again
+
+        Returns
+        -------
+        None.
+
+        """
+        ax = self.ax
+        collections = self._collections
+        stripes, lines, markers = self._scale_artists(self.total_width)
+        collections["stripes"].set_verts(stripes)
+        collections["stripes"].set_linewidths(self.sep_linewidth)
+        collections["outlines"].set_segments(lines)
+        collections["outlines"].set_linewidths(
+            self._line_widths(self.linewidth))
+        collections["skeleton"].set_linewidths(self.linewidth)
+        if "markers" in collections:
+            collections["markers"].set_offsets(markers)
+            collections["markers"].set_linewidths(self.sep_linewidth)
+        if self._show_legend != "no":
+            self._add_legend(ax)
         
+        # only the x limits follow the new width, as the y limits may
+        # have been set for the statistics or by the user
+        ax.ignore_existing_data_limits = True
+        ax.update_datalim(np.concatenate(stripes + lines))
+        ax.autoscale_view(scaley=False)
+        self._apply_style(ax)
+        ax.set_xlabel(self.xlabel, fontsize=self.style.get("axes.labelsize"))
+        ax.set_ylabel(self.ylabel, fontsize=self.style.get("axes.labelsize"))
+        self.fig.tight_layout()
+    
+    def _scatter_size(self):
+        """
+        Select the size of the replicate markers based on the number
+        of replicates
+
+        Returns
+        -------
+        integer
+            Marker size in points squared
+
+        """
+        scatter_sizes = [10, 8, 6, 4]
+        if len(self.unique_reps) < 3:
+            num = 0 
+        elif len(self.unique_reps) > len(scatter_sizes):
+            num = -1
+        else:
+            num = len(self.unique_reps) - 3
+        return scatter_sizes[num]
+    
     @staticmethod
-    def _find_nearest(array, value):
+    def _interpolate_rows(rows, grid, values):
         """
-        Helper function to find the value of an array nearest to the input
-        value argument
+        Linearly interpolate each row of an array at its own value, using
+        a single np.searchsorted call on the shared grid
 
         Parameters
         ----------
-        array : numpy array
-            array of x co-ordinates from the fitted kde
-        value : float
-            the middle value of 
+        rows : numpy array
+            Values of each row (rows) at each grid point (columns)
+        grid : numpy array
+            Increasing points shared by all rows
+        values : numpy array
+            Point at which to interpolate each row. Points outside the grid
+            are clipped to its ends and NaN values give NaN
 
         Returns
         -------
-        float
-            nearest value in array to the input value argument
+        numpy array
+            Interpolated value of each row
 
         """
-        array = np.asarray(array)
-        idx = (np.abs(array - value)).argmin()
-        return array[idx]
+        values = np.clip(values, grid[0], grid[-1])
+        right = np.clip(np.searchsorted(grid, values), 1, grid.size - 1)
+        left = right - 1
+        step = grid[right] - grid[left]
+        frac = np.divide(values - grid[left], step,
+                         out=np.zeros_like(values), where=step > 0)
+        
+        # NaN values still index a valid point so the result can be masked
+        nan = np.isnan(values)
+        right[nan] = left[nan] = 0
+        rows_idx = np.arange(len(rows))
+        result = (rows[rows_idx, left] * (1 - frac) 
+                  + rows[rows_idx, right] * frac)
+        result[nan] = np.nan
+        return result
     
     def get_statistics(self, centre_val="mean", paired="no",
                        on_plot="yes", ylimits="None",
-                       return_=False):
+                       return_=False, ax=None, control="None"):
         """
         Determine appropriate statistics for the dataset, output statistics in
         txt file if there are 3 or more groups, and overlay on plot (optional).
@@ -633,30 +1710,84 @@ class Superviolin:
             upper are float values. The default is "None".
         return_ : bool
             Whether to return the statistics data or not
+        ax : matplotlib Axes, optional
+            Axes to overlay the statistics on. The default None uses the
+            axes drawn on by plot_subgroups, if any.
+        control : string, optional
+            Condition compared with every other condition by Dunnett's test
+            when there are 3 or more groups. The default "None" compares
+            every pair of conditions by Tukey's test.
             
         Returns
         -------
         if return_ == True, return statistics
 
+        """
+        p, posthoc = self._compute_statistics(centre_val, paired, return_,
+                                              control)
+        self.overlay_statistics(p, posthoc, on_plot, ylimits, ax, control)
+        if return_:
+            if len(self.subgroups) == 2:
+                return p, paired
+            else:
+                return p, posthoc
+    
+    def _compute_statistics(self, centre_val="mean", paired="no",
+                            return_=False, control="None"):
+        """
+        Compare the conditions of the dataset and report the results,
+        saving the posthoc tests to a txt file if they are not returned
+
+        Parameters
+        ----------
+        centre_val : string, optional
+            Central measure of each replicate. The default is "mean".
+        paired : string, optional
+            Either "yes" or "no" if the data are paired.
+            The default is "no".
+        return_ : bool
+            Whether the statistics data will be returned
+        control : string, optional
+            Condition compared with every other condition.
+            The default is "None".
+
+        Returns
+        -------
+        p : float
+            P-value of the test
+        posthoc : Pandas DataFrame or None
+            P-values of the posthoc tests rounded to 3 decimal places, if
+            there are 3 or more groups
+
         """
         if centre_val == "robust":
-            means = self.df.groupby([self.rep, self.x],
-                                    as_index=False).agg({self.y : "mean"})
-        else:
-            means = self.df.groupby([self.rep, self.x],
-                                    as_index=False).agg({self.y : centre_val})
-        data = [list(means[means[self.x] == i][self.y]) for i in means[self.x].unique()]
+            centre_val = "mean"
+        
+        # replicate means of the plotted conditions in their order,
+        # taken from the grouped index, so the tests compare the
+        # conditions on the plot as compute_statistics does
+        means = []
+        for group in self.subgroups:
+            mid_df = self._replicate_middles(group, centre_val)
+            mid_df[self.x] = group
+            means.append(mid_df)
+        means = pd.concat(means, ignore_index=True)
         
         num_groups = len(self.subgroups)
+        if control == "None":
+            control = None
+        from superviolin.stats import compare_conditions
+        result = compare_conditions(means, self.x, self.y, paired, num_groups,
+                                    control)
+        p = result["p_value"]
+        posthoc = result["posthoc"]
         
         if num_groups > 2:
-            # compute one-way ANOVA test results
-            stat, p = f_oneway(*data)
-            
-            # use tukey to compare all groups with Bonferroni correction
-            posthoc = sp.posthoc_tukey(means, self.y, self.x)
             print(f"One-way ANOVA P-value: {p:.3f}")
-            print("Tukey posthoc tests conducted")
+            if control is None:
+                print("Tukey posthoc tests conducted")
+            else:
+                print(f"Dunnett posthoc tests against {control} conducted")
             
             # round p values to 3 decimal places in posthoc tests
             posthoc = posthoc.round(3)
@@ -665,28 +1796,52 @@ class Superviolin:
                 posthoc.to_csv(f"posthoc_statistics_{self.y}.txt", sep="\t")
                 print("Posthoc statistics saved to txt file")
         elif num_groups == 2:
-            if paired == "no":
-                # independent t-test
-                stat, p = ttest_ind(data[0], data[1])
-                if p < 0.0001:
-                    print(f"Independent t-test P-value: {p:.2e}")
-                else:
-                    print(f"Independent t-test P-value: {p:.3f}")
+            if p < 0.0001:
+                print(f"{result['test']} P-value: {p:.2e}")
             else:
-                # paired t-test
-                stat, p = ttest_rel(data[0], data[1])
-                if p < 0.0001:
-                    print(f"Paired t-test P-value: {p:.2e}")
-                else:
-                    print(f"Paired t-test P-value: {p:.3f}")
+                print(f"{result['test']} P-value: {p:.3f}")
         else:
-            stat = "Can't run statistics for only 1 replicate"
-            p = stat
             print(p)
+        return p, posthoc
+    
+    def overlay_statistics(self, p, posthoc, on_plot="yes", ylimits="None",
+                           ax=None, control="None"):
+        """
+        Overlay the P-values of 2 or 3 groups on the plot, such as those
+        computed by superviolin.stats.compute_statistics
+
+        Parameters
+        ----------
+        p : float
+            P-value of the test
+        posthoc : Pandas DataFrame or None
+            P-values of the posthoc tests
+        on_plot : string, optional
+            Either "yes" or "no" to put overlay the statistics on the plot.
+            The default is "yes".
+        ylimits : string, optional
+            User-specified ylimits in the form (lower, upper).
+            The default is "None".
+        ax : matplotlib Axes, optional
+            Axes to overlay the statistics on. The default None uses the
+            axes drawn on by plot_subgroups, if any.
+        control : string, optional
+            Condition compared with every other condition.
+            The default is "None".
+
+        Returns
+        -------
+        None.
+
+        """
+        num_groups = len(self.subgroups)
+        if control == "None":
+            control = None
             
         # plot statistics if only 2 or 3 groups
-        if on_plot == "yes" and num_groups in [2, 3]:
-            ax = plt.gca()
+        if ax is None:
+            ax = self.ax
+        if on_plot == "yes" and num_groups in [2, 3] and ax is not None:
             low, high = ax.get_ylim()
             span = high - low
             increment = span * 0.03 # add high to get the new y value
@@ -695,12 +1850,12 @@ class Superviolin:
                 x1, x2 = 0, 2
                 y = increment + high
                 h = y + increment
-                plt.plot([x1, x1, x2, x2], [y, h, h, y], lw=1, c="k")
-                plt.text((x1+x2)*.5, h, f"P = {p:.3f}", ha="center",
-                         va="bottom", color="k", fontsize=8)
-                plt.ylim((low, high+increment*10))
+                ax.plot([x1, x1, x2, x2], [y, h, h, y], lw=1, c="k")
+                ax.text((x1+x2)*.5, h, f"P = {p:.3f}", ha="center",
+                        va="bottom", color="k", fontsize=8)
+                ax.set_ylim((low, high+increment*10))
             elif num_groups == 3:
-                labels = [i._text for i in ax.get_xticklabels()]
+                labels = [i.get_text() for i in ax.get_xticklabels()]
                 pairs = ((0, 1), (1, 2), (0, 2))
                 # increment = 3% of the range of the y-axis
                 y = increment + high 
@@ -709,7 +1864,14 @@ class Superviolin:
                 for i,pair in enumerate(pairs):
                     # get posthoc statistic for each comparison
                     condition1, condition2 = [labels[i] for i in pair]
-                    pval = posthoc.loc[condition1, condition2]
+                    if control is None:
+                        pval = posthoc.loc[condition1, condition2]
+                    elif control in (condition1, condition2):
+                        # only comparisons with the control were made
+                        other = condition2 if condition1 == control else condition1
+                        pval = posthoc.loc[other, control]
+                    else:
+                        continue
                     x1, x2 = [i * 2 for i in pair]
                     
                     # calculate values for lines and locating p-values on plot
@@ -717,18 +1879,12 @@ class Superviolin:
                     y += increment * 5
                     
                     # plot the posthoc p-values and lines
-                    plt.plot([x1, x1, x2, x2], [h, y, y, h], lw=1, c="Black")
-                    plt.text((x1+x2)/2, y, f"P = {pval:.3f}", ha=text_loc[i],
-                             va="bottom", color="Black", fontsize=8)
-                plt.ylim((low, low + span * 1.5))
+                    ax.plot([x1, x1, x2, x2], [h, y, y, h], lw=1, c="Black")
+                    ax.text((x1+x2)/2, y, f"P = {pval:.3f}", ha=text_loc[i],
+                            va="bottom", color="Black", fontsize=8)
+                ax.set_ylim((low, low + span * 1.5))
             if ylimits != "None":
-                lims = (float(i) for i in ylimits.split(", "))
-                plt.ylim(lims)
-            plt.tight_layout()
-        
-        if return_:
-            if num_groups == 2:
-                return p, paired
-            else:
-                return p, posthoc
+                lims = [float(i) for i in ylimits.split(", ")]
+                ax.set_ylim(lims)
+            ax.figure.tight_layout()
             
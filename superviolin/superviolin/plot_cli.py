@@ -8,14 +8,16 @@ Created on Sat Jan 9 13:49:42 2021
 
 import io
 import os
+import sys
 import pkgutil
 import click
-import unittest
-import pandas as pd
-import matplotlib.pyplot as plt
+import json
 from appdirs import AppDirs
-from superviolin import test_plot
-from superviolin.plot import Superviolin
+from superviolin import benchmark
+
+# numpy, pandas, scipy, matplotlib and the modules which use them are
+# imported by the commands which need them, so --help and init start fast
+# and the stats command never loads matplotlib
 
 def process_txt(txt):
     """
@@ -47,6 +49,30 @@ def process_txt(txt):
                 arg_dict[k] = v
     return arg_dict
 
+def read_args(path):
+    """
+    Read an args.txt file from any location. A relative filename in the
+    file is taken to be relative to the folder containing it
+
+    Parameters
+    ----------
+    path : string
+        Path of the args.txt file
+
+    Returns
+    -------
+    arg_dict : dictionary
+        Argument and argument value pairs
+
+    """
+    with open(path, "r") as f:
+        arg_dict = process_txt(f.readlines())
+    filename = arg_dict.get("filename")
+    if isinstance(filename, str) and not os.path.isabs(filename):
+        folder = os.path.dirname(os.path.abspath(path))
+        arg_dict["filename"] = os.path.join(folder, filename)
+    return arg_dict
+
 def get_args(demonstration=False, preferences=False):
     """
     Get arguments from txt files depending on whether the data is
@@ -110,6 +136,44 @@ def make_user_data_dir():
         f.write(txt_data)
     return user_data_args
 
+def collect_jobs(args_files, data_dir=None, template=None):
+    """
+    Gather the arguments of each dataset given to the batch and stats
+    commands, from args.txt files and from each data file in a folder
+
+    Parameters
+    ----------
+    args_files : list of strings
+        Paths of args.txt files
+    data_dir : string, optional
+        Folder of data files, each used with the arguments of template
+    template : string, optional
+        args.txt used for every file in data_dir. The default None uses
+        args.txt in the current folder
+
+    Returns
+    -------
+    list of tuples
+        Unique name and arguments of each dataset
+
+    """
+    from superviolin.batch import find_datasets, job_names
+    
+    arg_dicts = [read_args(path) for path in args_files]
+    if data_dir is not None:
+        if template is None:
+            if not os.path.exists("args.txt"):
+                raise click.UsageError("--data-dir needs --template or an "
+                                       "args.txt in the current folder")
+            template = "args.txt"
+        template_args = read_args(template)
+        for filename in find_datasets(data_dir):
+            arg_dicts.append(dict(template_args, filename=filename))
+    if not arg_dicts:
+        raise click.UsageError("No args.txt files or data files to use")
+    names = job_names([d.get("filename", "") for d in arg_dicts])
+    return list(zip(names, arg_dicts))
+
 @click.group()
 def cli():    
     pass
@@ -136,7 +200,9 @@ def init():
     click.echo("Modify args.txt with your preferences, then run `superviolin plot`")
 
 @cli.command("plot", short_help="Generate Violin SuperPlot")
-def make_superplot():
+@click.option("--memprofile", is_flag=True,
+              help="Save the memory used by each stage as memory_profile.json")
+def make_superplot(memprofile):
     """
     Generates a Violin SuperPlot based on the args.txt file in the current
     directory
@@ -147,14 +213,167 @@ def make_superplot():
 
     """
     
+    import matplotlib.pyplot as plt
+    from superviolin.plot import Superviolin
+    
     d = get_args()
     if not d:
         click.echo("args.txt not found in current folder")
     else:
+        if memprofile:
+            d["memprofile"] = "yes"
         violin = Superviolin(**d)
         violin.generate_plot()
+        if memprofile:
+            violin.save_memory_report("memory_profile.json")
+            click.echo("Memory profile saved to memory_profile.json")
+        
+        # save from the figure window at the dpi in args.txt
+        plt.rcParams["savefig.dpi"] = violin.dpi
         plt.show()
 
+@cli.command("batch", short_help="Render many Violin SuperPlots without a display")
+@click.argument("args_files", nargs=-1, type=click.Path(exists=True, dir_okay=False))
+@click.option("--data-dir", type=click.Path(exists=True, file_okay=False),
+              help="Render every data file in this folder")
+@click.option("--template", type=click.Path(exists=True, dir_okay=False),
+              help="args.txt used for every file in --data-dir [default: args.txt]")
+@click.option("--out-dir", default="superviolin_batch", show_default=True,
+              help="Folder to save the figures and report in")
+@click.option("--formats", default="png", show_default=True,
+              help="File formats to save, separated by commas e.g. png,svg")
+@click.option("--jobs", "n_jobs", default=1, show_default=True,
+              help="Number of worker processes. Values below 1 use every CPU core")
+@click.option("--report", type=click.Path(dir_okay=False),
+              help="Path of the JSON report [default: OUT_DIR/batch_report.json]")
+def batch(args_files, data_dir, template, out_dir, formats, n_jobs, report):
+    """
+    Generates a Violin SuperPlot for each args.txt file given, and for each
+    data file in --data-dir using the arguments of --template, on the
+    headless Agg backend. A summary of the time taken and any errors of
+    each plot is printed and saved as a JSON report.
+
+    Returns
+    -------
+    None.
+
+    """
+    from superviolin.batch import run_batch
+    
+    jobs = collect_jobs(args_files, data_dir, template)
+    formats = [f.strip().lstrip(".") for f in formats.split(",") if f.strip()]
+    summary = run_batch(jobs, out_dir, formats, n_jobs, report)
+    for result in summary["jobs"]:
+        status = "ok" if result["status"] == "ok" else "FAILED"
+        click.echo(f"{status:<7}{result['seconds']:8.2f} s  {result['name']}")
+        for error in result["errors"]:
+            click.echo(f"{'':17}{error}")
+    click.echo(f"{summary['succeeded']} succeeded, {summary['failed']} failed "
+               f"in {summary['seconds']:.2f} s")
+    click.echo(f"Report saved to {summary['report']}")
+
+@cli.command("stats", short_help="Compute statistics without drawing plots")
+@click.argument("args_files", nargs=-1, type=click.Path(exists=True, dir_okay=False))
+@click.option("--data-dir", type=click.Path(exists=True, file_okay=False),
+              help="Compute statistics of every data file in this folder")
+@click.option("--template", type=click.Path(exists=True, dir_okay=False),
+              help="args.txt used for every file in --data-dir [default: args.txt]")
+@click.option("--jobs", "n_jobs", default=1, show_default=True,
+              help="Number of worker processes. Values below 1 use every CPU core")
+@click.option("--out", default="statistics.json", show_default=True,
+              help="JSON file to save the results in")
+def stats(args_files, data_dir, template, n_jobs, out):
+    """
+    Computes the statistics of the Violin SuperPlot of each args.txt file
+    given, and of each data file in --data-dir using the arguments of
+    --template, from the middle value of each replicate. No kernel density
+    estimators are fitted and no plots are drawn. The P value of each
+    dataset is printed and all results are saved as JSON.
+
+    Returns
+    -------
+    None.
+
+    """
+    from superviolin.parallel import map_jobs
+    from superviolin.stats import dataset_statistics
+    
+    jobs = collect_jobs(args_files, data_dir, template)
+    results = map_jobs(dataset_statistics, jobs, n_jobs)
+    for result in results:
+        if result["status"] != "ok":
+            click.echo(f"FAILED  {result['name']}: {'; '.join(result['errors'])}")
+        elif isinstance(result["p_value"], str):
+            click.echo(f"{result['name']}: {result['p_value']}")
+        else:
+            click.echo(f"{result['name']}: {result['test']} "
+                       f"P-value: {result['p_value']:.3g}")
+    with open(out, "w") as f:
+        json.dump(results, f, indent=2)
+    click.echo(f"Results saved to {out}")
+
+@cli.command("bench", short_help="Time each stage on synthetic datasets")
+@click.option("--suite", default="quick", show_default=True,
+              type=click.Choice(sorted(benchmark.SUITES)),
+              help="Set of dataset sizes, shapes, conditions and replicates")
+@click.option("--repeats", default=3, show_default=True,
+              help="Number of runs of each case. The fastest run is kept")
+@click.option("--kde-engine", default="exact", show_default=True,
+              help="Method used to fit the kernel density estimators")
+@click.option("--seed", default=0, show_default=True,
+              help="Seed of the synthetic datasets")
+@click.option("--out", default="benchmark.json", show_default=True,
+              help="JSON file to save the results in")
+@click.option("--baseline", type=click.Path(dir_okay=False),
+              help="Earlier results to compare with")
+@click.option("--save-baseline", is_flag=True,
+              help="Save the results as the new --baseline file")
+@click.option("--tolerance", default=benchmark.TOLERANCE, show_default=True,
+              help="Fraction by which a stage may be slower than the baseline")
+def bench(suite, repeats, kde_engine, seed, out, baseline, save_baseline,
+          tolerance):
+    """
+    Times the load, kde, render, stats and savefig stages of generating a
+    Violin SuperPlot on seeded synthetic datasets, and the startup of the
+    command line. Results are compared with a baseline, if given, and the
+    command exits with status 1 if any stage is slower than the baseline by
+    more than the tolerance. It also exits with status 1 if the startup is
+    slower than 0.2 s, with or without a baseline.
+
+    Returns
+    -------
+    None.
+
+    """
+    if save_baseline and baseline is None:
+        raise click.UsageError("--save-baseline needs the --baseline file "
+                               "to save the results in")
+    results = benchmark.run_suite(suite, repeats, kde_engine, seed,
+                                  echo=click.echo)
+    results["startup"] = benchmark.time_startup()
+    click.echo(f"{'startup (--help)':<38}{results['startup']:.3f}")
+    benchmark.save_results(results, out)
+    click.echo(f"Results saved to {out}")
+    
+    # the startup is checked against a fixed limit on every run
+    regressions = benchmark.startup_regressions(results)
+    if save_baseline:
+        benchmark.save_results(results, baseline)
+        click.echo(f"Baseline saved to {baseline}")
+    elif baseline is not None:
+        if not os.path.exists(baseline):
+            raise click.UsageError(f"Baseline {baseline} not found. "
+                                   "Create it with --save-baseline")
+        regressions += benchmark.find_regressions(
+            results, benchmark.load_results(baseline), tolerance)
+    for r in regressions:
+        click.echo(f"REGRESSION {r['case']} {r['stage']}: "
+                   f"{r['baseline']:.3f} s -> {r['seconds']:.3f} s")
+    if regressions:
+        sys.exit(1)
+    if baseline is not None and not save_baseline:
+        click.echo("No regressions")
+
 @cli.command("demo", short_help="Make demo Violin SuperPlot")
 def demo():
     """
@@ -167,11 +386,16 @@ def demo():
 
     """
     
+    import pandas as pd
+    import matplotlib.pyplot as plt
+    from superviolin.plot import Superviolin
+    
     d = get_args(demonstration=True)
     bytedata = pkgutil.get_data(__name__, "res/demo_data.csv")
     df = pd.read_csv(io.BytesIO(bytedata))
     violin = Superviolin(**d, dataframe=df)
     violin.generate_plot()
+    plt.rcParams["savefig.dpi"] = violin.dpi
     plt.show()
     
 @cli.command("test", short_help="Test the Superviolin class to ensure it is working")
@@ -184,6 +408,9 @@ def test():
     None.
 
     """
+    import unittest
+    from superviolin import test_plot
+    
     suite = unittest.TestLoader().loadTestsFromModule(test_plot)
     unittest.TextTestRunner(verbosity=2).run(suite)
     
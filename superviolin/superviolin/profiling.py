@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Memory profiling of each stage of generating a Violin SuperPlot, to find
+which stage uses the most memory on large datasets
+
+@author: Martin Kenny
+"""
+
+import os
+import sys
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+def current_rss():
+    """
+    Get the resident set size of this process
+
+    Returns
+    -------
+    integer or None
+        Resident set size in bytes, or None if it cannot be measured
+
+    """
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError, IndexError):
+        return None
+
+def peak_rss():
+    """
+    Get the largest resident set size of this process so far
+
+    Returns
+    -------
+    integer or None
+        Peak resident set size in bytes, or None if it cannot be measured
+
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # macOS reports bytes, other platforms report kilobytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+class MemoryProfiler:
+    def __init__(self):
+        """
+        Record the memory used by each stage of generating a Violin SuperPlot.
+        Python and numpy allocations are traced with tracemalloc, which is
+        started here if it is not already running, and the resident set size
+        of the process is measured before and after each stage.
+
+        """
+        self.stages = []
+        self._started = not tracemalloc.is_tracing()
+        if self._started:
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Measure the memory used by the code run in a with block
+
+        Parameters
+        ----------
+        name : string
+            Name of the stage in the report
+
+        Yields
+        ------
+        None.
+
+        """
+        if not tracemalloc.is_tracing():
+            yield
+            return
+
+        # peak memory is only measured from the start of the
+        # stage on Python 3.9 or later, which can reset it
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        traced_before = tracemalloc.get_traced_memory()[0]
+        rss_before = current_rss()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            traced_after, traced_peak = tracemalloc.get_traced_memory()
+            rss_after = current_rss()
+            self.stages.append({
+                "stage" : name,
+                "seconds" : seconds,
+                "traced_peak_bytes" : traced_peak - traced_before,
+                "traced_retained_bytes" : traced_after - traced_before,
+                "rss_before_bytes" : rss_before,
+                "rss_after_bytes" : rss_after,
+                "rss_retained_bytes" : (None if None in (rss_before, rss_after)
+                                        else rss_after - rss_before),
+                "rss_peak_bytes" : peak_rss(),
+                })
+
+    def stop(self):
+        """
+        Stop tracing allocations if this profiler started it
+
+        Returns
+        -------
+        None.
+
+        """
+        if self._started and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self._started = False
+
+    def report(self):
+        """
+        Get the measurements of every stage
+
+        Returns
+        -------
+        dictionary
+            Python version, platform and the measurements of each stage in
+            the order they were run. rss_peak_bytes is the peak of the whole
+            process up to the end of the stage
+
+        """
+        return {
+            "python" : sys.version.split()[0],
+            "platform" : sys.platform,
+            "stages" : list(self.stages),
+            }
+
+    def save(self, fname):
+        """
+        Save the report as JSON
+
+        Parameters
+        ----------
+        fname : string
+            Path of the JSON file
+
+        Returns
+        -------
+        None.
+
+        """
+        with open(fname, "w") as f:
+            json.dump(self.report(), f, indent=2)
@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+"""
+Readers which load only the columns needed for Violin SuperPlots from CSV,
+Excel, Parquet, Feather and Arrow IPC files
+
+@author: Martin Kenny
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+FILE_FORMATS = ("auto", "csv", "excel", "parquet", "feather", "arrow")
+
+EXTENSIONS = {
+    ".csv" : "csv",
+    ".parquet" : "parquet",
+    ".pq" : "parquet",
+    ".feather" : "feather",
+    ".arrow" : "arrow",
+    ".arrows" : "arrow",
+    ".ipc" : "arrow",
+    }
+
+def detect_format(filename, file_format="auto"):
+    """
+    Get the format of a data file from its extension
+
+    Parameters
+    ----------
+    filename : string
+        Name of the data file
+    file_format : string, optional
+        One of FILE_FORMATS. Any value but "auto" is returned unchanged.
+        The default is "auto".
+
+    Returns
+    -------
+    string
+        Format of the file
+
+    """
+    if file_format not in FILE_FORMATS:
+        raise ValueError(f"Unsupported file format: {file_format}")
+    if file_format != "auto":
+        return file_format
+    ext = os.path.splitext(filename)[1].lower()
+    if ext.startswith(".xl"):
+        return "excel"
+    if ext not in EXTENSIONS:
+        raise ValueError("Incorrect filename or unsupported filetype")
+    return EXTENSIONS[ext]
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("Reading Parquet, Feather and Arrow files "
+                          "requires pyarrow. Install it with "
+                          "`pip install pyarrow`") from None
+    return pyarrow
+
+def _typed_filter_values(field_type, conditions):
+    """
+    Convert the condition names to the type of the condition column so
+    they can be compared with it when reading a Parquet file
+
+    Parameters
+    ----------
+    field_type : pyarrow DataType
+        Type of the condition column
+    conditions : list of strings
+        Conditions to keep
+
+    Returns
+    -------
+    list or None
+        Converted conditions, or None if they cannot be compared with the
+        column and the rows must be filtered after reading
+
+    """
+    pa = _import_pyarrow()
+    if pa.types.is_dictionary(field_type):
+        field_type = field_type.value_type
+    try:
+        if pa.types.is_integer(field_type):
+            return [int(c) for c in conditions]
+        elif pa.types.is_floating(field_type):
+            return [float(c) for c in conditions]
+        elif pa.types.is_string(field_type) or pa.types.is_large_string(field_type):
+            return list(conditions)
+    except ValueError:
+        pass
+    return None
+
+def _read_parquet(filename, columns, condition=None, conditions=None):
+    """
+    Read columns of a Parquet file. Row groups which cannot contain any of
+    the conditions are skipped using the column statistics of the file
+
+    """
+    pa = _import_pyarrow()
+    import pyarrow.parquet as pq
+
+    schema = pq.read_schema(filename)
+    columns = [c for c in columns if c in schema.names]
+    filters = None
+    if conditions is not None and condition in schema.names:
+        values = _typed_filter_values(schema.field(condition).type, conditions)
+        if values is not None:
+            filters = [(condition, "in", values)]
+    try:
+        table = pq.read_table(filename, columns=columns, filters=filters)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        table = pq.read_table(filename, columns=columns)
+    return table.to_pandas()
+
+def _read_ipc(filename, columns):
+    """
+    Read columns of a Feather or Arrow IPC file or stream. Only the fields
+    which are needed are read, so compressed columns which are not needed
+    are never decompressed
+
+    """
+    pa = _import_pyarrow()
+    with pa.memory_map(filename, "r") as source:
+        try:
+            open_ipc = pa.ipc.open_file
+            schema = open_ipc(source).schema
+        except pa.ArrowInvalid:
+            source.seek(0)
+            try:
+                open_ipc = pa.ipc.open_stream
+                schema = open_ipc(source).schema
+            except pa.ArrowInvalid:
+                # version 1 Feather files are not Arrow IPC files
+                import pyarrow.feather as feather
+                table = feather.read_table(filename, memory_map=True)
+                columns = [c for c in columns if c in table.column_names]
+                return table.select(columns).to_pandas()
+        columns = [c for c in columns if c in schema.names]
+        options = pa.ipc.IpcReadOptions(
+            included_fields=[schema.get_field_index(c) for c in columns])
+        source.seek(0)
+        table = open_ipc(source, options=options).read_all()
+        return table.select(columns).to_pandas()
+
+def read_tidy(filename, columns, file_format="auto", condition=None,
+              conditions=None):
+    """
+    Read the columns used for a Violin SuperPlot from a tidy data file.
+    Columns which are missing from the file are left out so they can be
+    reported together afterwards
+
+    Parameters
+    ----------
+    filename : string
+        Path of the data file
+    columns : list of strings
+        Columns to read
+    file_format : string, optional
+        One of FILE_FORMATS. The default "auto" uses the file extension.
+    condition : string, optional
+        Name of the condition column, needed to filter by conditions
+    conditions : list of strings, optional
+        Only keep rows of these conditions. Parquet files skip row groups
+        which do not contain them. The default None keeps every row.
+
+    Returns
+    -------
+    Pandas DataFrame
+        The requested columns
+
+    """
+    file_format = detect_format(filename, file_format)
+    if file_format == "csv":
+        df = pd.read_csv(filename, usecols=lambda c: c in columns)
+    elif file_format == "excel":
+        df = pd.read_excel(filename, usecols=lambda c: c in columns)
+    elif file_format == "parquet":
+        df = _read_parquet(filename, columns, condition, conditions)
+    else:
+        df = _read_ipc(filename, columns)
+
+    if conditions is not None and condition in df.columns:
+        keep = df[condition].astype(str).isin(conditions)
+        if not keep.all():
+            df = df[keep].reset_index(drop=True)
+    return df
+
+def _sheet_columns(rows):
+    """
+    Collect the columns of a worksheet from its rows, one row at a time.
+    Empty cells are NaN, empty rows at the end of the sheet are dropped and
+    unnamed and duplicate columns are named as pandas would name them
+
+    Parameters
+    ----------
+    rows : iterator of tuples
+        Cell values of each row, starting with the header row
+
+    Returns
+    -------
+    names : list of strings
+        Header of each column
+    columns : list of lists
+        Values of each column, all of the same length
+
+    """
+    header = next(rows, None)
+    if header is None:
+        return [], []
+    names = list(header)
+    while names and names[-1] is None:
+        names.pop()
+    columns = [[] for _ in names]
+    num_rows = 0
+    pending = 0
+    for row in rows:
+        cells = list(row)
+        while cells and cells[-1] is None:
+            cells.pop()
+        if not cells:
+            # wait for a later non-empty row before keeping empty rows
+            pending += 1
+            continue
+        num_rows += pending
+        for col in columns:
+            col.extend([np.nan] * pending)
+        pending = 0
+        while len(columns) < len(cells):
+            names.append(None)
+            columns.append([np.nan] * num_rows)
+        for j, col in enumerate(columns):
+            value = cells[j] if j < len(cells) else None
+            col.append(np.nan if value is None else value)
+        num_rows += 1
+    unnamed = [j for j, name in enumerate(names) if name is None]
+    names = [f"Unnamed: {j}" if name is None else str(name)
+             for j, name in enumerate(names)]
+    # duplicate headers become A, A.1, A.2, ... as they do in pandas, which
+    # skips names already in the header and renames named columns first
+    counts = {}
+    named = [j for j in range(len(names)) if j not in unnamed]
+    for j in named + unnamed:
+        name = names[j]
+        count = counts.get(names[j], 0)
+        while count > 0:
+            counts[names[j]] = count + 1
+            name = f"{names[j]}.{count}"
+            count = count + 1 if name in names else counts.get(name, 0)
+        names[j] = name
+        counts[name] = count + 1
+    return names, columns
+
+def _iter_sheets(source):
+    """
+    Yield the name and columns of each worksheet of an Excel workbook.
+    xlsx workbooks are streamed in read-only mode, and older xls workbooks
+    are read one sheet at a time
+
+    """
+    name = getattr(source, "name", source)
+    if isinstance(name, str) and name.lower().endswith(".xls"):
+        xl = pd.ExcelFile(source)
+        for sheet in xl.sheet_names:
+            df = xl.parse(sheet)
+            yield sheet, [str(c) for c in df.columns], [df[c].to_numpy()
+                                                       for c in df.columns]
+        return
+
+    from openpyxl import load_workbook
+    wb = load_workbook(source, read_only=True, data_only=True)
+    try:
+        for ws in wb.worksheets:
+            names, columns = _sheet_columns(ws.iter_rows(values_only=True))
+            yield ws.title, names, columns
+    finally:
+        wb.close()
+
+def read_untidy_excel(source, condition="condition", value="value",
+                      replicate="replicate"):
+    """
+    Read an untidy Excel workbook, which has a sheet for each replicate and
+    a column for each condition, into tidy data in a single pass over the
+    workbook. Values are gathered straight into arrays, so no DataFrame is
+    made for each sheet
+
+    Parameters
+    ----------
+    source : string or file-like object
+        Path of the workbook or an open file, e.g. a web upload
+    condition : string, optional
+        Name of the condition column. The default is "condition".
+    value : string, optional
+        Name of the value column. The default is "value".
+    replicate : string, optional
+        Name of the replicate column. The default is "replicate".
+
+    Returns
+    -------
+    Pandas DataFrame
+        Condition, value and replicate columns, ordered by sheet, then by
+        column and then by row. Sheets without values are left out
+
+    """
+    values = []
+    conditions = []
+    reps = []
+    for sheet, names, columns in _iter_sheets(source):
+        if not columns or len(columns[0]) == 0:
+            continue
+        for name, col in zip(names, columns):
+            try:
+                col = np.asarray(col, dtype=float)
+            except (TypeError, ValueError):
+                raise ValueError(f"Non-numeric value in column {name} "
+                                 f"of sheet {sheet}") from None
+            values.append(col)
+            conditions.append(np.full(col.size, name, dtype=object))
+            reps.append(np.full(col.size, sheet, dtype=object))
+    if not values:
+        return pd.DataFrame({condition : [], value : [], replicate : []})
+    return pd.DataFrame({
+        condition : np.concatenate(conditions),
+        value : np.concatenate(values),
+        replicate : np.concatenate(reps),
+        })
@@ -0,0 +1,472 @@
+# -*- coding: utf-8 -*-
+"""
+Replicate-level statistics of Violin SuperPlot data, computed straight from
+the grouped values without fitting kernel density estimators, drawing a
+figure or importing matplotlib
+
+@author: Martin Kenny
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+from scipy.interpolate import CubicSpline
+from scipy.special import ndtr
+from scipy.stats import chi, f_oneway, ttest_ind, ttest_rel
+
+from superviolin.readers import detect_format, read_tidy, read_untidy_excel
+from superviolin.summary import (compact_values, encode_labels, group_offsets,
+                                 replicate_centres)
+
+SINGLE_CONDITION = "Can't run statistics for only 1 replicate"
+
+# grids used to integrate the studentized range and Dunnett distributions.
+# Values beyond _RANGE_GRID are far outside any range of normal samples
+_Z_GRID = np.linspace(-10, 10, 1001)
+_RANGE_GRID = np.linspace(0, 14, 701)
+_SCALE_POINTS = 513
+_CHI_TAIL = 1e-15
+
+def _simpson_weights(x):
+    """
+    Weights of Simpson's rule on an evenly spaced grid of an odd number of
+    points
+
+    """
+    weights = np.ones(x.size)
+    weights[1:-1:2] = 4
+    weights[2:-1:2] = 2
+    return weights * (x[1] - x[0]) / 3
+
+def _scale_mixture_sf(cdf, q, df):
+    """
+    Survival function of X / S at each q, where cdf is the distribution of
+    X and S is an independent pooled standard deviation with df degrees of
+    freedom, i.e. sqrt(chi-squared / df). S is integrated on an evenly
+    spaced grid of its logarithm, which keeps the integrand smooth for any
+    degrees of freedom
+
+    Parameters
+    ----------
+    cdf : function
+        Distribution function of X, evaluated on arrays
+    q : numpy array
+        Non-negative points to evaluate
+    df : float
+        Degrees of freedom of S
+
+    Returns
+    -------
+    numpy array
+        P(X / S > q)
+
+    """
+    log_s = np.linspace(np.log(chi.ppf(_CHI_TAIL, df)),
+                        np.log(chi.isf(_CHI_TAIL, df)), _SCALE_POINTS)
+    s = np.exp(log_s)
+    weights = chi.pdf(s, df) * s * _simpson_weights(log_s)
+    w = np.minimum(np.multiply.outer(q, s / np.sqrt(df)), _RANGE_GRID[-1])
+    return np.clip(1 - np.clip(cdf(w), 0, 1) @ weights, 0, 1)
+
+def studentized_range_sf(q, k, df):
+    """
+    Survival function of the studentized range of k groups with df degrees
+    of freedom, evaluated at every q at once. Agrees with
+    scipy.stats.studentized_range.sf to about 1e-9, which evaluates each q
+    separately and takes around 10 ms per value for many groups
+
+    Parameters
+    ----------
+    q : numpy array
+        Studentized ranges
+    k : integer
+        Number of groups
+    df : float
+        Degrees of freedom of the pooled variance
+
+    Returns
+    -------
+    numpy array
+        P value of each q
+
+    """
+    q = np.abs(np.asarray(q, dtype=float))
+    pdf = np.exp(-_Z_GRID ** 2 / 2) / np.sqrt(2 * np.pi)
+
+    # distribution of the range of k standard normal samples
+    inner = ndtr(_Z_GRID) - ndtr(np.subtract.outer(_Z_GRID, _RANGE_GRID).T)
+    inner = np.clip(inner, 0, 1) ** (k - 1)
+    cdf = CubicSpline(_RANGE_GRID,
+                      k * inner @ (pdf * _simpson_weights(_Z_GRID)))
+    p = _scale_mixture_sf(cdf, q.ravel(), df)
+    p[np.isnan(q.ravel())] = np.nan
+    return p.reshape(q.shape)
+
+def dunnett_sf(t, counts, control_count, df):
+    """
+    Two-sided P values of Dunnett's many-to-one comparisons, evaluated at
+    every t statistic at once. Each P value is the probability that the
+    largest absolute t statistic of all comparisons exceeds it, using the
+    correlation between comparisons that share the control
+
+    Parameters
+    ----------
+    t : numpy array
+        t statistic of each comparison
+    counts : numpy array
+        Number of replicates of each compared condition
+    control_count : integer
+        Number of replicates of the control
+    df : float
+        Degrees of freedom of the pooled variance
+
+    Returns
+    -------
+    numpy array
+        P value of each t statistic
+
+    """
+    t = np.abs(np.asarray(t, dtype=float))
+    pdf = np.exp(-_Z_GRID ** 2 / 2) / np.sqrt(2 * np.pi)
+
+    # the statistics are independent given the control mean, so the joint
+    # distribution is a product over conditions, one factor for each size
+    sizes, repeats = np.unique(counts, return_counts=True)
+    joint = np.ones((_RANGE_GRID.size, _Z_GRID.size))
+    for size, repeat in zip(sizes, repeats):
+        lam = np.sqrt(size / (size + control_count))
+        gamma = np.sqrt(1 - lam ** 2)
+        shift = lam * _Z_GRID
+        inside = (ndtr(np.subtract.outer(_RANGE_GRID, shift) / gamma)
+                  - ndtr(np.subtract.outer(-_RANGE_GRID, shift) / gamma))
+        joint *= np.clip(inside, 0, 1) ** repeat
+    cdf = CubicSpline(_RANGE_GRID, joint @ (pdf * _simpson_weights(_Z_GRID)))
+    p = _scale_mixture_sf(cdf, t.ravel(), df)
+    p[np.isnan(t.ravel())] = np.nan
+    return p.reshape(t.shape)
+
+def _group_moments(means, value, condition):
+    """
+    Count, mean and sum of squared deviations of each condition in one pass
+    over the table of replicate values, ignoring NaN values
+
+    Returns
+    -------
+    groups : numpy array
+        Conditions in order of first appearance
+    counts, group_means, squares : numpy arrays
+        Moments of each condition
+    df : integer
+        Degrees of freedom of the pooled variance
+
+    """
+    codes, groups = pd.factorize(means[condition])
+    values = means[value].to_numpy(dtype=float)
+    keep = ~np.isnan(values)
+    codes, values = codes[keep], values[keep]
+    counts = np.bincount(codes, minlength=len(groups))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        group_means = np.bincount(codes, values, len(groups)) / counts
+    squares = np.bincount(codes, (values - group_means[codes]) ** 2,
+                          len(groups))
+    df = counts.sum() - len(groups)
+    return np.asarray(groups), counts, group_means, squares, df
+
+def tukey_posthoc(means, value, condition):
+    """
+    Tukey's all-pairs comparisons of the conditions, with the Tukey-Kramer
+    standard error for unequal numbers of replicates. Every pair is
+    compared at once, giving the same P values as
+    scikit_posthocs.posthoc_tukey
+
+    Parameters
+    ----------
+    means : Pandas DataFrame
+        Middle value of each replicate of each condition
+    value : string
+        Name of the value column
+    condition : string
+        Name of the condition column
+
+    Returns
+    -------
+    Pandas DataFrame
+        P values of each pair of conditions, in order of first appearance
+
+    """
+    groups, counts, group_means, squares, df = _group_moments(means, value,
+                                                              condition)
+    mse = squares.sum() / df
+    upper = np.triu_indices(groups.size, 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scale = mse * 0.5 * (1.0 / counts[upper[0]] + 1.0 / counts[upper[1]])
+        q_values = (group_means[upper[0]] - group_means[upper[1]]) / np.sqrt(scale)
+    vs = np.ones((groups.size, groups.size))
+    vs[upper] = studentized_range_sf(q_values, groups.size, df)
+    vs[upper[::-1]] = vs[upper]
+    return pd.DataFrame(vs, index=groups, columns=groups)
+
+def dunnett_posthoc(means, value, condition, control):
+    """
+    Dunnett's comparisons of every condition with a control. Only one
+    comparison is made for each condition, so the work grows linearly with
+    the number of conditions
+
+    Parameters
+    ----------
+    means : Pandas DataFrame
+        Middle value of each replicate of each condition
+    value : string
+        Name of the value column
+    condition : string
+        Name of the condition column
+    control : string
+        Condition every other condition is compared with
+
+    Returns
+    -------
+    Pandas DataFrame
+        P value of each condition, in order of first appearance, in a
+        column named after the control
+
+    """
+    groups, counts, group_means, squares, df = _group_moments(means, value,
+                                                              condition)
+    if control not in groups:
+        raise ValueError(f"Control {control} not found in data")
+    is_control = groups == control
+    c = np.flatnonzero(is_control)[0]
+    mse = squares.sum() / df
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = ((group_means[~is_control] - group_means[c])
+             / np.sqrt(mse * (1.0 / counts[~is_control] + 1.0 / counts[c])))
+    p = dunnett_sf(t, counts[~is_control], counts[c], df)
+    return pd.DataFrame({control : p}, index=groups[~is_control])
+
+def compare_conditions(means, condition, value, paired="no", num_groups=None,
+                       control=None):
+    """
+    Run a one-way ANOVA with posthoc tests for 3 or more conditions, or an
+    independent or paired t-test for 2 conditions. The posthoc tests
+    compare every pair of conditions with Tukey's test, or every condition
+    with a control with Dunnett's test
+
+    Parameters
+    ----------
+    means : Pandas DataFrame
+        Middle value of each replicate of each condition
+    condition : string
+        Name of the condition column
+    value : string
+        Name of the value column
+    paired : string, optional
+        Either "yes" or "no" if the data are paired. The default is "no".
+    num_groups : integer, optional
+        Number of conditions which decides the test. The default None uses
+        the number of conditions in means.
+    control : string, optional
+        Condition to compare the others with in the posthoc tests. The
+        default None compares every pair of conditions.
+
+    Returns
+    -------
+    dictionary
+        Name of the test, test statistic, P value, name of the posthoc test
+        and posthoc P values. The posthoc entries are None unless 3 or more
+        conditions are compared
+
+    """
+    groups = means[condition].unique()
+    data = [means[value][means[condition] == g].to_numpy() for g in groups]
+    if num_groups is None:
+        num_groups = len(groups)
+
+    posthoc_test = posthoc = None
+    if num_groups > 2:
+        test = "One-way ANOVA"
+        stat, p = f_oneway(*data)
+        if control is None:
+            posthoc_test = "Tukey"
+            posthoc = tukey_posthoc(means, value, condition)
+        else:
+            posthoc_test = "Dunnett"
+            posthoc = dunnett_posthoc(means, value, condition, control)
+    elif num_groups == 2:
+        if paired == "no":
+            test = "Independent t-test"
+            stat, p = ttest_ind(data[0], data[1])
+        else:
+            test = "Paired t-test"
+            stat, p = ttest_rel(data[0], data[1])
+    else:
+        test = None
+        stat = p = SINGLE_CONDITION
+    return {"test" : test, "statistic" : stat, "p_value" : p,
+            "posthoc_test" : posthoc_test, "posthoc" : posthoc}
+
+def _read_data(filename, condition, value, replicate, data_format="tidy",
+               file_format="auto", conditions=None):
+    """
+    Read the condition, value and replicate columns of a data file
+
+    """
+    file_format = detect_format(filename, file_format)
+    if file_format == "excel" and data_format != "tidy":
+        return read_untidy_excel(filename, condition, value, replicate)
+    return read_tidy(filename, [condition, value, replicate], file_format,
+                     condition, conditions)
+
+def compute_statistics(filename="", condition="condition", value="value",
+                       replicate="replicate", order="None", data_format="tidy",
+                       file_format="auto", filter_order="no", centre_val="mean",
+                       paired_data="no", control="None", dataframe=None,
+                       **kwargs):
+    """
+    Compute the statistics of a Violin SuperPlot from the middle value of
+    each replicate, without fitting kernel density estimators or drawing
+    the plot. Takes the same arguments as Superviolin, so the arguments of
+    an args.txt file can be passed unchanged. Arguments which only change
+    the plot are ignored
+
+    Parameters
+    ----------
+    filename : string, optional
+        Path of the data file. Not used if dataframe is given
+    condition : string, optional
+        Name of the condition column. The default is "condition".
+    value : string, optional
+        Name of the value column. The default is "value".
+    replicate : string, optional
+        Name of the replicate column. The default is "replicate".
+    order : string, optional
+        Conditions to compare, separated by ", ". The default "None"
+        compares every condition in sorted order.
+    data_format : string, optional
+        Either "tidy" or "untidy". The default is "tidy".
+    file_format : string, optional
+        Format of the file, or "auto" to use the file extension.
+        The default is "auto".
+    filter_order : string, optional
+        Either "yes" or "no" to only read the conditions in order from the
+        file. The default is "no".
+    centre_val : string, optional
+        Middle value of each replicate, either mean or median.
+        The default is "mean".
+    paired_data : string, optional
+        Either "yes" or "no" if the data are paired. The default is "no".
+    control : string, optional
+        Condition compared with every other condition by Dunnett's test
+        when there are 3 or more conditions. The default "None" compares
+        every pair of conditions by Tukey's test.
+    dataframe : Pandas DataFrame, optional
+        Tidy data to use instead of reading filename. The default is None.
+    **kwargs
+        Other arguments of Superviolin, which are ignored
+
+    Returns
+    -------
+    dictionary
+        Name of the test, test statistic, P value, name of the posthoc test,
+        posthoc P values, the compared conditions and the middle value of
+        each replicate
+
+    """
+    conditions = None
+    if order != "None":
+        conditions = order.split(", ")
+    if not isinstance(dataframe, pd.DataFrame):
+        dataframe = _read_data(filename, condition, value, replicate,
+                               data_format, file_format,
+                               conditions if filter_order == "yes" else None)
+    missing = [c for c in (condition, value, replicate)
+               if c not in dataframe.columns]
+    if missing:
+        raise ValueError(f"Columns not found in data: {', '.join(missing)}")
+
+    # group the values by (condition, replicate) pair as Superviolin does
+    x = encode_labels(dataframe[condition])
+    rep = encode_labels(dataframe[replicate])
+    values = compact_values(dataframe[value])
+    sort_order, offsets = group_offsets(x.codes, rep.codes,
+                                        len(x.categories), len(rep.categories))
+    if sort_order is not None:
+        values = values[sort_order]
+    how = "median" if centre_val == "median" else "mean"
+    centres, sizes = replicate_centres(values, offsets, how)
+    shape = (len(x.categories), len(rep.categories))
+    centres = centres.reshape(shape)
+    sizes = sizes.reshape(shape)
+
+    labels = list(x.categories)
+    if conditions is None:
+        conditions = sorted(labels)
+    absent = [c for c in conditions if c not in labels]
+    if absent:
+        raise ValueError(f"Conditions not found in data: {', '.join(absent)}")
+    rows = [labels.index(c) for c in conditions]
+    has_rows = sizes[rows] > 0
+    means = pd.DataFrame({
+        condition : np.repeat(conditions, has_rows.sum(axis=1)),
+        replicate : np.tile(np.array(rep.categories, dtype=object),
+                            len(rows))[has_rows.ravel()],
+        value : centres[rows][has_rows],
+        })
+    result = compare_conditions(means, condition, value, paired_data,
+                                control=None if control == "None" else control)
+    result["conditions"] = conditions
+    result["replicate_values"] = means
+    return result
+
+def json_number(value):
+    """
+    Convert a statistic to a float for a JSON report, or None if it is NaN
+    or infinite, which JSON cannot represent
+    """
+    value = float(value)
+    return value if np.isfinite(value) else None
+
+def dataset_statistics(name, args):
+    """
+    Compute the statistics of one dataset for a report, catching errors so
+    one bad dataset does not stop the others
+
+    Parameters
+    ----------
+    name : string
+        Name of the dataset
+    args : dictionary
+        Arguments for compute_statistics
+
+    Returns
+    -------
+    dictionary
+        JSON serializable name, filename, status, test, statistic, P value,
+        posthoc P values, errors and time taken in seconds
+
+    """
+    start = time.perf_counter()
+    result = {"name" : name, "filename" : args.get("filename", ""),
+              "status" : "ok", "errors" : []}
+    try:
+        stats = compute_statistics(**args)
+    except Exception as e:
+        result["status"] = "failed"
+        result["errors"].append(f"{type(e).__name__}: {e}")
+    else:
+        stat, p = stats["statistic"], stats["p_value"]
+        if not isinstance(p, str):
+            stat, p = json_number(stat), json_number(p)
+        posthoc = stats["posthoc"]
+        if posthoc is not None:
+            posthoc = posthoc.astype(object).where(np.isfinite(posthoc), None)
+        result.update({
+            "test" : stats["test"],
+            "statistic" : stat,
+            "p_value" : p,
+            "posthoc_test" : stats["posthoc_test"],
+            "posthoc" : None if posthoc is None else posthoc.to_dict(),
+            "conditions" : stats["conditions"],
+            })
+    result["seconds"] = time.perf_counter() - start
+    return result
@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+"""
+Grouping of Violin SuperPlot data by (condition, replicate) pair and
+vectorized summaries of every pair, computed in one pass over the grouped
+values
+
+@author: Martin Kenny
+"""
+
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from superviolin.parallel import map_jobs
+
+SUMMARIES = ("mean", "median", "robust")
+
+# percentiles kept by the robust mean
+ROBUST_LIMITS = (2.5, 97.5)
+
+# default number of resamples of bootstrap confidence intervals
+BOOTSTRAP_SAMPLES = 10000
+
+def encode_labels(column):
+    """
+    Get integer codes and string labels of a column, with the labels in
+    order of first appearance. Values with the same string form share
+    a code, matching a conversion of the column to strings
+
+    Parameters
+    ----------
+    column : Pandas Series
+        Condition or replicate column
+
+    Returns
+    -------
+    Pandas Categorical
+        Codes of each row with the string labels as categories
+
+    """
+    codes, uniques = pd.factorize(column, use_na_sentinel=False)
+    labels = pd.Index(uniques).astype(str)
+    label_codes, labels = pd.factorize(labels)
+    return pd.Categorical.from_codes(label_codes[codes], labels)
+
+def compact_values(column):
+    """
+    Convert a value column to floats, using 32-bit floats where that
+    does not change any value
+
+    Parameters
+    ----------
+    column : Pandas Series
+        Value column
+
+    Returns
+    -------
+    numpy array
+        Values as float32 or float64
+
+    """
+    values = pd.to_numeric(column).to_numpy(dtype=float)
+    compact = values.astype(np.float32)
+    if np.array_equal(compact, values, equal_nan=True):
+        return compact
+    return values
+
+def group_offsets(x_codes, rep_codes, num_x, num_reps):
+    """
+    Find the order which sorts rows by their (condition, replicate) codes,
+    so the values of each pair are a contiguous slice, and the offsets of
+    each slice
+
+    Parameters
+    ----------
+    x_codes : numpy array
+        Condition code of each row
+    rep_codes : numpy array
+        Replicate code of each row
+    num_x : integer
+        Number of conditions
+    num_reps : integer
+        Number of replicates
+
+    Returns
+    -------
+    order : numpy array or None
+        Order of the rows sorted by pair, or None if they are already sorted
+    offsets : numpy array
+        Start of the slice of each pair, followed by the number of rows
+
+    """
+    num_pairs = num_x * num_reps
+    pairs = np.asarray(x_codes).astype(np.int64) * num_reps + rep_codes
+    order = None
+    if np.any(pairs[1:] < pairs[:-1]):
+        order = np.argsort(pairs, kind="stable")
+        pairs = pairs[order]
+    offsets = np.zeros(num_pairs + 1, dtype=np.int64)
+    np.cumsum(np.bincount(pairs, minlength=num_pairs), out=offsets[1:])
+    return order, offsets
+
+def _lerp(a, b, t):
+    """
+    Linear interpolation computed the same way as np.percentile, so the
+    robust limits match it exactly
+    """
+    diff = b - a
+    return np.where(t >= 0.5, b - diff * (1 - t), a + diff * t)
+
+def _segment_sums(values, starts, counts):
+    """
+    Sum each segment of values, where empty segments sum to zero
+
+    Parameters
+    ----------
+    values : numpy array
+        Values of every segment, one segment after another
+    starts : numpy array
+        Index of the first value of each segment
+    counts : numpy array
+        Number of values in each segment
+
+    Returns
+    -------
+    numpy array
+        Sum of each segment
+
+    """
+    sums = np.zeros(len(starts))
+    filled = counts > 0
+    if values.size and filled.any():
+        # only the starts of non-empty segments are given, so each sum
+        # runs to the start of the next non-empty segment
+        sums[filled] = np.add.reduceat(values, starts[filled])
+    return sums
+
+def replicate_centres(values, offsets, how="mean"):
+    """
+    Calculate the middle value of every (condition, replicate) pair at once
+
+    Parameters
+    ----------
+    values : numpy array
+        Values sorted by pair, so each pair is a contiguous slice
+    offsets : numpy array
+        Start of the slice of each pair, followed by the number of values
+    how : string, optional
+        Either mean, median, or robust mean, which uses data between the
+        2.5 and 97.5 percentiles of each pair. NaN values are ignored.
+        The default is "mean".
+
+    Returns
+    -------
+    centres : numpy array
+        Middle value of each pair, NaN if it has no values that are not NaN
+    sizes : numpy array
+        Number of rows of each pair, including NaN values
+
+    """
+    if how not in SUMMARIES:
+        raise ValueError(f"Unsupported summary: {how}")
+    values = np.asarray(values, dtype=float)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    sizes = np.diff(offsets)
+    pair_ids = np.repeat(np.arange(sizes.size), sizes)
+
+    # drop NaN values, keeping the pairs contiguous
+    keep = ~np.isnan(values)
+    values = values[keep]
+    pair_ids = pair_ids[keep]
+    counts = np.bincount(pair_ids, minlength=sizes.size)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    centres = np.full(sizes.size, np.nan)
+    filled = counts > 0
+
+    if how == "mean":
+        sums = _segment_sums(values, starts, counts)
+        centres[filled] = sums[filled] / counts[filled]
+        return centres, sizes
+
+    # sort within each pair; the pairs themselves are already in order
+    values = values[np.lexsort((values, pair_ids))]
+    if how == "median":
+        lo = values[(starts + (counts - 1) // 2)[filled]]
+        hi = values[(starts + counts // 2)[filled]]
+        centres[filled] = (lo + hi) / 2
+        return centres, sizes
+
+    # robust mean between the percentile limits of each pair
+    limits = []
+    for q in ROBUST_LIMITS:
+        pos = q / 100 * (counts[filled] - 1)
+        below = np.floor(pos).astype(np.int64)
+        above = np.minimum(below + 1, counts[filled] - 1)
+        a = values[starts[filled] + below]
+        b = values[starts[filled] + above]
+        limit = np.full(sizes.size, np.nan)
+        limit[filled] = _lerp(a, b, pos - below)
+        limits.append(limit)
+    lower, upper = limits
+    inside = (values >= lower[pair_ids]) & (values <= upper[pair_ids])
+    kept = np.bincount(pair_ids, weights=inside, minlength=sizes.size)
+    sums = _segment_sums(np.where(inside, values, 0), starts, counts)
+    valid = kept > 0
+    centres[valid] = sums[valid] / kept[valid]
+    return centres, sizes
+
+def skeleton_stats(centres):
+    """
+    Summarize the replicate middle values of each condition for the
+    skeleton plot, ignoring NaN values as pandas does
+
+    Parameters
+    ----------
+    centres : numpy array
+        Middle value of each replicate (columns) of each condition (rows)
+
+    Returns
+    -------
+    dictionary
+        Mean, median, sample standard deviation and standard error of the
+        mean of each condition
+
+    """
+    centres = np.asarray(centres, dtype=float)
+    count = np.sum(~np.isnan(centres), axis=1)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        mean = np.nanmean(centres, axis=1)
+        median = np.nanmedian(centres, axis=1)
+        std = np.nanstd(centres, axis=1, ddof=1)
+    std[count < 2] = np.nan
+    return {"mean" : mean, "median" : median, "std" : std,
+            "sem" : std / np.sqrt(np.maximum(count, 1))}
+
+def _bootstrap_condition(values, how, n_resamples, confidence, seed):
+    """
+    Percentile bootstrap interval of the mean or median of one condition,
+    drawing every resample in a single array
+
+    Parameters
+    ----------
+    values : numpy array
+        Replicate middle values of the condition, without NaN values
+    how : string
+        Either "mean" or "median"
+    n_resamples : integer
+        Number of resamples
+    confidence : float
+        Confidence level of the interval
+    seed : numpy SeedSequence
+        Seed of the resamples of this condition
+
+    Returns
+    -------
+    tuple of floats
+        Lower and upper limits of the interval
+
+    """
+    if values.size == 0:
+        return np.nan, np.nan
+    rng = np.random.default_rng(seed)
+    resamples = values[rng.integers(0, values.size,
+                                    size=(n_resamples, values.size))]
+    if how == "median":
+        centres = np.median(resamples, axis=1)
+    else:
+        centres = resamples.mean(axis=1)
+    tail = (1 - confidence) / 2 * 100
+    lower, upper = np.percentile(centres, [tail, 100 - tail])
+    return lower, upper
+
+def bootstrap_intervals(centres, how="mean", n_resamples=BOOTSTRAP_SAMPLES,
+                        confidence=0.95, seed=0, n_jobs=1):
+    """
+    Percentile bootstrap confidence intervals of the mean or median of the
+    replicate middle values of each condition. Each condition gets its own
+    random stream spawned from seed, so the intervals do not depend on the
+    number of workers
+
+    Parameters
+    ----------
+    centres : numpy array
+        Middle value of each replicate (columns) of each condition (rows).
+        NaN values are ignored
+    how : string, optional
+        Either "mean" or "median". The default is "mean".
+    n_resamples : integer, optional
+        Number of resamples of each condition.
+        The default is BOOTSTRAP_SAMPLES.
+    confidence : float, optional
+        Confidence level of the intervals. The default is 0.95.
+    seed : integer, optional
+        Seed of the random number generator. The default is 0.
+    n_jobs : integer, optional
+        Number of worker processes. Values below 1 use every CPU core.
+        The default is 1.
+
+    Returns
+    -------
+    lower, upper : numpy arrays
+        Limits of the interval of each condition
+
+    """
+    centres = np.asarray(centres, dtype=float)
+    seeds = np.random.SeedSequence(seed).spawn(len(centres))
+    jobs = [(row[~np.isnan(row)], how, n_resamples, confidence, s)
+            for row, s in zip(centres, seeds)]
+    limits = np.array(map_jobs(_bootstrap_condition, jobs, n_jobs),
+                      dtype=float).reshape(len(centres), 2)
+    return limits[:, 0], limits[:, 1]
@@ -6,14 +6,45 @@ Created on Fri Mar 26 10:44:09 2021
 """
 
 import io
+import os
+import sys
 import pkgutil
+import subprocess
+import tempfile
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
 import unittest
+import json
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
+from click.testing import CliRunner
 
-from superviolin.plot import Superviolin
+from superviolin.plot import STAGES, Superviolin
 from superviolin import plot_cli
+from superviolin import kde
+from superviolin import cache
+from superviolin import benchmark
+from superviolin import batch
+from superviolin import readers
+from superviolin import summary
+from superviolin import stats
+
+def plotted_lines(ax, num_reps):
+    """
+    Get the lines of a Violin SuperPlot from its collections in the order
+    they were once drawn as separate lines: the separators and outline of
+    each condition followed by its summary statistics skeleton
+    """
+    collections = {c.get_gid() : c for c in ax.collections}
+    outlines = collections["outlines"].get_segments()
+    skeleton = collections["skeleton"].get_segments()
+    lines = []
+    for i in range(len(skeleton) // 4):
+        segments = outlines[i*(num_reps+1):(i+1)*(num_reps+1)]
+        segments += skeleton[i*4:(i+1)*4]
+        lines.extend(np.append(seg[:, 0], seg[:, 1]) for seg in segments)
+    return lines
 
 class TestingSuperplotMethods(unittest.TestCase):
     
@@ -30,10 +61,7 @@ class TestingSuperplotMethods(unittest.TestCase):
         ax = plt.gca()
         
         # get data from plot and close it
-        self.lines = []
-        for a in ax.lines:
-            arr = np.append(a.get_xdata(), a.get_ydata())
-            self.lines.append(arr)
+        self.lines = plotted_lines(ax, len(self.superviolin.unique_reps))
         plt.close()
     
     def test_plotted_lines_2_conditions(self):
@@ -43,8 +71,605 @@ class TestingSuperplotMethods(unittest.TestCase):
         real_lines = np.load(bytelines, allow_pickle=True)
         
         # compare generated data with expected data
+        self.assertEqual(len(self.lines), len(real_lines))
         for a,b in zip(self.lines, real_lines):
             np.testing.assert_allclose(a, b)
+    
+    def test_lines_keep_projecting_caps(self):
+        # the lines were once drawn separately with projecting caps
+        violin = Superviolin(condition="drug", value="variable",
+                             dataframe=self.superviolin.df)
+        fig, ax = violin.make_figure()
+        violin.generate_plot(ax=ax)
+        collections = {c.get_gid() : c for c in ax.collections}
+        for gid in ("outlines", "skeleton"):
+            self.assertEqual(collections[gid].get_capstyle(), "projecting")
+
+class TestingReplicateMarkers(unittest.TestCase):
+    
+    def test_interpolated_rows_match_numpy(self):
+        rng = np.random.default_rng(4)
+        grid = np.cumsum(rng.uniform(0.1, 1, 20))
+        rows = rng.normal(size=(6, 20))
+        values = np.array([grid[3], grid[0] - 1, grid[-1] + 1, np.nan,
+                           (grid[7] + grid[8]) / 2, grid[-1]])
+        result = Superviolin._interpolate_rows(rows, grid, values)
+        expected = [np.interp(v, grid, row) for row, v in zip(rows, values)]
+        np.testing.assert_allclose(result, expected)
+        self.assertTrue(np.isnan(result[3]))
+    
+    def test_markers_of_empty_replicate(self):
+        df = benchmark.make_tidy_data(40, 3, 3, "normal", seed=0)
+        empty = ("C2", "R2")
+        df = df[(df["condition"] != empty[0]) | (df["replicate"] != empty[1])]
+        violin = Superviolin(condition="condition", value="value",
+                             replicate="replicate", dataframe=df)
+        fig, ax = violin.make_figure()
+        violin.generate_plot(ax=ax)
+        collections = {c.get_gid() : c for c in ax.collections}
+        stripes = collections["stripes"].get_paths()
+        markers = collections["markers"].get_offsets()
+        
+        # each marker is halfway between the edges of its own stripe
+        pairs = [(c, r) for c in violin.subgroups for r in violin.unique_reps]
+        stripes = [s for s, pair in zip(stripes, pairs) if pair != empty]
+        self.assertEqual(len(markers), len(pairs) - 1)
+        for (x, y), stripe in zip(markers, stripes):
+            verts = stripe.vertices[:len(stripe.vertices) // 2 * 2]
+            left, right = np.split(verts, 2)
+            right = right[::-1]
+            edges = [np.interp(y, side[:, 1], side[:, 0])
+                     for side in (left, right)]
+            self.assertAlmostEqual(x, np.mean(edges))
+
+class TestingConcurrentRendering(unittest.TestCase):
+    
+    @staticmethod
+    def render(df, order):
+        violin = Superviolin(condition="drug", value="variable", order=order,
+                             stats_on_plot="yes", dataframe=df.copy())
+        fig, ax = violin.make_figure()
+        violin.generate_plot(ax=ax)
+        lines = plotted_lines(ax, len(violin.unique_reps))
+        lines += [np.append(a.get_xdata(), a.get_ydata()) for a in ax.lines]
+        return lines
+    
+    def test_threads_draw_independent_figures(self):
+        bytedata = pkgutil.get_data(__name__, "res/demo_data.csv")
+        df = pd.read_csv(io.BytesIO(bytedata))
+        orders = ["Control, Drug", "Drug, Control"] * 4
+        expected = {order : self.render(df, order) for order in set(orders)}
+        figures = len(plt.get_fignums())
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(lambda o: self.render(df, o), orders))
+        
+        # no pyplot figures are created and each figure only has its own lines
+        self.assertEqual(len(plt.get_fignums()), figures)
+        for order, lines in zip(orders, results):
+            self.assertEqual(len(lines), len(expected[order]))
+            for a, b in zip(lines, expected[order]):
+                np.testing.assert_allclose(a, b)
+
+class TestingStagedPipeline(unittest.TestCase):
+    
+    @staticmethod
+    def render(df, **params):
+        params = dict(dict(condition="drug", value="variable"), **params)
+        violin = Superviolin(stats_on_plot="yes", dataframe=df, **params)
+        fig, ax = violin.make_figure()
+        violin.generate_plot(ax=ax)
+        return violin, ax
+    
+    def test_changes_rerun_only_invalidated_stages(self):
+        bytedata = pkgutil.get_data(__name__, "res/demo_data.csv")
+        df = pd.read_csv(io.BytesIO(bytedata))
+        violin, ax = self.render(df)
+        fitted = violin.subgroup_dict["Drug"]["norm_wy"]
+        
+        # cosmetic changes redraw the figure without fitting again
+        stages = violin.set_params(total_width=0.5, linewidth=2,
+                                   xlabel="Drug")
+        self.assertEqual(stages, ("redraw",))
+        self.assertEqual(violin.update(), ("redraw",))
+        self.assertIs(violin.subgroup_dict["Drug"]["norm_wy"], fitted)
+        expected, expected_ax = self.render(df, total_width=0.5,
+                                            linewidth=2, xlabel="Drug")
+        lines = plotted_lines(ax, len(violin.unique_reps))
+        expected_lines = plotted_lines(expected_ax, len(violin.unique_reps))
+        self.assertEqual(len(lines), len(expected_lines))
+        for a, b in zip(lines, expected_lines):
+            np.testing.assert_allclose(a, b)
+        self.assertEqual(ax.get_xlabel(), "Drug")
+        np.testing.assert_allclose(ax.get_xlim(), expected_ax.get_xlim())
+        
+        # unchanged values invalidate nothing, while data changes
+        # invalidate every stage which depends on them
+        self.assertEqual(violin.set_params(total_width=0.5), ())
+        self.assertEqual(violin.set_params(order="Drug, Control"),
+                         ("statistics", "render", "redraw"))
+        self.assertEqual(violin.set_params(bw=0.5),
+                         ("kde", "render", "redraw"))
+        self.assertEqual(violin.set_params(dataframe=df.copy()),
+                         ("load", "kde", "statistics", "render", "redraw"))
+        self.assertEqual(violin.update(), STAGES)
+        self.assertEqual(violin.stale_stages, ())
+        with self.assertRaises(TypeError):
+            violin.set_params(width=1)
+    
+    def test_order_changes_recompute_statistics(self):
+        df = benchmark.make_tidy_data(100, 4, 5, "skewed", seed=3)
+        violin, ax = self.render(df, condition="condition", value="value",
+                                 order="C2, C0", return_stats=True)
+        
+        # the same number of conditions, but different ones
+        self.assertEqual(violin.set_params(order="C1, C0"),
+                         ("kde", "statistics", "render", "redraw"))
+        violin.update()
+        result = stats.compute_statistics(dataframe=df, order="C1, C0")
+        self.assertEqual(violin._statistics[0], result["p_value"])
+        self.assertEqual(violin.set_params(cmap="Set1"), ("render", "redraw"))
+
+class TestingBatchMode(unittest.TestCase):
+    
+    def test_batch_renders_data_dir_and_reports_failures(self):
+        bytedata = pkgutil.get_data(__name__, "res/demo_data.csv")
+        args = pkgutil.get_data(__name__, "res/demo_args.txt")
+        with tempfile.TemporaryDirectory() as tmp:
+            data_dir = os.path.join(tmp, "data")
+            os.makedirs(data_dir)
+            for name in ("a.csv", "b.csv"):
+                with open(os.path.join(data_dir, name), "wb") as f:
+                    f.write(bytedata)
+            with open(os.path.join(data_dir, "broken.csv"), "w") as f:
+                f.write("x,y\n1,2\n")
+            template = os.path.join(tmp, "args.txt")
+            with open(template, "wb") as f:
+                f.write(args)
+            out_dir = os.path.join(tmp, "out")
+            
+            figures = len(plt.get_fignums())
+            result = CliRunner().invoke(plot_cli.cli, [
+                "batch", "--data-dir", data_dir, "--template", template,
+                "--out-dir", out_dir, "--formats", "png,svg"])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertEqual(len(plt.get_fignums()), figures)
+            
+            with open(os.path.join(out_dir, "batch_report.json")) as f:
+                report = json.load(f)
+            self.assertEqual((report["succeeded"], report["failed"]), (2, 1))
+            status = {job["name"] : job["status"] for job in report["jobs"]}
+            self.assertEqual(status, {"a" : "ok", "b" : "ok",
+                                      "broken" : "failed"})
+            for name in ("a.png", "a.svg", "b.png", "b.svg"):
+                self.assertTrue(os.path.exists(os.path.join(out_dir, name)))
+    
+    def test_report_is_valid_json_without_a_p_value(self):
+        bytedata = pkgutil.get_data(__name__, "res/demo_data.csv")
+        df = pd.read_csv(io.BytesIO(bytedata))
+        args = plot_cli.get_args(demonstration=True)
+        with tempfile.TemporaryDirectory() as tmp:
+            # a single replicate gives a NaN P value
+            filename = os.path.join(tmp, "one.csv")
+            df[df["replicate"] == df["replicate"].iloc[0]].to_csv(filename,
+                                                                 index=False)
+            summary = batch.run_batch([("one", dict(args, filename=filename))],
+                                      os.path.join(tmp, "out"))
+            with open(summary["report"]) as f:
+                report = json.load(f, parse_constant=self.fail)
+        self.assertEqual(report["jobs"][0]["status"], "ok")
+        self.assertIsNone(report["jobs"][0]["p_value"])
+
+class TestingStatistics(unittest.TestCase):
+    
+    def test_statistics_match_generated_plot(self):
+        df = benchmark.make_tidy_data(100, 4, 5, "skewed", seed=3)
+        violin = Superviolin(dataframe=df.copy(), return_stats=True)
+        fig, ax = violin.make_figure()
+        p, posthoc = violin.generate_plot(ax=ax)
+        result = stats.compute_statistics(dataframe=df, cmap="Set2")
+        self.assertEqual(result["test"], "One-way ANOVA")
+        self.assertEqual(result["p_value"], p)
+        pd.testing.assert_frame_equal(result["posthoc"].round(3), posthoc)
+    
+    def test_statistics_of_ordered_conditions(self):
+        # only the plotted conditions are compared, in their order
+        df = benchmark.make_tidy_data(100, 4, 5, "skewed", seed=3)
+        for order in ("C0, C1, C2", "C2, C0", "C3, C1"):
+            violin = Superviolin(dataframe=df.copy(), order=order,
+                                 return_stats=True)
+            fig, ax = violin.make_figure()
+            p, posthoc = violin.generate_plot(ax=ax)
+            result = stats.compute_statistics(dataframe=df, order=order)
+            self.assertEqual(result["p_value"], p)
+            if result["posthoc"] is not None:
+                pd.testing.assert_frame_equal(result["posthoc"].round(3),
+                                              posthoc)
+            self.assertEqual(result["conditions"], order.split(", "))
+    
+    def test_posthoc_distributions_match_scipy(self):
+        from scipy.stats import studentized_range, t
+        q = np.array([0.2, 1.5, 3.0, 4.5, 7.0])
+        for k, df in ((3, 6), (10, 40)):
+            np.testing.assert_allclose(stats.studentized_range_sf(q, k, df),
+                                       studentized_range.sf(q, k, df),
+                                       atol=1e-7)
+        
+        # a single comparison with the control is a two-sided t-test
+        np.testing.assert_allclose(stats.dunnett_sf(q, [4], 4, 9),
+                                   2 * t.sf(q, 9), atol=1e-7)
+    
+    def test_control_comparisons(self):
+        df = benchmark.make_tidy_data(50, 5, 4, "normal", seed=2)
+        result = stats.compute_statistics(dataframe=df, control="C2")
+        self.assertEqual(result["posthoc_test"], "Dunnett")
+        self.assertEqual(list(result["posthoc"].index), ["C0", "C1", "C3", "C4"])
+        self.assertEqual(list(result["posthoc"].columns), ["C2"])
+        
+        # fewer comparisons are corrected for, so P values are no larger
+        # than Tukey's P values of the same pairs
+        tukey = stats.compute_statistics(dataframe=df)["posthoc"]
+        self.assertTrue(np.all(result["posthoc"]["C2"]
+                               <= tukey.loc[["C0", "C1", "C3", "C4"], "C2"]))
+    
+    def test_command_does_not_import_matplotlib(self):
+        bytedata = pkgutil.get_data(__name__, "res/demo_data.csv")
+        args = pkgutil.get_data(__name__, "res/demo_args.txt")
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in ("a.csv", "b.csv"):
+                with open(os.path.join(tmp, name), "wb") as f:
+                    f.write(bytedata)
+            template = os.path.join(tmp, "args.txt")
+            with open(template, "wb") as f:
+                f.write(args)
+            out = os.path.join(tmp, "statistics.json")
+        
+            # run in a new interpreter as this module already imports matplotlib
+            code = ("import sys\n"
+                    "from click.testing import CliRunner\n"
+                    "from superviolin import plot_cli\n"
+                    f"args = ['stats', '--data-dir', {tmp!r}, '--template', "
+                    f"{template!r}, '--out', {out!r}]\n"
+                    "result = CliRunner().invoke(plot_cli.cli, args)\n"
+                    "assert result.exit_code == 0, result.output\n"
+                    "print('matplotlib' in sys.modules)\n")
+            output = subprocess.run([sys.executable, "-c", code], check=True,
+                                    capture_output=True, text=True).stdout
+            self.assertEqual(output.strip(), "False")
+            with open(out) as f:
+                results = json.load(f)
+        self.assertEqual([r["name"] for r in results], ["a", "b"])
+        self.assertEqual(results[0]["test"], "Paired t-test")
+        self.assertEqual(results[0]["p_value"], results[1]["p_value"])
+    
+    def test_report_is_valid_json_without_a_p_value(self):
+        # P values which are not numbers are saved as null
+        bytedata = pkgutil.get_data(__name__, "res/demo_data.csv")
+        df = pd.read_csv(io.BytesIO(bytedata))
+        args = plot_cli.get_args(demonstration=True)
+        result = stats.dataset_statistics("one", dict(
+            args, dataframe=df[df["replicate"] == df["replicate"].iloc[0]]))
+        self.assertIsNone(result["p_value"])
+        json.dumps(result, allow_nan=False)
+
+class TestingMemoryProfile(unittest.TestCase):
+    
+    def test_report_lists_each_stage(self):
+        bytedata = pkgutil.get_data(__name__, "res/demo_data.csv")
+        df = pd.read_csv(io.BytesIO(bytedata))
+        violin = Superviolin(condition="drug", value="variable",
+                             dataframe=df, memprofile="yes")
+        fig, ax = violin.make_figure()
+        violin.generate_plot(ax=ax)
+        self.assertFalse(tracemalloc.is_tracing())
+        
+        report = violin.memory_report()
+        stages = [stage["stage"] for stage in report["stages"]]
+        self.assertEqual(stages, ["load", "coercion", "group_index",
+                                  "get_kde_data", "plot_subgroups",
+                                  "get_statistics"])
+        for stage in report["stages"]:
+            self.assertGreaterEqual(stage["traced_peak_bytes"],
+                                    stage["traced_retained_bytes"])
+
+class TestingBenchmark(unittest.TestCase):
+    
+    def test_synthetic_data_is_seeded(self):
+        for shape in benchmark.SHAPES:
+            a = benchmark.make_tidy_data(50, 3, 4, shape, seed=1)
+            b = benchmark.make_tidy_data(50, 3, 4, shape, seed=1)
+            pd.testing.assert_frame_equal(a, b)
+            self.assertEqual(len(a), 50 * 3 * 4)
+            self.assertEqual(a.groupby(["condition", "replicate"]).size().nunique(), 1)
+    
+    def test_regressions_are_flagged(self):
+        baseline = {"cases" : {"a" : {"kde" : 1.0, "render" : 0.001}}}
+        results = {"cases" : {"a" : {"kde" : 1.5, "render" : 0.004},
+                              "b" : {"kde" : 9.0}}}
+        regressions = benchmark.find_regressions(results, baseline)
+        self.assertEqual([(r["case"], r["stage"]) for r in regressions],
+                         [("a", "kde")])
+    
+    def test_save_baseline_needs_a_file(self):
+        result = CliRunner().invoke(plot_cli.cli, ["bench", "--save-baseline"])
+        self.assertEqual(result.exit_code, 2)
+        self.assertIn("--save-baseline needs the --baseline file", result.output)
+    
+    def test_command_line_does_not_import_plotting_modules(self):
+        # the command line must not load the modules used for plotting
+        code = ("import sys; import superviolin.plot_cli; "
+                "print(' '.join(sorted(sys.modules)))")
+        out = subprocess.run([sys.executable, "-c", code], check=True,
+                             capture_output=True, text=True).stdout.split()
+        for module in ("numpy", "pandas", "scipy", "matplotlib", "unittest"):
+            self.assertNotIn(module, out)
+        
+        # nor does the plot module until a figure or statistics are made
+        code = code.replace("superviolin.plot_cli", "superviolin.plot")
+        out = subprocess.run([sys.executable, "-c", code], check=True,
+                             capture_output=True, text=True).stdout.split()
+        for module in ("scipy.stats", "matplotlib"):
+            self.assertNotIn(module, out)
+        
+        # the time taken is left to the bench command, which checks it
+        # against a fixed limit
+        results = {"startup" : benchmark.STARTUP_LIMIT * 2, "cases" : {}}
+        self.assertEqual([r["stage"] for r in
+                          benchmark.startup_regressions(results)], ["startup"])
+        self.assertEqual(benchmark.startup_regressions({"cases" : {}}), [])
+
+class TestingColumnarInput(unittest.TestCase):
+    
+    def test_parquet_reads_needed_columns_and_conditions(self):
+        try:
+            import pyarrow # noqa: F401
+        except ImportError:
+            self.skipTest("pyarrow is not installed")
+        bytedata = pkgutil.get_data(__name__, "res/demo_data.csv")
+        df = pd.read_csv(io.BytesIO(bytedata))
+        df["unused"] = 0
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "demo.parquet")
+            df.to_parquet(filename, row_group_size=100)
+            columns = ["drug", "variable", "replicate"]
+            tidy = readers.read_tidy(filename, columns)
+            self.assertEqual(list(tidy.columns), columns)
+            pd.testing.assert_frame_equal(tidy, df[columns])
+            
+            drug = readers.read_tidy(filename, columns, condition="drug",
+                                     conditions=["Drug"])
+            self.assertEqual(set(drug["drug"]), {"Drug"})
+            self.assertEqual(len(drug), (df["drug"] == "Drug").sum())
+
+    def test_compressed_feather_reads_needed_columns(self):
+        try:
+            import pyarrow as pa
+        except ImportError:
+            self.skipTest("pyarrow is not installed")
+        bytedata = pkgutil.get_data(__name__, "res/demo_data.csv")
+        df = pd.read_csv(io.BytesIO(bytedata))
+        df["unused"] = 0
+        df["notes"] = "unused"
+        columns = ["replicate", "drug", "variable"]
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "demo.feather")
+            df.to_feather(filename, compression="zstd")
+            tidy = readers.read_tidy(filename, columns)
+            self.assertEqual(list(tidy.columns), columns)
+            pd.testing.assert_frame_equal(tidy, df[columns])
+            
+            filename = os.path.join(tmp, "demo.arrows")
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            options = pa.ipc.IpcWriteOptions(compression="lz4")
+            with pa.ipc.new_stream(filename, table.schema,
+                                   options=options) as writer:
+                writer.write_table(table)
+            tidy = readers.read_tidy(filename, columns)
+            pd.testing.assert_frame_equal(tidy, df[columns])
+
+class TestingCompactColumns(unittest.TestCase):
+    
+    def test_columns_are_encoded_without_changing_input(self):
+        df = pd.DataFrame({"condition" : [2, 1, 2, 1, 2, 1] * 2,
+                           "replicate" : ["b"] * 6 + ["a"] * 6,
+                           "value" : [1, 2, 3, 4, 5, 7] * 2})
+        original = df.copy()
+        violin = Superviolin(dataframe=df)
+        pd.testing.assert_frame_equal(df, original)
+        
+        self.assertIsInstance(violin.df["condition"].dtype, pd.CategoricalDtype)
+        self.assertEqual(violin.df["value"].dtype, np.float32)
+        self.assertEqual(violin.subgroups, ("1", "2"))
+        self.assertEqual(violin.unique_reps, ("b", "a"))
+        np.testing.assert_array_equal(violin._replicate_values("1", "a"),
+                                      [2, 4, 7])
+
+class TestingReplicateSummaries(unittest.TestCase):
+    
+    def test_vectorized_centres_match_numpy(self):
+        rng = np.random.default_rng(0)
+        pairs = [rng.normal(size=n) for n in (5, 0, 1, 40, 3)]
+        pairs[3][::7] = np.nan
+        pairs.append(np.array([np.nan, np.nan]))
+        offsets = np.concatenate([[0], np.cumsum([p.size for p in pairs])])
+        values = np.concatenate(pairs)
+        
+        def robust(arr):
+            lower, upper = np.percentile(arr, [2.5, 97.5])
+            return arr[(arr >= lower) & (arr <= upper)].mean()
+        
+        for how, func in (("mean", np.mean), ("median", np.median),
+                          ("robust", robust)):
+            centres, sizes = summary.replicate_centres(values, offsets, how)
+            expected = [func(p[~np.isnan(p)]) if np.any(~np.isnan(p))
+                        else np.nan for p in pairs]
+            np.testing.assert_allclose(centres, expected, rtol=1e-12)
+            np.testing.assert_array_equal(sizes, [p.size for p in pairs])
+    
+    def test_bootstrap_intervals_are_seeded(self):
+        rng = np.random.default_rng(0)
+        centres = rng.normal(size=(6, 4))
+        centres[1] = np.nan
+        centres[2, 1:] = np.nan
+        lower, upper = summary.bootstrap_intervals(centres, n_resamples=2000)
+        pooled = summary.bootstrap_intervals(centres, n_resamples=2000,
+                                             n_jobs=2)
+        np.testing.assert_array_equal(lower, pooled[0])
+        np.testing.assert_array_equal(upper, pooled[1])
+        
+        # conditions without replicates have no interval, and a single
+        # replicate gives an interval of no width
+        self.assertTrue(np.isnan(lower[1]) and np.isnan(upper[1]))
+        self.assertEqual((lower[2], upper[2]), (centres[2, 0], centres[2, 0]))
+        means = centres.mean(axis=1)
+        self.assertTrue(np.all((lower[3:] < means[3:]) & (means[3:] < upper[3:])))
+
+class TestingUntidyExcel(unittest.TestCase):
+    
+    def test_workbook_matches_melted_sheets(self):
+        from openpyxl import Workbook
+        wb = Workbook()
+        ws = wb.active
+        ws.title = "rep1"
+        for row in (["A", "B", None, "D"], [1, 2, None, 4], [3], [], [None]):
+            ws.append(row)
+        wb.create_sheet("empty").append(["A", "B"])
+        ws = wb.create_sheet("rep2")
+        for row in (["A", "B"], [5, 6], [None, 7], [8]):
+            ws.append(row)
+        ws = wb.create_sheet("rep3")
+        for row in (["A", "A", "B", "A.1"], [9, 10, 11, 12]):
+            ws.append(row)
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "untidy.xlsx")
+            wb.save(filename)
+            tidy = readers.read_untidy_excel(filename)
+            
+            # reference: every non-empty sheet parsed by pandas and melted
+            xl = pd.ExcelFile(filename)
+            dfs = []
+            for sheet in xl.sheet_names:
+                df = xl.parse(sheet)
+                if not df.empty:
+                    df = df.melt(var_name="condition", value_name="value")
+                    df["replicate"] = sheet
+                    dfs.append(df)
+            expected = pd.concat(dfs, ignore_index=True)
+            xl.close()
+        
+        self.assertEqual(list(tidy["condition"]), list(expected["condition"]))
+        self.assertEqual(list(tidy["replicate"]), list(expected["replicate"]))
+        np.testing.assert_array_equal(tidy["value"],
+                                      expected["value"].astype(float))
+
+class TestingParsedFileCache(unittest.TestCase):
+    
+    def test_cached_file_matches_parsed_file(self):
+        bytedata = pkgutil.get_data(__name__, "res/demo_data.csv")
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "demo.csv")
+            with open(filename, "wb") as f:
+                f.write(bytedata)
+            kwargs = dict(filename=filename, condition="drug",
+                          value="variable", file_cache="yes", cache_dir=tmp)
+            parsed = Superviolin(**kwargs)
+            cached = Superviolin(**kwargs)
+            self.assertIsInstance(cached._offsets, np.memmap)
+            pd.testing.assert_frame_equal(cached.df, parsed.df)
+            np.testing.assert_array_equal(cached._offsets, parsed._offsets)
+            self.assertEqual(cached.unique_reps, parsed.unique_reps)
+            
+            # a changed file is parsed again
+            with open(filename, "a") as f:
+                f.write("1.0,Extra,new\n")
+            changed = Superviolin(**kwargs)
+            self.assertNotIsInstance(changed._offsets, np.memmap)
+            self.assertIn("new", changed.unique_reps)
+
+class TestingKDEEngines(unittest.TestCase):
+    
+    def test_fft_engine_within_tolerance(self):
+        rng = np.random.default_rng(0)
+        samples = (rng.normal(size=2000), rng.lognormal(sigma=1.5, size=2000),
+                   np.append(rng.normal(0, 1, 500), rng.normal(20, 0.5, 500)))
+        for arr in samples:
+            for bw in (None, 0.1, 1.0):
+                points = np.linspace(arr.min(), arr.max(), 128)
+                exact, _ = kde.evaluate_kde(arr, points, bw, "exact")
+                fft, _ = kde.evaluate_kde(arr, points, bw, "fft")
+                error = np.abs(exact - fft).max() / exact.max()
+                self.assertLess(error, kde.FFT_TOLERANCE)
+        
+        # a wide span against a small bandwidth needs more bins than
+        # FFT_MAX_BINS, so the exact density is used
+        arr = samples[2]
+        points = np.linspace(arr.min(), arr.max(), 4096)
+        exact, _ = kde.evaluate_kde(arr, points, 1e-5, "exact")
+        fft, _ = kde.evaluate_kde(arr, points, 1e-5, "fft")
+        np.testing.assert_array_equal(fft, exact)
+    
+    def test_truncated_engine_matches_exact(self):
+        rng = np.random.default_rng(1)
+        arr = rng.lognormal(sigma=1, size=5000)
+        points = np.linspace(arr.min(), arr.max(), 128)
+        exact, _ = kde.evaluate_kde(arr, points, None, "exact")
+        truncated, _ = kde.evaluate_kde(arr, points, None, "truncated")
+        np.testing.assert_allclose(truncated, exact, rtol=0,
+                                   atol=exact.max() * 1e-7)
+    
+    def test_batch_exact_engine_matches_single_fits(self):
+        rng = np.random.default_rng(2)
+        arrays = [rng.normal(size=300), np.array([]), rng.lognormal(size=1000)]
+        points = np.linspace(-3, 10, 128)
+        densities, factors = kde.batch_kde(arrays, points)
+        self.assertEqual(densities.shape, (3, 128))
+        self.assertIsNone(factors[1])
+        np.testing.assert_array_equal(densities[1], 0)
+        for i in (0, 2):
+            single, factor = kde.evaluate_kde(arrays[i], points)
+            np.testing.assert_allclose(densities[i], single, atol=1e-12)
+            self.assertAlmostEqual(factors[i], factor)
+    
+    def test_adaptive_grid_points(self):
+        # limited by the pixels available, then by the bandwidth
+        self.assertEqual(kde.adaptive_grid_points(10, 0.001, 150), 150)
+        self.assertEqual(kde.adaptive_grid_points(10, 1, 1500), 41)
+        self.assertEqual(kde.adaptive_grid_points(10, 100, 1500), 16)
+    
+    def test_process_pool_matches_serial_fits(self):
+        bytedata = pkgutil.get_data(__name__, "res/demo_data.csv")
+        df = pd.read_csv(io.BytesIO(bytedata))
+        results = []
+        for n_jobs in (1, 2):
+            violin = Superviolin(condition="drug", value="variable",
+                                 dataframe=df.copy())
+            violin.get_kde_data(n_jobs=n_jobs)
+            results.append(violin.subgroup_dict)
+        for group in results[0]:
+            for key in ("norm_wy", "px"):
+                np.testing.assert_array_equal(results[0][group][key],
+                                              results[1][group][key])
+
+class TestingKDECache(unittest.TestCase):
+    
+    def test_cached_results_match_fresh_fits(self):
+        bytedata = pkgutil.get_data(__name__, "res/demo_data.csv")
+        df = pd.read_csv(io.BytesIO(bytedata))
+        with tempfile.TemporaryDirectory() as cache_dir:
+            results = []
+            
+            # fit, then read back from memory, then from disk
+            memory = cache.KDECache(cache_dir=cache_dir)
+            for kde_cache in (memory, memory, cache.KDECache(cache_dir=cache_dir)):
+                violin = Superviolin(condition="drug", value="variable",
+                                     dataframe=df.copy(), kde_cache=kde_cache)
+                violin.get_kde_data(cache=violin.kde_cache)
+                results.append(violin.subgroup_dict)
+            self.assertEqual(len(os.listdir(cache_dir)), len(results[0]))
+        for group in results[0]:
+            for result in results[1:]:
+                np.testing.assert_array_equal(results[0][group]["norm_wy"],
+                                              result[group]["norm_wy"])
         
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
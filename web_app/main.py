@@ -8,13 +8,21 @@ Created on Sat Jul 24 16:21:59 2021
 
 import re
 import scipy
+import hashlib
 import pandas as pd
+from io import BytesIO
 import streamlit as st
-import matplotlib.pyplot as plt
 from datetime import datetime
 from superviolin.plot import Superviolin
-from matplotlib import rcParams as params
+from superviolin.readers import read_untidy_excel
+from superviolin.stats import compute_statistics
 from streamlit_extras.dataframe_explorer import dataframe_explorer
+
+# width in pixels of the plot preview, which is rendered at screen
+# resolution; exports are only rendered at the chosen dpi on request
+PREVIEW_WIDTH = 600
+EXPORT_FORMATS = ("PNG", "SVG", "PDF")
+
 st.set_page_config(page_title="Violin SuperPlot Web App",
                    page_icon="violin",
                    layout="wide")
@@ -70,7 +78,8 @@ with st.sidebar.expander("Violin SuperPlot formatting"):
     dpi = st.text_input("DPI for saving the Violin SuperPlot", "1200")
     mid_vals = st.radio("Mean or median per replicate", ("Mean", "Median"))
     centre_vals = st.radio("Mean or median for overall statistics", ("Mean", "Median"))
-    error_bars = st.radio("Choose format for error bars", ("SEM", "SD", "95% CI"))
+    error_bars = st.radio("Choose format for error bars",
+                          ("SEM", "SD", "95% CI", "Bootstrap 95% CI"))
     paired = st.radio("Paired data", ("Yes", "No"))
     stats_on_plot = st.radio("Show statistics on plot (only works for 2 conditions)",
                                ("Yes", "No"))
@@ -91,14 +100,14 @@ with st.sidebar.expander("General plot formatting"):
     rotate_xticks = st.slider("X-tick rotation", value=0, min_value=0,
                               max_value=90, step=5)
     log_scale = st.checkbox('Log scale for Y axis')
-    params["xtick.labelsize"] = xtick_lbl_size
-    params["ytick.labelsize"] = ytick_lbl_size
-    params["axes.labelsize"] = axes_lbl_size
-    params["axes.linewidth"] = axes_lw
-    params["xtick.minor.width"] = axes_lw / 2
-    params["ytick.minor.width"] = axes_lw / 2
-    params["xtick.major.width"] = axes_lw
-    params["ytick.major.width"] = axes_lw
+    style = {"xtick.labelsize" : xtick_lbl_size,
+             "ytick.labelsize" : ytick_lbl_size,
+             "axes.labelsize" : axes_lbl_size,
+             "axes.linewidth" : axes_lw,
+             "xtick.minor.width" : axes_lw / 2,
+             "ytick.minor.width" : axes_lw / 2,
+             "xtick.major.width" : axes_lw,
+             "ytick.major.width" : axes_lw}
 
 # include publication stats
 with st.sidebar:
@@ -107,6 +116,10 @@ with st.sidebar:
 
 @st.cache_data
 def read_data(fname, ending, tidy, condition, value, replicate):
+    if tidy != "Tidy":
+        # read all sheets of the "untidy" workbook in a single pass
+        return read_untidy_excel(fname, condition, value, replicate)
+    
     if ending == "CSV":
         df = pd.read_csv(fname)
     else:
@@ -114,22 +127,39 @@ def read_data(fname, ending, tidy, condition, value, replicate):
     assert condition in df.columns, st.markdown('Condition column not found in data; Are you sure you typed it correctly?')
     assert value in df.columns, st.markdown('Value column not found; Are you sure you typed it correctly?')
     assert replicate in df.columns, st.markdown('Replicate column not found; Are you sure you typed it correctly?')
-        
-    if tidy != "Tidy":
-        # read multiple sheets in "untidy" format
-        xl = pd.ExcelFile(fname)
-        sheets = xl.sheet_names # replicates
-        dfs = []
-        for s in sheets:
-            df = xl.parse(s)
-            if not df.empty:
-                df = df.melt(value_vars=df.columns.tolist(),
-                             var_name=condition,
-                             value_name=value)
-                df[replicate] = s
-                dfs.append(df)
-        df = pd.concat(dfs)
     return df
+
+@st.cache_data(max_entries=32)
+def get_statistics(df, condition, value, replicate, order, centre_val, paired):
+    # statistics are computed once for each filtered dataset and settings,
+    # without fitting kernel density estimators
+    result = compute_statistics(condition=condition, value=value,
+                                replicate=replicate, order=order,
+                                centre_val=centre_val, paired_data=paired,
+                                dataframe=df)
+    return result["p_value"], result["posthoc"]
+
+def render(fig, fmt, dpi):
+    buffer = BytesIO()
+    fig.savefig(buffer, format=fmt, dpi=dpi)
+    return buffer.getvalue()
+
+def figure_state(df, settings, *options):
+    # identifies everything drawn on the figure, so exports of an unchanged
+    # figure are not rendered again
+    data = hashlib.sha1(pd.util.hash_pandas_object(df).to_numpy().tobytes())
+    return data.hexdigest(), repr(sorted(settings.items())), options
+
+def export(fig, fmt, dpi, state):
+    # keep the exports of the current figure only, rendering each format
+    # the first time it is requested
+    if st.session_state.get("export_state") != state:
+        st.session_state["export_state"] = state
+        st.session_state["exports"] = {}
+    exports = st.session_state["exports"]
+    if fmt not in exports:
+        exports[fmt] = render(fig, fmt.lower(), dpi)
+    return exports[fmt]
     
 # process logic to make superviolin
 if uploaded_file is not None:
@@ -142,60 +172,80 @@ if uploaded_file is not None:
     
     if bw == 0:
         bw = "None"
+    if error_bars == "Bootstrap 95% CI":
+        error_bars = "bootstrap"
     if stats_on_plot == "Yes":
         show_stats = True
     else:
         show_stats = False
-    plot = Superviolin(dataframe=fdf, condition=condition, value=value,
-                       replicate=replicate, centre_val=centre_vals.lower(),
-                       xlabel=xlabel, middle_vals=mid_vals.lower(),
-                       error_bars=error_bars, ylabel=ylabel, bw=bw,
-                       stats_on_plot=stats_on_plot.lower(), dpi=int(dpi),
-                       paired_data=paired.lower(), return_stats=True,
-                       cmap=cmap, order=order, ylimits=ylims,
-                       sep_linewidth=violin_sep_lw, total_width=violin_width)
-    plot.get_kde_data(plot.bw)
+    settings = dict(condition=condition, value=value,
+                    replicate=replicate, centre_val=centre_vals.lower(),
+                    xlabel=xlabel, middle_vals=mid_vals.lower(),
+                    error_bars=error_bars, ylabel=ylabel, bw=bw,
+                    stats_on_plot=stats_on_plot.lower(), dpi=int(dpi),
+                    paired_data=paired.lower(), return_stats=True,
+                    cmap=cmap, order=order, ylimits=ylims,
+                    sep_linewidth=violin_sep_lw, total_width=violin_width,
+                    style=style)
+    plot = Superviolin(dataframe=fdf, kde_cache="memory", **settings)
+    
+    # kernel density estimators are kept in memory keyed on the data of each
+    # replicate and the fitting parameters, so reruns which only change the
+    # appearance of the plot reuse them. The figure does not use pyplot, so
+    # concurrent sessions do not share any state
+    fig, ax = plot.make_figure()
+    plot.get_kde_data(plot.bw, cache=plot.kde_cache)
     plot.plot_subgroups(plot.centre_val, plot.middle_vals,
                         plot.error_bars, plot.ylimits,
                         plot.total_width, plot.linewidth,
-                        plot.stats_on_plot, plot.show_legend)
-    plt.xticks(rotation=rotate_xticks)
+                        plot.stats_on_plot, plot.show_legend, ax)
+    try:
+        p, info = get_statistics(fdf, condition, value, replicate, order,
+                                 plot.centre_val, plot.paired)
+    except Exception:
+        p = info = None
+    else:
+        if info is not None:
+            info = info.round(3)
+        plot.overlay_statistics(p, info, plot.stats_on_plot, plot.ylimits, ax)
+    ax.tick_params(axis="x", labelrotation=rotate_xticks)
     if log_scale:
-        plt.yscale('log')
-    plt.savefig("ViolinSuperPlot.png", dpi=int(dpi))
-    plt.savefig("ViolinSuperPlot.svg", dpi=int(dpi))
-    st.image("ViolinSuperPlot.png", caption="Your Violin SuperPlot",
-                 width=600)
+        ax.set_yscale('log')
     
-    col1, col2 = st.sidebar.columns(2)
-    with open("ViolinSuperPlot.svg", "rb") as f:
-        fname = datetime.now().strftime("%Y%m%d_%H-%M-%S_ViolinSuperPlot.svg")
-        col1.download_button("Download SVG", data=f, file_name=fname)
-    with open("ViolinSuperPlot.png", "rb") as f:
-        fname = datetime.now().strftime("%Y%m%d_%H-%M-%S_ViolinSuperPlot.png")
-        col2.download_button("Download PNG", data=f, file_name=fname)
+    # render in memory rather than to files shared by every session,
+    # showing a preview at screen resolution
+    preview_dpi = min(plot.dpi, PREVIEW_WIDTH / fig.get_figwidth())
+    st.image(render(fig, "png", preview_dpi),
+             caption="Your Violin SuperPlot", width=PREVIEW_WIDTH)
+    
+    # the full dpi export is only rendered once a format is requested
+    state = figure_state(fdf, settings, rotate_xticks, log_scale)
+    fmt = st.sidebar.selectbox("Download format", EXPORT_FORMATS)
+    exports = st.session_state.get("exports", {})
+    ready = st.session_state.get("export_state") == state and fmt in exports
+    if ready or st.sidebar.button(f"Prepare {fmt} download"):
+        data = export(fig, fmt, plot.dpi, state)
+        fname = datetime.now().strftime(
+            f"%Y%m%d_%H-%M-%S_ViolinSuperPlot.{fmt.lower()}")
+        st.sidebar.download_button(f"Download {fmt}", data=data,
+                                   file_name=fname)
     
     # show statistics
-    try:
-        p, info = plot.get_statistics(plot.centre_val, plot.paired,
-                                      plot.stats_on_plot, plot.ylimits,
-                                      plot.return_stats)
-        if len(plot.subgroups) == 2:
-            if paired == "yes":
-                st.write(f"Paired t-test p-value {p:.3f}")
-            else:
-                st.write(f"Unpaired t-test p-value {p:.3f}")
-        else:
-            st.markdown(f"<p><em>One-way ANOVA p-value <strong>{p:.3f}<strong></em><br><br>Table of Tukey posthoc statistics:</p>",
-                        unsafe_allow_html=True)
-            st.table(info)
-            fname = f"posthoc_statistics_{value}.txt"
-            try:
-                with open(fname, "rb") as f:
-                    st.sidebar.download_button("Download posthoc statistics",
-                                               data=f, file_name=fname)
-            except:
-                pass
-    except:
+    if p is None:
         st.write("Error calculating statistics")
+    elif len(plot.subgroups) < 2:
+        st.write(p)
+    elif len(plot.subgroups) == 2:
+        if plot.paired == "yes":
+            st.write(f"Paired t-test p-value {p:.3f}")
+        else:
+            st.write(f"Unpaired t-test p-value {p:.3f}")
+    else:
+        st.markdown(f"<p><em>One-way ANOVA p-value <strong>{p:.3f}<strong></em><br><br>Table of Tukey posthoc statistics:</p>",
+                    unsafe_allow_html=True)
+        st.table(info)
+        fname = f"posthoc_statistics_{value}.txt"
+        st.sidebar.download_button("Download posthoc statistics",
+                                   data=info.to_csv(sep="\t"),
+                                   file_name=fname)
     st.sidebar.markdown("**Please cite the editorial if using this web app to generate figures for publication**")